@@ -0,0 +1,107 @@
+import threading
+
+import pytest
+
+from zhinstlib.core.device_worker import DeviceWorker
+
+
+class StubDevice(object):
+    """
+    Records the calls it receives. The first call to wait blocks the worker until release is set, so that the next
+    calls stay queued.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def wait(self):
+        self.started.set()
+        self.release.wait(5)
+
+    def set_pid_enabled(self, pid_num=0, enabled=False):
+        self.calls.append(("enable", pid_num, enabled))
+
+    def set_aux_offset(self, aux=0, offset=0):
+        self.calls.append(("offset", aux, offset))
+
+    def get_aux_offset(self, aux=0):
+        self.calls.append(("get_offset", aux))
+        return 0.0
+
+
+@pytest.fixture
+def device():
+    return StubDevice()
+
+
+@pytest.fixture
+def worker(device):
+    worker = DeviceWorker(device, timeout=5)
+    yield worker
+    device.release.set()
+    worker.stop(timeout=5)
+
+
+def queue_while_busy(worker, device, calls):
+    """
+    Queues the calls while the worker is blocked, then lets them run.
+    :return: the futures of the calls.
+    """
+    worker.call("wait")
+    assert device.started.wait(5)
+    futures = [getattr(worker, kind)(*args) for kind, *args in calls]
+    device.release.set()
+    for future in futures:
+        future.result(5)
+    return futures
+
+
+def test_sets_of_different_nodes_keep_their_order(worker, device):
+    queue_while_busy(
+        worker,
+        device,
+        [
+            ("set", "set_pid_enabled", 0, False),
+            ("set", "set_aux_offset", 0, 1.5),
+            ("set", "set_pid_enabled", 0, True),
+        ],
+    )
+    assert device.calls == [
+        ("enable", 0, False),
+        ("offset", 0, 1.5),
+        ("enable", 0, True),
+    ]
+
+
+def test_consecutive_sets_of_a_node_are_coalesced(worker, device):
+    futures = queue_while_busy(
+        worker,
+        device,
+        [
+            ("set", "set_aux_offset", 0, 1.0),
+            ("set", "set_aux_offset", 0, 2.0),
+            ("set", "set_aux_offset", 1, 3.0),
+            ("set", "set_aux_offset", 1, 4.0),
+        ],
+    )
+    assert device.calls == [("offset", 0, 2.0), ("offset", 1, 4.0)]
+    assert all(future.done() and future.exception() is None for future in futures)
+
+
+def test_other_calls_close_the_coalescing_window(worker, device):
+    queue_while_busy(
+        worker,
+        device,
+        [
+            ("set", "set_aux_offset", 0, 1.0),
+            ("call", "get_aux_offset", 0),
+            ("set", "set_aux_offset", 0, 2.0),
+        ],
+    )
+    assert device.calls == [
+        ("offset", 0, 1.0),
+        ("get_offset", 0),
+        ("offset", 0, 2.0),
+    ]
@@ -0,0 +1,96 @@
+import h5py
+import numpy as np
+import pytest
+
+from zhinstlib.core.custom_data_containers import RingdownDataContainer
+from zhinstlib.data_processing.file_io import (
+    append_ringdown_data,
+    create_ringdown_file,
+    h5reader,
+)
+
+CLOCKBASE = 60e6
+DEMOD_PATH = "/dev1/demods/{}/sample.{}"
+SIGNALS = ("x", "y", "frequency")
+
+
+def daq_read(demods, ticks):
+    """
+    :return: the flat dictionary of a DAQ module read of one burst, with the same values for all the signals of a
+             demod: x = tick / 1000, y = -x and frequency = demod + 1.
+    """
+    values = {
+        "x": ticks / 1000,
+        "y": -ticks / 1000,
+    }
+    daq_data = dict()
+    for demod in demods:
+        for signal in SIGNALS:
+            value = values.get(signal, np.full(len(ticks), demod + 1.0))
+            daq_data[DEMOD_PATH.format(demod, signal)] = [
+                {"timestamp": ticks[np.newaxis, :], "value": value[np.newaxis, :]}
+            ]
+    return daq_data
+
+
+@pytest.fixture
+def ringdown_file(tmp_path):
+    """
+    A ringdown of two demods, written in two reads, with 3 samples lost between them.
+    """
+    sig_paths = [
+        DEMOD_PATH.format(demod, signal) for demod in (0, 1) for signal in SIGNALS
+    ]
+    savefile = create_ringdown_file(tmp_path / "chip" / "mode1", sig_paths, CLOCKBASE)
+    ticks = 5000 + 400 * np.arange(200, dtype=np.int64)
+    ticks[120:] += 3 * 400
+    append_ringdown_data(savefile, sig_paths, daq_read((0, 1), ticks[:120]))
+    append_ringdown_data(savefile, sig_paths, daq_read((0, 1), ticks[120:]))
+    return savefile, ticks
+
+
+def test_timestamps_are_int64_and_hard_linked(ringdown_file):
+    savefile, ticks = ringdown_file
+    assert savefile.name == "ringdown0000.h5"
+
+    with h5py.File(savefile, "r") as file:
+        assert file.attrs["clockbase"] == CLOCKBASE
+        for demod in (0, 1):
+            demod_path = DEMOD_PATH.format(demod, "{}").lstrip("/")
+            timestamp = file[demod_path.format("x") + "/timestamp"]
+            assert timestamp.dtype == np.int64
+            np.testing.assert_array_equal(timestamp[:], ticks)
+            # The timestamps are stored once, and linked under the other signals
+            for signal in ("y", "frequency"):
+                assert file[demod_path.format(signal) + "/timestamp"] == timestamp
+            np.testing.assert_array_equal(
+                file[demod_path.format("y") + "/value"][:], -ticks / 1000
+            )
+
+
+def test_index_lists_all_timestamp_links(ringdown_file):
+    savefile, _ = ringdown_file
+    h5index = h5reader(str(savefile), use_cache=False).read_index()
+    for demod in (0, 1):
+        for signal in SIGNALS:
+            path = DEMOD_PATH.format(demod, signal).lstrip("/") + "/timestamp"
+            assert h5index[path]["type"] == "dataset"
+
+
+def test_load_ringdown_round_trip(ringdown_file):
+    savefile, ticks = ringdown_file
+    ringdown_collection = RingdownDataContainer()
+    ringdown_collection.load_ringdown(savefile, "dev1/demods")
+
+    ringdown = ringdown_collection.ringdown(0)
+    for demod in (0, 1):
+        demod_data = ringdown.demod(demod)
+        np.testing.assert_array_equal(demod_data.x_quad, ticks / 1000)
+        np.testing.assert_array_equal(demod_data.y_quad, -ticks / 1000)
+        assert demod_data.frequency == demod + 1
+
+        time_axis = demod_data.timebase
+        assert time_axis.dt == 400
+        np.testing.assert_array_equal(time_axis.gaps, [[120, 3 * 400]])
+        np.testing.assert_array_equal(time_axis.ticks(), ticks)
+        np.testing.assert_allclose(demod_data.time_axis, (ticks - ticks[0]) / CLOCKBASE)
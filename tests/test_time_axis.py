@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from zhinstlib.core.custom_data_containers import TimeAxis
+from zhinstlib.data_processing.data_manip import chunk_boundaries, chunkify_timetrace
+
+CLOCKBASE = 60e6
+
+
+@pytest.fixture
+def gapped_ticks():
+    """
+    100 samples every 1000 ticks, with 5 samples lost after the 40th sample.
+    """
+    ticks = 123456 + 1000 * np.arange(100, dtype=np.int64)
+    ticks[40:] += 5 * 1000
+    return ticks
+
+
+def test_from_timestamps_round_trip_with_gap(gapped_ticks):
+    time_axis = TimeAxis.from_timestamps(gapped_ticks, CLOCKBASE)
+
+    assert len(time_axis) == len(gapped_ticks)
+    assert time_axis.dt == 1000
+    np.testing.assert_array_equal(time_axis.gaps, [[40, 5000]])
+    np.testing.assert_array_equal(time_axis.ticks(), gapped_ticks)
+    np.testing.assert_allclose(
+        time_axis.to_seconds(), (gapped_ticks - gapped_ticks[0]) / CLOCKBASE
+    )
+
+
+def test_getitem_across_gap(gapped_ticks):
+    time_axis = TimeAxis.from_timestamps(gapped_ticks, CLOCKBASE)
+
+    for start, stop in [(30, 60), (0, 40), (40, 100), (41, 90)]:
+        sliced = time_axis[start:stop]
+        np.testing.assert_array_equal(sliced.ticks(), gapped_ticks[start:stop])
+        # The origin is kept, so the times are still counted from the first sample of the trace
+        assert sliced.origin == gapped_ticks[0]
+    assert time_axis[30:60].has_gaps()
+    assert not time_axis[40:100].has_gaps()
+
+
+def test_getitem_only_contiguous_slices(gapped_ticks):
+    time_axis = TimeAxis.from_timestamps(gapped_ticks, CLOCKBASE)
+    with pytest.raises(Exception):
+        time_axis[::2]
+
+
+def test_rebase_across_gap(gapped_ticks):
+    sliced = TimeAxis.from_timestamps(gapped_ticks, CLOCKBASE)[30:60]
+
+    rebased = sliced.rebase()
+    np.testing.assert_array_equal(rebased.ticks(), gapped_ticks[30:60])
+    np.testing.assert_allclose(
+        rebased.to_seconds(), (gapped_ticks[30:60] - gapped_ticks[30]) / CLOCKBASE
+    )
+
+    rebased = sliced.rebase(gapped_ticks[50])
+    assert rebased.to_seconds()[20] == 0
+
+
+@pytest.mark.parametrize("gapped", [False, True])
+def test_index_at(gapped_ticks, gapped):
+    ticks = gapped_ticks if gapped else 123456 + 1000 * np.arange(100)
+    time_axis = TimeAxis.from_timestamps(ticks, CLOCKBASE)
+
+    for idx in [0, 1, 39, 40, 41, 99]:
+        # Exactly on a sample, and just after the previous one
+        assert time_axis.index_at(ticks[idx]) == idx
+        if idx > 0:
+            assert time_axis.index_at(ticks[idx - 1] + 1) == idx
+    assert time_axis.index_at(ticks[0] - 10**6) == 0
+    assert time_axis.index_at(ticks[-1] + 1) == len(ticks)
+
+
+def _old_chunkify_timetrace(signal, reference):
+    """
+    The chunkify_timetrace of the baseline, before the boundaries were split out in chunk_boundaries.
+    """
+    if signal.ndim == 1:
+        signal = signal[np.newaxis, :]
+    idxs = np.arange(0, signal.shape[1] - 1)
+
+    reference = np.where(reference >= reference.mean(), 1, 0).astype(int)
+
+    diff_ref = np.diff(reference)
+    diff_nonzero = diff_ref != 0
+
+    diff_ref, idxs = diff_ref[diff_nonzero], idxs[diff_nonzero]
+
+    signal_chunks = []
+    for ii in range(len(idxs) - 1):
+        if (diff_ref[ii] == -1) and (diff_ref[ii + 1] == 1):
+            signal_chunks.append(signal[:, idxs[ii] : idxs[ii + 1]])
+
+    if diff_ref[-1] == -1:
+        signal_chunks.append(signal[:, idxs[-1] :])
+
+    return signal_chunks
+
+
+@pytest.mark.parametrize("ends_low", [False, True])
+@pytest.mark.parametrize("starts_low", [False, True])
+def test_chunk_boundaries_match_old_chunkify_timetrace(starts_low, ends_low):
+    rng = np.random.default_rng(0)
+    levels = np.repeat(np.tile([1.0, 0.0], 6), rng.integers(50, 150, 12))
+    if starts_low:
+        levels = np.concatenate((np.zeros(60), levels))
+    if not ends_low:
+        levels = np.concatenate((levels, np.ones(80)))
+    reference = levels + 0.01 * rng.standard_normal(len(levels))
+    signal = np.vstack((rng.standard_normal(len(levels)), np.arange(len(levels))))
+
+    old_chunks = _old_chunkify_timetrace(signal, reference)
+    boundaries = chunk_boundaries(reference)
+    assert len(boundaries) == len(old_chunks) > 0
+    for (start, stop), old_chunk in zip(boundaries, old_chunks):
+        np.testing.assert_array_equal(signal[:, start:stop], old_chunk)
+    assert (boundaries[-1][1] is None) == ends_low
+
+    new_chunks = chunkify_timetrace(signal, reference)
+    for new_chunk, old_chunk in zip(new_chunks, old_chunks):
+        np.testing.assert_array_equal(new_chunk, old_chunk)
@@ -0,0 +1,184 @@
+"""
+Adapts the read cadence of a continuous DAQ acquisition, and checks the returned data for lost samples.
+"""
+
+import numpy as np
+
+# The keys of a burst header that mark lost or invalid data
+_loss_header_keys = ("dataloss", "blockloss", "invalidtimestamp")
+
+
+def choose_burst_duration(
+    sampling_rate,
+    signal_num,
+    target_burst_bytes=2**20,
+    min_duration=0.05,
+    max_duration=2.0,
+):
+    """
+    Chooses the burst duration so that each burst carries about target_burst_bytes for all the signals: long enough
+    that the overhead of each burst stays small at high rates, short enough that the live data are not delayed.
+    :param sampling_rate: the sampling rate of the DAQ grid, in Hz.
+    :param signal_num: the number of subscribed signals.
+    :param target_burst_bytes: the target size of a burst, in bytes.
+    :param min_duration: the shortest burst duration, in seconds.
+    :param max_duration: the longest burst duration, in seconds.
+    :return: the burst duration, in seconds.
+    """
+    # Each sample is stored as a float64 value and an int64 timestamp
+    burst_duration = target_burst_bytes / (16 * max(signal_num, 1) * sampling_rate)
+    return float(np.clip(burst_duration, min_duration, max_duration))
+
+
+class AcquisitionController(object):
+    """
+    Measures the time spent reading and saving each DAQ module read, and adapts the read interval: about
+    bursts_per_read bursts per read, but never so short that the reads and saves take more than target_load of the
+    time. It also counts the lost samples, from the discontinuities of the timestamps of each demodulator (within and
+    between reads), and the bursts whose header reports lost or invalid data.
+    """
+
+    def __init__(
+        self,
+        burst_duration=0.5,
+        read_interval=2.0,
+        min_read_interval=0.1,
+        max_read_interval=5.0,
+        bursts_per_read=4,
+        target_load=0.5,
+        gap_tolerance=0.01,
+        header_loss_flags=0,
+        smoothing=0.3,
+    ):
+        """
+        :param burst_duration: the burst duration of the DAQ module, in seconds.
+        :param read_interval: the first read interval, in seconds.
+        :param min_read_interval: the shortest read interval, in seconds.
+        :param max_read_interval: the longest read interval, in seconds. It must stay below the time the DAQ module
+                                  can buffer.
+        :param bursts_per_read: the number of bursts read at once, when the reads are fast enough.
+        :param target_load: the maximum fraction of the read interval spent reading and saving.
+        :param gap_tolerance: a step between two timestamps is a gap when it exceeds the sampling period by more than
+                              gap_tolerance sampling periods.
+        :param header_loss_flags: optional, bit mask of the header flags that mark lost data. With 0, only the
+                                  loss keys of the header are checked.
+        :param smoothing: the weight of the last read in the running average of the read and save time.
+        """
+        self.burst_duration = burst_duration
+        self.read_interval = read_interval
+        self.min_read_interval = min_read_interval
+        self.max_read_interval = max_read_interval
+        self.bursts_per_read = bursts_per_read
+        self.target_load = target_load
+        self.gap_tolerance = gap_tolerance
+        self.header_loss_flags = header_loss_flags
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the counters, e.g. at the start of an acquisition.
+        """
+        self.read_num = 0
+        self.sample_num = 0
+        self.lost_samples = 0
+        self.gap_num = 0
+        self.flagged_bursts = 0
+        self.processing_time = None
+        # Demod path -> [last timestamp, sampling period], both in clock ticks
+        self._demod_timing = dict()
+
+    def check_data(self, daq_data):
+        """
+        Counts the lost samples of a DAQ module read. Only one signal per demodulator is checked, since the signals
+        of a demodulator share the timestamps.
+        :param daq_data: the flat dictionary returned by the DAQ module read.
+        :return: the number of samples lost in this read.
+        """
+        lost_samples = 0
+        checked_demods = set()
+        for signal_path, signal_bursts in daq_data.items():
+            demod_path = signal_path.rsplit("/", 1)[0]
+            if demod_path in checked_demods or not isinstance(signal_bursts, list):
+                continue
+            checked_demods.add(demod_path)
+
+            timestamps = []
+            for signal_burst in signal_bursts:
+                self._check_header(signal_burst.get("header", dict()))
+                timestamps.append(np.ravel(signal_burst["timestamp"]))
+            if len(timestamps) == 0:
+                continue
+            timestamps = np.concatenate(timestamps).astype(np.int64)
+            if len(timestamps) == 0:
+                continue
+            self.sample_num += len(timestamps)
+            lost_samples += self._count_lost_samples(demod_path, timestamps)
+
+        self.lost_samples += lost_samples
+        return lost_samples
+
+    def _check_header(self, header):
+        flagged = any(header.get(key, False) for key in _loss_header_keys)
+        if self.header_loss_flags:
+            flagged |= bool(int(header.get("flags", 0)) & self.header_loss_flags)
+        if flagged:
+            self.flagged_bursts += 1
+
+    def _count_lost_samples(self, demod_path, timestamps):
+        last_timestamp, dt = self._demod_timing.get(demod_path, (None, None))
+        steps = np.diff(timestamps)
+        if len(steps) > 0:
+            dt = np.median(steps)
+        if last_timestamp is not None:
+            steps = np.concatenate(([timestamps[0] - last_timestamp], steps))
+        self._demod_timing[demod_path] = (timestamps[-1], dt)
+        if dt is None or dt <= 0:
+            return 0
+
+        gap_steps = steps[steps > (1 + self.gap_tolerance) * dt]
+        self.gap_num += len(gap_steps)
+        return int(np.round(gap_steps / dt).sum() - len(gap_steps))
+
+    def record_read(self, daq_data, read_duration, save_duration):
+        """
+        Checks a read for lost samples, and adapts the read interval.
+        :param daq_data: the flat dictionary returned by the DAQ module read.
+        :param read_duration: the time spent reading, in seconds.
+        :param save_duration: the time spent saving, in seconds.
+        :return: the new read interval, in seconds.
+        """
+        self.read_num += 1
+        self.check_data(daq_data)
+
+        processing_time = read_duration + save_duration
+        if self.processing_time is None:
+            self.processing_time = processing_time
+        else:
+            self.processing_time += self.smoothing * (
+                processing_time - self.processing_time
+            )
+
+        read_interval = max(
+            self.bursts_per_read * self.burst_duration,
+            self.processing_time / self.target_load,
+        )
+        self.read_interval = float(
+            np.clip(read_interval, self.min_read_interval, self.max_read_interval)
+        )
+        return self.read_interval
+
+    def get_load(self):
+        """
+        :return: the fraction of the read interval spent reading and saving.
+        """
+        if self.processing_time is None:
+            return 0
+        return self.processing_time / self.read_interval
+
+    def summary(self):
+        return (
+            f"Read every {self.read_interval:.2f} s ({100 * self.get_load():.0f}% busy), "
+            f"lost samples: {self.lost_samples} in {self.gap_num} gaps, "
+            f"flagged bursts: {self.flagged_bursts}"
+        )
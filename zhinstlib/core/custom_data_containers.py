@@ -1,8 +1,14 @@
 import numpy as np
 import h5py
-from zhinstlib.data_processing.data_manip import chunkify_timetrace
-from zhinstlib.data_processing.fitting_funcs import lin_rdown, lin_rdown_v2
-from scipy.optimize import curve_fit
+from collections import OrderedDict
+from math import ceil
+from zhinstlib.core.shared_arrays import attach_array, close_block
+from zhinstlib.data_processing.data_manip import chunk_boundaries
+from zhinstlib.data_processing.fitting_funcs import (
+    lin_rdown,
+    lin_rdown_v2,
+    get_jacobian,
+)
 
 
 class WaferFitContainer(object):
@@ -66,20 +72,44 @@ Here there are some nested classes:
 
 
 class WaferDataContainer(object):
-    def __init__(self, mode):
+    """
+    The chips are kept in the order they were last used. When a memory budget is set, the least recently used chips
+    are evicted when the loaded data exceed the budget. The fit results are not lost, since they are stored in the
+    WaferFitContainer, and the evicted chips can be reloaded from their files.
+    """
+
+    def __init__(self, mode, memory_budget=None):
+        """
+        :param mode: the mechanical mode, in python indexing.
+        :param memory_budget: optional, the maximum memory in bytes used by the loaded chips. Default is no limit.
+        """
         super(WaferDataContainer, self).__init__()
         self.mode = mode
-        self._chip_ringdowns = dict()
+        self.memory_budget = memory_budget
+        self._chip_ringdowns = OrderedDict()
+        self._chip_nbytes = dict()
+        self._evicted_chips = set()
         self._available_chips = []
 
     def add_ringdowns(self, chipID, ringdown_container):
+        """
+        :return: the list of the chips evicted to stay within the memory budget.
+        """
         if not isinstance(ringdown_container, RingdownDataContainer):
             print("The ringdowns passed must by an instance of RingdownContainer")
-            return
+            return []
 
         self._chip_ringdowns[chipID] = ringdown_container
+        self._chip_ringdowns.move_to_end(chipID)
+        self._chip_nbytes[chipID] = ringdown_container.nbytes()
+        self._evicted_chips.discard(chipID)
+        return self.evict()
 
     def get_ringdowns(self, chipID):
+        """
+        Returns the ringdowns of a chip, and marks the chip as the most recently used.
+        """
+        self._chip_ringdowns.move_to_end(chipID)
         return self._chip_ringdowns[chipID]
 
     def add_available_chip(self, chipID):
@@ -93,17 +123,66 @@ class WaferDataContainer(object):
         return self._available_chips
 
     def get_loaded_chips(self):
-        return self._chip_ringdowns.keys()
+        return list(self._chip_ringdowns.keys())
 
     def is_empty(self):
         isempty = True if len(self._chip_ringdowns) == 0 else True
         return
 
     def clear_data(self):
-        self._chip_ringdowns = dict()
+        self._chip_ringdowns = OrderedDict()
+        self._chip_nbytes = dict()
+        self._evicted_chips = set()
 
     def clear_chip(self, chipID):
         self._chip_ringdowns.pop(chipID)
+        self._chip_nbytes.pop(chipID)
+        self._evicted_chips.discard(chipID)
+
+    def update_chip_memory(self, chipID):
+        """
+        Updates the memory used by a chip, after its data have been modified (e.g. chunkified).
+        :return: the list of the evicted chips.
+        """
+        if chipID in self._chip_ringdowns:
+            self._chip_nbytes[chipID] = self._chip_ringdowns[chipID].nbytes()
+        return self.evict()
+
+    def get_memory_usage(self):
+        """
+        :return: the memory used by the loaded chips, in bytes.
+        """
+        return sum(self._chip_nbytes.values())
+
+    def set_memory_budget(self, memory_budget):
+        """
+        :param memory_budget: the maximum memory in bytes, or None for no limit.
+        :return: the list of the evicted chips.
+        """
+        self.memory_budget = memory_budget
+        return self.evict()
+
+    def evict(self):
+        """
+        Evicts the least recently used chips, until the memory is within budget. The most recently used chip is
+        never evicted.
+        :return: the list of the evicted chips.
+        """
+        evicted = []
+        if self.memory_budget is None:
+            return evicted
+        while (
+            len(self._chip_ringdowns) > 1
+            and self.get_memory_usage() > self.memory_budget
+        ):
+            chipID, _ = self._chip_ringdowns.popitem(last=False)
+            self._chip_nbytes.pop(chipID)
+            self._evicted_chips.add(chipID)
+            evicted.append(chipID)
+        return evicted
+
+    def was_evicted(self, chipID):
+        return chipID in self._evicted_chips
 
 
 class RingdownDataContainer(object):
@@ -134,36 +213,90 @@ class RingdownDataContainer(object):
         """
         return self._ringdowns[ringdown]
 
-    def load_ringdown(self, filepath, h5file_demodpath):
+    def nbytes(self):
+        """
+        :return: the memory used by the data of all the ringdowns, in bytes.
+        """
+        return sum(ringdown.nbytes() for ringdown in self._ringdowns)
+
+    def load_ringdown(self, filepath, h5file_demodpath, swmr=False):
         """
         :param filepath: the path of the h5 file
         :param h5file_demodpath: the path to the demodulators in the h5 dictionary
+        :param swmr: if True, the file is opened in SWMR read mode, e.g. while it is written by the acquisition. The
+                     ringdown can then be updated with refresh_ringdown.
         """
         ringdown_li_data = LockinData()
+        if swmr:
+            ringdown_li_data.source = (filepath, h5file_demodpath)
+        self._read_ringdown_file(ringdown_li_data, filepath, h5file_demodpath, swmr)
+
+        self.add_ringdown_sequence(ringdown_li_data)
+
+    def refresh_ringdown(self, ringdown_idx):
+        """
+        Reads the samples written since the last read, for a ringdown loaded in SWMR mode.
+        :return: True if new samples were read.
+        """
+        ringdown = self._ringdowns[ringdown_idx]
+        if ringdown.source is None:
+            return False
+        return self._read_ringdown_file(ringdown, *ringdown.source, swmr=True)
+
+    def refresh_live_ringdowns(self):
+        """
+        Refreshes all the ringdowns loaded in SWMR mode, which have not been chunkified yet.
+        :return: True if new samples were read.
+        """
+        refreshed = [
+            self.refresh_ringdown(ringdown_idx)
+            for ringdown_idx in range(len(self._ringdowns))
+        ]
+        return any(refreshed)
 
-        with h5py.File(filepath, "r") as file:
+    def _read_ringdown_file(self, ringdown_li_data, filepath, h5file_demodpath, swmr):
+        """
+        Reads the samples of the file that are not in the LockinData yet.
+        :return: True if new samples were read.
+        """
+        new_samples = False
+        with h5py.File(filepath, "r", swmr=swmr) as file:
+            # The files written before the clockbase was saved were all recorded with a HF2LI
+            clockbase = file.attrs.get("clockbase", 210e6)
             demod_templist = [int(key) for key in file[h5file_demodpath].keys()]
             for demod in demod_templist:
-                timestamp = file[
-                    h5file_demodpath + f"/{demod}/sample.frequency/timestamp"
-                ][:]
-                timestamp = (timestamp - timestamp[0]) / 210e6
-
-                frequency = file[h5file_demodpath + f"/{demod}/sample.frequency/value"][
-                    :
-                ].mean()
-                x_quad = file[h5file_demodpath + f"/{demod}/sample.x/value"][:]
-                y_quad = file[h5file_demodpath + f"/{demod}/sample.y/value"][:]
-
-                ringdown_li_data.create_demod(
-                    demod,
-                    time_axis=timestamp,
-                    x_quad=x_quad,
-                    y_quad=y_quad,
-                    frequency=frequency,
-                )
-
-        self.add_ringdown_sequence(ringdown_li_data)
+                demod_path = h5file_demodpath + f"/{demod}"
+                datasets = [
+                    file[demod_path + "/sample.frequency/timestamp"],
+                    file[demod_path + "/sample.frequency/value"],
+                    file[demod_path + "/sample.x/value"],
+                    file[demod_path + "/sample.y/value"],
+                ]
+                # While the file is written, the datasets are not necessarily flushed to the same length
+                sample_num = min(len(dataset) for dataset in datasets)
+                loaded_num = 0
+                if demod in ringdown_li_data.get_demods():
+                    loaded_num = len(ringdown_li_data.demod(demod).x_quad)
+                if sample_num <= loaded_num:
+                    continue
+
+                timestamp, frequency, x_quad, y_quad = [
+                    dataset[loaded_num:sample_num] for dataset in datasets
+                ]
+                if loaded_num == 0:
+                    ringdown_li_data.create_demod(
+                        demod,
+                        time_axis=TimeAxis.from_timestamps(timestamp, clockbase),
+                        x_quad=x_quad,
+                        y_quad=y_quad,
+                        frequency=frequency.mean(),
+                    )
+                else:
+                    ringdown_li_data.demod(demod).append_samples(
+                        timestamp, x_quad, y_quad, frequency
+                    )
+                new_samples = True
+        return new_samples
 
     def chunkify_ringdown(self, ringdown_idx, reference_demod):
         """
@@ -222,6 +355,8 @@ class LockinData(object):
     def __init__(self, chunkified=False):
         self._demods = dict()
         self._chunkified = chunkified
+        # (file path, demodulator path) of a file that is still being written, see RingdownDataContainer
+        self.source = None
 
     def create_demod(self, demod, time_axis, x_quad, y_quad, frequency):
         data_container = DemodulatorDataContainer(
@@ -242,6 +377,9 @@ class LockinData(object):
     def isChunkified(self):
         return self._chunkified
 
+    def nbytes(self):
+        return sum(data.nbytes() for data in self._demods.values())
+
     def chunkify_demods(self, reference_demod):
         """
         Chunkify the signal using the reference demodulator. Delete the reference signal afterwards.
@@ -250,27 +388,29 @@ class LockinData(object):
         :param reference_demod: the index of the reference demodulator, in python indexing
         :return list of the new LockinData
         """
-        reference_signal = self._demods[reference_demod].r_quad
-        chunk_num = len(
-            chunkify_timetrace(reference_signal, reference_signal)
-        )  # Trick to know the number of chunks in advance
+        reference_data = self._demods[reference_demod]
+        boundaries = chunk_boundaries(reference_data.r_quad)
         self.pop(reference_demod)  # Remove the demod from the demod dictionary.
 
         # Now chunk up the rest of the demods. First create a list of new empty Lockin containers.
-        lockin_list = [LockinData(chunkified=True) for _ in range(chunk_num)]
+        lockin_list = [LockinData(chunkified=True) for _ in range(len(boundaries))]
         for demod_num, data in self._demods.items():
-
-            # Stack up the data to chunk them up
-            data_stack = np.vstack((data.time_axis, data.x_quad, data.y_quad))
-
-            chunked_signals = chunkify_timetrace(data_stack, reference_signal)
-
-            for chunk_num, data_chunk in enumerate(chunked_signals):
-                data_chunk[0, :] -= data_chunk[
-                    0, 0
-                ]  # Set the beginning of time to be zero
+            demod_boundaries = _map_boundaries(
+                boundaries, reference_data.timebase, data.timebase
+            )
+            for chunk_num, (start, stop) in enumerate(demod_boundaries):
+                # Set the beginning of time to be zero
+                if isinstance(data.timebase, TimeAxis):
+                    chunk_time = data.timebase[start:stop].rebase()
+                else:
+                    chunk_time = data.timebase[start:stop] - data.timebase[start]
+                # Copy the quadratures, so that the full trace can be released
                 lockin_list[chunk_num].create_demod(
-                    demod_num, *data_chunk, data.frequency
+                    demod_num,
+                    chunk_time,
+                    data.x_quad[start:stop].copy(),
+                    data.y_quad[start:stop].copy(),
+                    data.frequency,
                 )
 
         return lockin_list
@@ -279,17 +419,18 @@ class LockinData(object):
         signal_demod = self._demods[demod_idx]
         success_flag = 0
         if not signal_demod.isFitted():
+            time_axis = signal_demod.time_axis
             if (timerange is not None) and (len(timerange) == 2):
                 timeaxmask = np.logical_and(
-                    signal_demod.time_axis >= timerange[0],
-                    signal_demod.time_axis <= timerange[1],
+                    time_axis >= timerange[0],
+                    time_axis <= timerange[1],
                 )
-                x_ax_fit = signal_demod.time_axis[timeaxmask]
+                x_ax_fit = time_axis[timeaxmask]
                 start_time = x_ax_fit[0]
                 y_ax_fit = signal_demod.r_quad[timeaxmask]
             else:
                 start_time = 0
-                x_ax_fit = signal_demod.time_axis
+                x_ax_fit = time_axis
                 y_ax_fit = signal_demod.r_quad
 
             x_ax_fit -= start_time
@@ -304,6 +445,8 @@ class LockinData(object):
             amp_guess = y_ax_fit[0]
             y0_guess = 0
 
+            from scipy.optimize import curve_fit
+
             try:
                 fitfunc = lin_rdown  # Here in case it is going to be replaced by some user-defined function
                 optimal_pars, cov_mat = curve_fit(
@@ -311,6 +454,7 @@ class LockinData(object):
                     x_ax_fit,
                     y_ax_fit,
                     p0=[gamma_guess, y0_guess, amp_guess],
+                    jac=get_jacobian(fitfunc),
                     bounds=([0, 0, 0], [np.inf, np.inf, np.inf]),
                     maxfev=10000,
                     gtol=1e-8,
@@ -327,16 +471,70 @@ class LockinData(object):
         return success_flag
 
 
+def _map_boundaries(boundaries, reference_timebase, timebase):
+    """
+    Maps the chunk boundaries found on the reference demodulator to another demodulator, which may be sampled at a
+    different rate: each boundary becomes the first sample of the demodulator at or after the boundary time.
+    :param boundaries: list of (start, stop) sample indices of the reference, as returned by chunk_boundaries.
+    :param reference_timebase: the TimeAxis, or the time array, of the reference.
+    :param timebase: the TimeAxis, or the time array, of the demodulator.
+    :return: the list of (start, stop) sample indices of the demodulator.
+    """
+    both_axes = isinstance(reference_timebase, TimeAxis) and isinstance(
+        timebase, TimeAxis
+    )
+    if both_axes:
+        same_sampling = (
+            reference_timebase.t0 == timebase.t0
+            and reference_timebase.dt == timebase.dt
+            and not reference_timebase.has_gaps()
+            and not timebase.has_gaps()
+        )
+        if same_sampling and len(reference_timebase) == len(timebase):
+            return boundaries
+        reference_time = reference_timebase.tick_at
+        index_at = timebase.index_at
+    else:
+        if isinstance(reference_timebase, TimeAxis):
+            reference_timebase = reference_timebase.to_seconds()
+        if isinstance(timebase, TimeAxis):
+            timebase = timebase.to_seconds()
+        if len(reference_timebase) == len(timebase) and np.array_equal(
+            reference_timebase, timebase
+        ):
+            return boundaries
+
+        def reference_time(idx):
+            return reference_timebase[idx]
+
+        def index_at(time):
+            return int(np.searchsorted(timebase, time, side="left"))
+
+    return [
+        (
+            index_at(reference_time(start)),
+            None if stop is None else index_at(reference_time(stop)),
+        )
+        for start, stop in boundaries
+    ]
+
+
 class DemodulatorDataContainer(object):
     """
     The most core container. It stores the quadratures, frequency and timestamp of a demodulator.
     """
 
+    # The arrays that can be moved to shared memory
+    _shared_attributes = ("timebase", "x_quad", "y_quad", "r_quad", "phase_quad")
+
     def __init__(self, time_axis=None, x_quad=None, y_quad=None, frequency=None):
+        """
+        :param time_axis: a TimeAxis, or an array with the time axis in seconds.
+        """
         self.x_quad = x_quad
         self.y_quad = y_quad
         self.frequency = frequency
-        self.time_axis = time_axis
+        self.timebase = time_axis
 
         self.r_quad, self.phase_quad = None, None
 
@@ -345,6 +543,23 @@ class DemodulatorDataContainer(object):
         # should be a list ordered as: [optimal fit pars, start time, stop time, fit function]
         self._fit_info = None
 
+        # The handles of the arrays in shared memory (owner process), and the attached blocks (worker process)
+        self._shared_handles = dict()
+        self._shared_blocks = []
+
+    @property
+    def time_axis(self):
+        """
+        The time axis in seconds. When the time axis is a TimeAxis, the array is built at each call.
+        """
+        if isinstance(self.timebase, TimeAxis):
+            return self.timebase.to_seconds()
+        return self.timebase
+
+    @time_axis.setter
+    def time_axis(self, time_axis):
+        self.timebase = time_axis
+
     def get_ampphase_quads(self, x_quad=None, y_quad=None):
         if x_quad is not None and y_quad is not None:
             complex_amp = x_quad + 1j * y_quad
@@ -354,6 +569,103 @@ class DemodulatorDataContainer(object):
         phase = np.angle(complex_amp)
         self.r_quad, self.phase_quad = r, phase
 
+    def append_samples(self, timestamps, x_quad, y_quad, frequency):
+        """
+        Appends new samples, e.g. read from a file that is still being written. The time axis must be a TimeAxis.
+        :param timestamps: the timestamps of the new samples, in clock ticks.
+        :param x_quad: the x quadrature of the new samples.
+        :param y_quad: the y quadrature of the new samples.
+        :param frequency: the frequency of the new samples. The frequency of the container is their running mean.
+        """
+        if not isinstance(self.timebase, TimeAxis):
+            raise Exception("Samples can only be appended to a TimeAxis time axis.")
+        loaded_num = len(self.x_quad)
+
+        self.timebase.extend(timestamps)
+        self.x_quad = np.concatenate((self.x_quad, x_quad))
+        self.y_quad = np.concatenate((self.y_quad, y_quad))
+        new_amp = x_quad + 1j * y_quad
+        self.r_quad = np.concatenate((self.r_quad, np.abs(new_amp)))
+        self.phase_quad = np.concatenate((self.phase_quad, np.angle(new_amp)))
+        self.frequency = (self.frequency * loaded_num + np.sum(frequency)) / len(
+            self.x_quad
+        )
+
+    def nbytes(self):
+        """
+        :return: the memory used by the time axis and the quadratures, in bytes.
+        """
+        arrays = [self.timebase, self.x_quad, self.y_quad, self.r_quad, self.phase_quad]
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def to_shared(self, registry):
+        """
+        Moves the arrays to shared memory blocks of a SharedArrayRegistry. The container holds a reference to each
+        block until release_shared is called.
+        :param registry: the SharedArrayRegistry of the owner process.
+        :return: the shared state, see shared_state.
+        """
+        for attribute in self._shared_attributes:
+            value = getattr(self, attribute)
+            if isinstance(value, np.ndarray) and attribute not in self._shared_handles:
+                handle, shared_array = registry.create(value)
+                setattr(self, attribute, shared_array)
+                self._shared_handles[attribute] = handle
+        return self.shared_state()
+
+    def shared_state(self):
+        """
+        :return: a small picklable dictionary, with the handles of the shared arrays and the other attributes, from
+                 which a worker process rebuilds the container with from_shared.
+        """
+        attributes = dict(
+            (name, value)
+            for name, value in vars(self).items()
+            if name not in self._shared_handles
+            and name not in ("_shared_handles", "_shared_blocks")
+        )
+        return {"handles": dict(self._shared_handles), "attributes": attributes}
+
+    @classmethod
+    def from_shared(cls, shared_state):
+        """
+        Rebuilds a container in a worker process, with arrays reading the shared memory blocks without any copy.
+        Call close_shared when the container is not used anymore.
+        :param shared_state: the dictionary returned by to_shared or shared_state.
+        """
+        container = cls()
+        vars(container).update(shared_state["attributes"])
+        for attribute, handle in shared_state["handles"].items():
+            array, block = attach_array(handle)
+            setattr(container, attribute, array)
+            container._shared_blocks.append(block)
+        return container
+
+    def close_shared(self):
+        """
+        Worker process: detaches the container from the shared memory blocks.
+        """
+        for attribute in self._shared_attributes:
+            if isinstance(getattr(self, attribute), np.ndarray):
+                setattr(self, attribute, None)
+        for block in self._shared_blocks:
+            close_block(block)
+        self._shared_blocks = []
+
+    def release_shared(self, registry, keep_data=True):
+        """
+        Owner process: releases the references of the container to its shared memory blocks.
+        :param registry: the SharedArrayRegistry used in to_shared.
+        :param keep_data: if True, the arrays are copied back to the private memory of the process. Otherwise, they
+                          are dropped.
+        """
+        for attribute, handle in self._shared_handles.items():
+            shared_array = getattr(self, attribute)
+            setattr(self, attribute, np.array(shared_array) if keep_data else None)
+            del shared_array
+            registry.release(handle)
+        self._shared_handles = dict()
+
     def set_mechmode_gamma(self, gamma):
         self._mechmode_gamma = gamma
 
@@ -374,3 +686,155 @@ class DemodulatorDataContainer(object):
 
     def set_fit_info(self, fit_info):
         self._fit_info = fit_info
+
+
+class TimeAxis(object):
+    """
+    The time axis of a uniformly sampled demodulator. Only the first timestamp t0 and the sampling period dt, both in
+    clock ticks, and the number of samples are stored. The array is built on demand. The interruptions of the sampling
+    (e.g. lost samples) are stored explicitly as gaps, so that the timestamps after them are still exact.
+    """
+
+    def __init__(self, t0, dt, n, clockbase, gaps=None, origin=None):
+        """
+        :param t0: the timestamp of the first sample, in clock ticks.
+        :param dt: the sampling period, in clock ticks.
+        :param n: the number of samples.
+        :param clockbase: the device clockbase, in Hz.
+        :param gaps: optional, (K, 2) array of [sample index, ticks added to dt before that sample] rows.
+        :param origin: optional, the timestamp in clock ticks corresponding to 0 s. Default is t0.
+        """
+        self.t0 = t0
+        self.dt = dt
+        self.n = n
+        self.clockbase = clockbase
+        self.gaps = np.zeros((0, 2)) if gaps is None else np.asarray(gaps, dtype=float)
+        self.origin = t0 if origin is None else origin
+
+    @classmethod
+    def from_timestamps(cls, timestamps, clockbase, gap_tolerance=0.01):
+        """
+        :param timestamps: the timestamps in clock ticks.
+        :param clockbase: the device clockbase, in Hz.
+        :param gap_tolerance: a step between two timestamps is a gap when it differs from the sampling period by more
+                              than gap_tolerance sampling periods.
+        :return: the TimeAxis.
+        """
+        timestamps = np.asarray(timestamps).astype(np.int64)
+        if len(timestamps) < 2:
+            t0 = int(timestamps[0]) if len(timestamps) else 0
+            return cls(t0, 1, len(timestamps), clockbase)
+
+        steps = np.diff(timestamps)
+        dt = np.median(steps)
+        is_gap = np.abs(steps - dt) > gap_tolerance * dt
+        dt = steps[~is_gap].mean()
+
+        gap_idxs = np.where(is_gap)[0]
+        gaps = np.column_stack((gap_idxs + 1, steps[gap_idxs] - dt))
+        return cls(int(timestamps[0]), dt, len(timestamps), clockbase, gaps)
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, item):
+        """
+        Only contiguous slices are supported. The origin is kept.
+        """
+        start, stop, step = item.indices(self.n)
+        if step != 1:
+            raise Exception("Only contiguous slices of a TimeAxis are supported.")
+        stop = max(start, stop)
+
+        in_slice = (self.gaps[:, 0] > start) & (self.gaps[:, 0] < stop)
+        gaps = self.gaps[in_slice] - [start, 0]
+        return TimeAxis(
+            self.tick_at(start),
+            self.dt,
+            stop - start,
+            self.clockbase,
+            gaps,
+            self.origin,
+        )
+
+    @property
+    def nbytes(self):
+        return self.gaps.nbytes
+
+    def has_gaps(self):
+        return len(self.gaps) > 0
+
+    def extend(self, timestamps, gap_tolerance=0.01):
+        """
+        Appends new samples to the time axis. The sampling period is not estimated again, unless there were less
+        than two samples.
+        :param timestamps: the timestamps of the new samples, in clock ticks.
+        :param gap_tolerance: see from_timestamps.
+        """
+        timestamps = np.asarray(timestamps).astype(np.int64)
+        if len(timestamps) == 0:
+            return
+        if self.n < 2:
+            previous_ticks = np.round(self.ticks()).astype(np.int64)
+            extended = TimeAxis.from_timestamps(
+                np.concatenate((previous_ticks, timestamps)),
+                self.clockbase,
+                gap_tolerance,
+            )
+            origin = extended.t0 if self.n == 0 else self.origin
+            vars(self).update(vars(extended))
+            self.origin = origin
+            return
+
+        steps = np.diff(timestamps, prepend=self.tick_at(self.n - 1))
+        gap_idxs = np.where(np.abs(steps - self.dt) > gap_tolerance * self.dt)[0]
+        new_gaps = np.column_stack((gap_idxs + self.n, steps[gap_idxs] - self.dt))
+        self.gaps = np.vstack((self.gaps, new_gaps))
+        self.n += len(timestamps)
+
+    def tick_at(self, idx):
+        """
+        :return: the timestamp of a sample, in clock ticks.
+        """
+        gap_ticks = self.gaps[self.gaps[:, 0] <= idx, 1].sum()
+        return self.t0 + self.dt * idx + gap_ticks
+
+    def index_at(self, tick):
+        """
+        :param tick: a timestamp, in clock ticks.
+        :return: the index of the first sample at or after the timestamp, between 0 and n.
+        """
+        if self.has_gaps():
+            ticks = self.ticks()
+            # Tolerance on the rounding of the ticks built from t0 and dt
+            return int(np.searchsorted(ticks, tick - 1e-6 * self.dt, side="left"))
+        idx = ceil((tick - self.t0) / self.dt - 1e-6)
+        return min(max(idx, 0), self.n)
+
+    def rebase(self, origin=None):
+        """
+        :param origin: the timestamp in clock ticks corresponding to 0 s. Default is the first sample.
+        :return: a new TimeAxis, with the new origin.
+        """
+        origin = self.t0 if origin is None else origin
+        return TimeAxis(self.t0, self.dt, self.n, self.clockbase, self.gaps, origin)
+
+    def ticks(self):
+        """
+        :return: the (N,) array of the timestamps, in clock ticks.
+        """
+        ticks = self.t0 + self.dt * np.arange(self.n, dtype=float)
+        if self.has_gaps():
+            gap_offsets = np.zeros(self.n)
+            np.add.at(gap_offsets, self.gaps[:, 0].astype(int), self.gaps[:, 1])
+            ticks += np.cumsum(gap_offsets)
+        return ticks
+
+    def to_seconds(self):
+        """
+        :return: the (N,) array of the times from the origin, in seconds.
+        """
+        ticks = self.ticks()
+        ticks -= self.origin
+        ticks /= self.clockbase
+        return ticks
@@ -0,0 +1,192 @@
+import threading
+from collections import deque
+from concurrent.futures import Future
+from PyQt5.QtCore import QObject, QCoreApplication, pyqtSignal
+
+
+class _DeviceCommand(object):
+    def __init__(self, function, args, kwargs, coalesce_key):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        # [future, timeout timer] of each submission merged in this command
+        self.submissions = []
+
+
+class DeviceWorker(QObject):
+    """
+    Runs the calls to a device on a dedicated thread, so that a slow data server never freezes the GUI. The calls are
+    queued and run in order. Each call returns a concurrent.futures.Future, and its outcome is also emitted with
+    signal_command_done or signal_command_failed, which the GUI receives on its own thread.
+
+    Consecutive sets of a node are coalesced: if the last queued call is a set of the same node, a new set replaces
+    its value, and all their futures get the same result. Any other call closes the coalescing window, so the calls
+    always reach the device in the order they were submitted. A call that is not done within its timeout fails with a
+    TimeoutError. The call cannot be interrupted once it has started, but if it times out while still queued, it is
+    not sent to the device.
+    """
+
+    # (future, result) and (future, exception)
+    signal_command_done = pyqtSignal(object, object)
+    signal_command_failed = pyqtSignal(object, object)
+    signal_connected = pyqtSignal(object)
+
+    def __init__(self, device=None, timeout=10.0, parent=None):
+        """
+        :param device: optional, the device, e.g. a ziVirtualDevice. It can also be created on the worker thread with
+                       connect_device.
+        :param timeout: the default timeout of the calls, in seconds.
+        """
+        super(DeviceWorker, self).__init__(parent)
+        self.device = device
+        self.timeout = timeout
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._stop_requested = False
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def submit(self, function, *args, coalesce_key=None, timeout=None, **kwargs):
+        """
+        Queues a function call on the worker thread.
+        :param function: the function.
+        :param coalesce_key: optional, a call is merged into the last queued call if it has the same key.
+        :param timeout: optional, the timeout in seconds. Default is the timeout of the worker.
+        :return: the Future of the call.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        future = Future()
+        with self._condition:
+            if self._stop_requested:
+                raise Exception("The device worker has been stopped.")
+            # Only the last queued call can be replaced, so that no call is moved before another one
+            if (
+                coalesce_key is not None
+                and self._queue
+                and self._queue[-1].coalesce_key == coalesce_key
+            ):
+                command = self._queue[-1]
+                command.function, command.args, command.kwargs = function, args, kwargs
+            else:
+                command = _DeviceCommand(function, args, kwargs, coalesce_key)
+                self._queue.append(command)
+
+            timer = threading.Timer(timeout, self._expire, (command, future))
+            timer.daemon = True
+            command.submissions.append([future, timer])
+            timer.start()
+            self._condition.notify()
+        return future
+
+    def call(self, method_name, *args, timeout=None, **kwargs):
+        """
+        Queues a call of a device method, e.g. call('get_available_demods').
+        :return: the Future of the call.
+        """
+        return self.submit(
+            self._call_device, method_name, *args, timeout=timeout, **kwargs
+        )
+
+    def set(self, method_name, *args, timeout=None, **kwargs):
+        """
+        Queues a call of a device set method, e.g. set('set_aux_offset', 0, 1.5). As for the set methods of
+        ziVirtualDevice, the value must be the last positional argument: the other arguments identify the node, and
+        consecutive queued sets of the same node are coalesced.
+        :return: the Future of the call.
+        """
+        coalesce_key = (method_name, args[:-1], tuple(sorted(kwargs.items())))
+        return self.submit(
+            self._call_device,
+            method_name,
+            *args,
+            coalesce_key=coalesce_key,
+            timeout=timeout,
+            **kwargs,
+        )
+
+    def connect_device(self, device_class, *args, timeout=None, **kwargs):
+        """
+        Creates the device on the worker thread, e.g. connect_device(PyQtziVirtualDevice, 'dev1347'). The device is
+        emitted with signal_connected, and used by the next calls.
+        :return: the Future of the device.
+        """
+        return self.submit(
+            self._create_device, device_class, *args, timeout=timeout, **kwargs
+        )
+
+    def _call_device(self, method_name, *args, **kwargs):
+        if self.device is None:
+            raise Exception("No device connected to the worker.")
+        return getattr(self.device, method_name)(*args, **kwargs)
+
+    def _create_device(self, device_class, *args, **kwargs):
+        device = device_class(*args, **kwargs)
+        application = QCoreApplication.instance()
+        if isinstance(device, QObject) and application is not None:
+            # The worker thread has no event loop: the device signals must be delivered on the GUI thread
+            device.moveToThread(application.thread())
+        self.device = device
+        self.signal_connected.emit(device)
+        return device
+
+    def _expire(self, command, future):
+        with self._condition:
+            if future.done():
+                return
+            future.set_exception(TimeoutError("The device did not answer in time."))
+        self.signal_command_failed.emit(future, future.exception())
+
+    def _complete(self, command, result, error):
+        finished = []
+        with self._condition:
+            for future, timer in command.submissions:
+                timer.cancel()
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+                finished.append(future)
+        for future in finished:
+            if error is None:
+                self.signal_command_done.emit(future, result)
+            else:
+                self.signal_command_failed.emit(future, error)
+
+    def pending(self):
+        """
+        :return: the number of queued calls.
+        """
+        with self._condition:
+            return len(self._queue)
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stop_requested:
+                    self._condition.wait()
+                if not self._queue:
+                    return
+                command = self._queue.popleft()
+                if all(future.done() for future, _ in command.submissions):
+                    # All the callers gave up waiting: do not send it to the device
+                    continue
+
+            try:
+                result, error = command.function(*command.args, **command.kwargs), None
+            except Exception as exception:
+                result, error = None, exception
+            self._complete(command, result, error)
+
+    def stop(self, timeout=None):
+        """
+        Runs the calls that are already queued, and stops the worker thread.
+        :param timeout: optional, the maximum time to wait for the thread, in seconds.
+        """
+        with self._condition:
+            self._stop_requested = True
+            self._condition.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
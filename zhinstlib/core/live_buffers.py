@@ -0,0 +1,159 @@
+import numpy as np
+import re
+
+
+class RingBuffer(object):
+    """
+    A fixed-size first-in first-out buffer backed by a preallocated numpy array. Once full, the oldest values are
+    overwritten.
+    """
+
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = int(capacity)
+        self._data = np.zeros(self.capacity, dtype=dtype)
+        self._write_idx = 0
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def extend(self, values):
+        values = np.asarray(values)
+        if len(values) >= self.capacity:
+            self._data[:] = values[-self.capacity :]
+            self._write_idx = 0
+            self._length = self.capacity
+            return
+
+        stop = self._write_idx + len(values)
+        if stop <= self.capacity:
+            self._data[self._write_idx : stop] = values
+        else:
+            first_part = self.capacity - self._write_idx
+            self._data[self._write_idx :] = values[:first_part]
+            self._data[: stop - self.capacity] = values[first_part:]
+        self._write_idx = stop % self.capacity
+        self._length = min(self._length + len(values), self.capacity)
+
+    def get(self):
+        """
+        :return: a copy of the buffer content, ordered from the oldest to the newest value.
+        """
+        if self._length < self.capacity:
+            return self._data[: self._length].copy()
+        return np.concatenate(
+            (self._data[self._write_idx :], self._data[: self._write_idx])
+        )
+
+    def clear(self):
+        self._write_idx = 0
+        self._length = 0
+
+
+class _DecimatedSignal(object):
+    """
+    The ring buffers of a single demodulator signal. The decimation keeps one sample every "decimation" samples, and
+    remembers where it stopped so that the decimation grid is continuous across the acquired bursts.
+    """
+
+    def __init__(self, capacity, decimation):
+        self.decimation = decimation
+        self.timestamp = RingBuffer(capacity)
+        self.value = RingBuffer(capacity)
+        self._offset = 0
+
+    def push(self, timestamp, value):
+        sample_num = len(value)
+        if sample_num == 0:
+            return
+        self.timestamp.extend(timestamp[self._offset :: self.decimation])
+        self.value.extend(value[self._offset :: self.decimation])
+        self._offset = (self._offset - sample_num) % self.decimation
+
+    def clear(self):
+        self.timestamp.clear()
+        self.value.clear()
+        self._offset = 0
+
+
+class LiveDemodBuffers(object):
+    """
+    Collects the data returned by a DAQ module read into fixed-size, decimated ring buffers, one per demodulator
+    signal. Used to display the data while they are being acquired, without reading them back from disk.
+    """
+
+    _path_pattern = re.compile(r"/demods/(\d+)/sample\.(\w+)$")
+
+    def __init__(self, capacity=20000, decimation=1, clockbase=1):
+        """
+        :param capacity: the number of (decimated) samples kept for each signal.
+        :param decimation: int, one sample every decimation samples is kept.
+        :param clockbase: the device clockbase, used to convert the timestamps in seconds.
+        """
+        self.capacity = capacity
+        self.decimation = max(int(decimation), 1)
+        self.clockbase = clockbase
+        self._signals = dict()
+        self._first_timestamp = None
+        self._updated = False
+
+    def feed(self, daq_data):
+        """
+        :param daq_data: the flat dictionary returned by the read method of a DAQ module.
+        """
+        for signal_path, signal_bursts in daq_data.items():
+            match = self._path_pattern.search(signal_path.lower())
+            if match is None:
+                continue
+            key = (int(match.group(1)), match.group(2))
+            if key not in self._signals:
+                self._signals[key] = _DecimatedSignal(self.capacity, self.decimation)
+
+            for signal_burst in signal_bursts:
+                timestamp = signal_burst["timestamp"][0, :]
+                if len(timestamp) == 0:
+                    continue
+                if self._first_timestamp is None:
+                    self._first_timestamp = timestamp[0]
+                self._signals[key].push(timestamp, signal_burst["value"][0, :])
+                self._updated = True
+
+    def get_demods(self):
+        return sorted(set(demod for demod, _ in self._signals.keys()))
+
+    def has_updates(self):
+        return self._updated
+
+    def get_quadrature(self, demod, quadrature):
+        """
+        :param demod: the demodulator, in python indexing.
+        :param quadrature: 0 for x, 1 for y, 2 for the amplitude, 3 for the phase.
+        :return: the time axis in seconds and the requested quadrature. None if the data are not available.
+        """
+        self._updated = False
+        if (demod, "x") not in self._signals or (demod, "y") not in self._signals:
+            return None
+        x_signal, y_signal = self._signals[(demod, "x")], self._signals[(demod, "y")]
+
+        sample_num = min(len(x_signal.value), len(y_signal.value))
+        if sample_num == 0:
+            return None
+        timestamp = x_signal.timestamp.get()[-sample_num:]
+        timestamp = (timestamp - self._first_timestamp) / self.clockbase
+
+        if quadrature == 0:
+            return timestamp, x_signal.value.get()[-sample_num:]
+        elif quadrature == 1:
+            return timestamp, y_signal.value.get()[-sample_num:]
+
+        x_quad = x_signal.value.get()[-sample_num:]
+        y_quad = y_signal.value.get()[-sample_num:]
+        if quadrature == 2:
+            return timestamp, np.hypot(x_quad, y_quad)
+        else:
+            return timestamp, np.arctan2(y_quad, x_quad)
+
+    def clear(self):
+        self._signals = dict()
+        self._first_timestamp = None
+        self._updated = False
@@ -0,0 +1,214 @@
+import numpy as np
+from scipy.signal import find_peaks
+from zhinstlib.data_processing.spectral_fits import (
+    find_lorentzian_peaks,
+    batch_lorentz_fit,
+)
+
+
+def find_peak_candidates(
+    freq_axis,
+    power,
+    max_peaks=5,
+    min_snr=10,
+    min_separation=0,
+    min_prominence_ratio=0.5,
+):
+    """
+    Finds the local maxima of a spectrum that stand out of the noise.
+    :param freq_axis: (N,) array, the frequency axis.
+    :param power: (N,) array, the power response.
+    :param max_peaks: the maximum number of peaks returned.
+    :param min_snr: the minimum prominence of a peak, in units of the background noise.
+    :param min_separation: the minimum frequency separation between two peaks. Of two closer peaks, only the highest
+                           is kept.
+    :param min_prominence_ratio: the minimum prominence of a peak, as a fraction of its height above the background.
+                                 The noise on the tail of a strong resonance is far larger than the background noise,
+                                 but its ripples only rise a little above the tail around them.
+    :return: array of the peak indices, sorted from the highest to the lowest peak.
+    """
+    background = np.median(power)
+    # Robust noise estimate: the median absolute deviation
+    noise = 1.4826 * np.median(np.abs(power - background))
+    noise = max(noise, np.finfo(float).tiny)
+
+    candidates, properties = find_peaks(power, prominence=min_snr * noise)
+    is_prominent = properties["prominences"] >= min_prominence_ratio * (
+        power[candidates] - background
+    )
+    candidates = candidates[is_prominent]
+    candidates = candidates[np.argsort(power[candidates])[::-1]]
+
+    peak_idxs = []
+    for candidate in candidates:
+        if len(peak_idxs) == max_peaks:
+            break
+        if all(
+            abs(freq_axis[candidate] - freq_axis[peak]) > min_separation
+            for peak in peak_idxs
+        ):
+            peak_idxs.append(candidate)
+    return np.array(peak_idxs, dtype=int)
+
+
+class ModeFinder(object):
+    """
+    Finds the mechanical modes with the sweeper. A coarse sweep over the whole range detects the resonances, and then
+    only a narrow window around each resonance is swept. The window is shrunk around the Lorentzian fit at each
+    iteration, until it matches the fitted linewidth. This needs far fewer points than a uniform sweep dense enough to
+    resolve the linewidth over the whole range.
+    """
+
+    def __init__(self, zinst_dev, demod=0, oscillator=0, sweep_kwargs=None):
+        """
+        :param zinst_dev: a ziVirtualDevice.
+        :param demod: the demodulator recording the response.
+        :param oscillator: the oscillator that is swept, and tuned to the modes.
+        :param sweep_kwargs: optional, dictionary passed to ziVirtualDevice.sweep_frequency.
+        """
+        self.zinst_dev = zinst_dev
+        self.demod = demod
+        self.oscillator = oscillator
+        self.sweep_kwargs = dict() if sweep_kwargs is None else sweep_kwargs
+        self.modes = np.empty((0, 3))
+        self.swept_points = 0
+
+    def sweep_power(self, start, stop, points):
+        """
+        :return: the frequency axis, and the power response x^2 + y^2.
+        """
+        freq_axis, x_quad, y_quad = self.zinst_dev.sweep_frequency(
+            start,
+            stop,
+            points,
+            demod=self.demod,
+            oscillator=self.oscillator,
+            **self.sweep_kwargs,
+        )
+        self.swept_points += len(freq_axis)
+        return np.asarray(freq_axis), np.square(x_quad) + np.square(y_quad)
+
+    def refine_mode(
+        self,
+        center,
+        half_span,
+        refine_points=100,
+        fit_span=5,
+        max_refinements=4,
+        background=None,
+    ):
+        """
+        Zooms on a resonance, until the swept window matches the fitted linewidth.
+        :param center: the first guess of the resonance frequency.
+        :param half_span: the half width of the first window.
+        :param refine_points: the number of points of each refined sweep.
+        :param fit_span: the final window is +- fit_span * FWHM around the resonance.
+        :param max_refinements: the maximum number of refined sweeps.
+        :param background: the background of the power response, e.g. from a wider sweep. The median of a zoomed
+                           window is part of the peak, and cannot be used. Default is the lowest edge of the first
+                           window.
+        :return: [freq0, FWHM, amp] array, or None if the fit failed at the first sweep.
+        """
+        fit_result = None
+        for _ in range(max_refinements):
+            freq_axis, power = self.sweep_power(
+                center - half_span, center + half_span, refine_points
+            )
+            if background is None:
+                background = min(power[0], power[-1])
+            guesses, _ = find_lorentzian_peaks(freq_axis, power - background)
+            window_fit, success = batch_lorentz_fit(
+                freq_axis, power, guesses, background=[background]
+            )
+            if not success[0]:
+                break
+            fit_result = window_fit[0]
+            center = fit_result[0]
+
+            new_half_span = fit_span * fit_result[1]
+            if new_half_span >= 0.8 * half_span:
+                # The window already matches the linewidth
+                break
+            half_span = new_half_span
+        return fit_result
+
+    def find_modes(
+        self,
+        start,
+        stop,
+        coarse_points=500,
+        max_modes=3,
+        min_snr=10,
+        refine_points=100,
+        fit_span=5,
+        max_refinements=4,
+        min_linewidths=5,
+        min_relative_amp=1e-3,
+    ):
+        """
+        :param start: the start frequency of the coarse sweep, in Hz.
+        :param stop: the stop frequency of the coarse sweep, in Hz.
+        :param coarse_points: the number of points of the coarse sweep.
+        :param max_modes: the maximum number of modes searched.
+        :param min_snr: the minimum height of a resonance above the background of the coarse sweep, in units of the
+                        background noise.
+        :param refine_points: the number of points of each refined sweep.
+        :param fit_span: the final windows are +- fit_span * FWHM around the resonances.
+        :param max_refinements: the maximum number of refined sweeps per mode.
+        :param min_linewidths: a mode closer than min_linewidths fitted FWHMs to a stronger mode is dropped.
+        :param min_relative_amp: a mode weaker than min_relative_amp times the strongest mode is dropped.
+        :return: (M, 3) array of [freq0, FWHM, amp] of the modes found, from the strongest to the weakest.
+        """
+        self.swept_points = 0
+        freq_axis, power = self.sweep_power(start, stop, coarse_points)
+        background = np.median(power)
+        coarse_step = abs(freq_axis[1] - freq_axis[0])
+
+        peak_idxs = find_peak_candidates(
+            freq_axis,
+            power,
+            max_peaks=max_modes,
+            min_snr=min_snr,
+            min_separation=2 * coarse_step,
+        )
+
+        modes = []
+        for peak_idx in peak_idxs:
+            # The coarse sweep only locates the resonance within a couple of steps
+            mode = self.refine_mode(
+                freq_axis[peak_idx],
+                2 * coarse_step,
+                refine_points=refine_points,
+                fit_span=fit_span,
+                max_refinements=max_refinements,
+                background=background,
+            )
+            if mode is not None:
+                modes.append(mode)
+
+        # The noise on the tail of a strong mode can still pass as a weak mode next to it
+        modes.sort(key=lambda mode: mode[2], reverse=True)
+        kept_modes = []
+        for mode in modes:
+            if mode[2] < min_relative_amp * modes[0][2]:
+                continue
+            if all(
+                abs(mode[0] - kept[0]) > min_linewidths * max(mode[1], kept[1])
+                for kept in kept_modes
+            ):
+                kept_modes.append(mode)
+
+        self.modes = np.array(kept_modes).reshape(-1, 3)
+        return self.modes
+
+    def tune_to_mode(self, mode_idx=0):
+        """
+        Sets the oscillator to the frequency of a mode found with find_modes.
+        :param mode_idx: the mode index, from the strongest mode.
+        :return: the frequency.
+        """
+        if mode_idx >= len(self.modes):
+            raise Exception("Mode not found. Run find_modes first.")
+        frequency = self.modes[mode_idx, 0]
+        self.zinst_dev.set_oscillator_freq(self.oscillator, frequency)
+        return frequency
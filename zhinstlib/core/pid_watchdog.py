@@ -0,0 +1,189 @@
+import numpy as np
+import time
+import threading
+import argparse
+from collections import deque
+
+
+class PIDWatchdog(object):
+    """
+    Headless service that watches the PID output streams, and resets the PIDs whose output rails. Instead of reading
+    the aux offsets one by one at fixed intervals, the PID streams are subscribed, and every block of data returned by
+    poll is checked at once, so that a rail is caught within one poll duration. The reset of all the railed PIDs is
+    sent to the device in a single transaction.
+    """
+
+    def __init__(
+        self,
+        zinst_dev,
+        pid_list=(0,),
+        limits=(-9, 9),
+        poll_duration=0.05,
+        holdoff=0.2,
+        stream_node="pids/{:d}/stream/value",
+        log_file=None,
+        rate_window=3600,
+    ):
+        """
+        :param zinst_dev: a ziVirtualDevice.
+        :param pid_list: the PIDs to watch. The PID n is assumed to drive the aux output n.
+        :param limits: the (lower, upper) output values outside which a PID is considered railed.
+        :param poll_duration: the duration of each poll, in seconds.
+        :param holdoff: after a reset, the samples of the reset PID are ignored for this time in seconds, to let the
+                        data acquired before the reset flush out.
+        :param stream_node: the streaming node of the PID output, relative to the device.
+        :param log_file: optional, file path to which the reset events are appended.
+        :param rate_window: the time window in seconds over which the reset rate is computed.
+        """
+        self.zinst_dev = zinst_dev
+        self.pid_list = list(pid_list)
+        self.limits = limits
+        self.poll_duration = poll_duration
+        self.holdoff = holdoff
+        self.log_file = log_file
+        self.rate_window = rate_window
+
+        base_address = f"/{zinst_dev.dev_name}/".lower()
+        self._stream_paths = {
+            base_address + stream_node.format(pid): pid for pid in self.pid_list
+        }
+        self._holdoff_until = dict().fromkeys(self.pid_list, 0.0)
+        self._reset_times = {pid: deque() for pid in self.pid_list}
+        self.reset_events = []
+
+        self._stop_requested = False
+        self._thread = None
+
+    def subscribe(self):
+        for stream_path in self._stream_paths:
+            self.zinst_dev.ziServer.subscribe(stream_path)
+        self.zinst_dev.ziServer.sync()
+
+    def unsubscribe(self):
+        for stream_path in self._stream_paths:
+            self.zinst_dev.ziServer.unsubscribe(stream_path)
+
+    def check_block(self, poll_data):
+        """
+        :param poll_data: the flat dictionary returned by poll.
+        :return: dictionary with the railed PIDs as keys, and the railed output values as values.
+        """
+        railed = dict()
+        now = time.monotonic()
+        for stream_path, stream_data in poll_data.items():
+            pid = self._stream_paths.get(stream_path.lower(), None)
+            if pid is None or now < self._holdoff_until[pid]:
+                continue
+            if isinstance(stream_data, dict):
+                stream_data = stream_data["value"]
+            values = np.ravel(stream_data)
+            if len(values) == 0:
+                continue
+
+            out_of_range = (values < self.limits[0]) | (values > self.limits[1])
+            if out_of_range.any():
+                railed[pid] = values[np.argmax(out_of_range)]
+        return railed
+
+    def reset(self, railed):
+        """
+        Resets all the railed PIDs with a single set, and logs the events.
+        :param railed: dictionary with the PIDs as keys, and the railed output values as values.
+        """
+        self.zinst_dev.reset_pids(list(railed.keys()))
+        now = time.monotonic()
+        for pid, value in railed.items():
+            self._holdoff_until[pid] = now + self.holdoff
+            self.log_event(pid, value, now)
+
+    def log_event(self, pid, value, event_time):
+        reset_times = self._reset_times[pid]
+        reset_times.append(event_time)
+        while reset_times[0] < event_time - self.rate_window:
+            reset_times.popleft()
+
+        tod = time.strftime("%H:%M:%S of %d/%m/%Y", time.localtime())
+        print(
+            f"Reset event on PID {pid} (output {value:.3f}) at {tod}. "
+            f"{len(reset_times)} resets in the last {self.rate_window / 60:.0f} minutes."
+        )
+        self.reset_events.append((time.time(), pid, value))
+        if self.log_file is not None:
+            with open(self.log_file, "a") as file:
+                file.write(f"{time.time():.3f}\t{pid}\t{value}\t{len(reset_times)}\n")
+
+    def get_reset_rate(self, pid):
+        """
+        :return: the number of resets per hour of the PID, over the last rate_window seconds.
+        """
+        reset_times = self._reset_times[pid]
+        now = time.monotonic()
+        while len(reset_times) and reset_times[0] < now - self.rate_window:
+            reset_times.popleft()
+        return len(reset_times) * 3600 / self.rate_window
+
+    def run(self, duration=None):
+        """
+        Watches the PIDs in a blocking fashion, until stop is called or the duration (in seconds) is elapsed.
+        """
+        self._stop_requested = False
+        self.subscribe()
+        start_time = time.monotonic()
+        try:
+            while not self._stop_requested:
+                if duration is not None and time.monotonic() - start_time > duration:
+                    break
+                poll_data = self.zinst_dev.ziServer.poll(
+                    self.poll_duration, 10, flat=True
+                )
+                railed = self.check_block(poll_data)
+                if railed:
+                    self.reset(railed)
+        finally:
+            self.unsubscribe()
+
+    def start(self):
+        """
+        Starts watching the PIDs on a separate thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_requested = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Resets the PIDs of a ZI lock-in when their output rails."
+    )
+    parser.add_argument("device", help="The device id, e.g. dev5152.")
+    parser.add_argument("--pids", type=int, nargs="+", default=[0])
+    parser.add_argument("--limits", type=float, nargs=2, default=[-9, 9])
+    parser.add_argument("--poll-duration", type=float, default=0.05)
+    parser.add_argument("--log-file", default=None)
+    args = parser.parse_args()
+
+    from zhinstlib.core.zinst_device import ziVirtualDevice
+
+    watchdog = PIDWatchdog(
+        ziVirtualDevice(args.device),
+        pid_list=args.pids,
+        limits=args.limits,
+        poll_duration=args.poll_duration,
+        log_file=args.log_file,
+    )
+    print(f"Watching PIDs {args.pids} of {args.device}. Press Ctrl+C to stop.")
+    try:
+        watchdog.run()
+    except KeyboardInterrupt:
+        print("Stopped listening.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import time
+from math import ceil, log, pi
+from pathlib import Path
+from zhinstlib.data_processing.file_io import create_ringdown_file, append_ringdown_data
+
+
+class RingdownSequencer(object):
+    """
+    Records a series of ringdowns per mode without user interaction. For each ringdown, the resonator is driven for
+    drive_time, the recording is started, the drive is cut off after pre_trigger, and the decay is recorded for
+    decay_time. Each ringdown is saved in its own file, in the same format as the wafer analyzer.
+
+    To reduce the dead time between ringdowns:
+    - the DAQ module of the next ringdown is created and configured while the current decay is being recorded;
+    - the drive settings of a mode are sent in a single set, and the device is synchronized only once per mode,
+      before the first recording. The drive cut-off does not need a sync, since the reference demodulator records
+      when it happens.
+    """
+
+    def __init__(
+        self,
+        zinst_dev,
+        drive_demod=0,
+        output_channel=0,
+        oscillator=0,
+        recorded_demods=(0, 1),
+        signals=("x", "y", "frequency"),
+        burst_duration=0.5,
+        read_interval=0.5,
+        data_callback=None,
+        demod_rates=None,
+    ):
+        """
+        :param zinst_dev: a ziVirtualDevice.
+        :param drive_demod: the demodulator whose output drives the resonator.
+        :param output_channel: the signal output of the drive.
+        :param oscillator: the oscillator of the drive demodulator.
+        :param recorded_demods: the demodulators that are recorded, in python indexing. They must include the
+                                reference demodulator used to chunkify the ringdowns.
+        :param signals: the recorded signals of each demodulator.
+        :param burst_duration: the burst duration of the DAQ module, in seconds.
+        :param read_interval: the interval between two reads of the DAQ module, in seconds.
+        :param data_callback: optional, function called with the dictionary of each DAQ module read, e.g. to display
+                              the data.
+        :param demod_rates: optional, the sampling rate of each recorded demodulator, e.g. from
+                            ziVirtualDevice.choose_demod_rates. By default, all are recorded at the same rate.
+        """
+        self.zinst_dev = zinst_dev
+        self.drive_demod = drive_demod
+        self.output_channel = output_channel
+        self.oscillator = oscillator
+        self.recorded_demods = list(recorded_demods)
+        self.signals = list(signals)
+        self.burst_duration = burst_duration
+        self.read_interval = read_interval
+        self.data_callback = data_callback
+        self.demod_rates = demod_rates
+        self.recorded_files = []
+        self._stop_requested = False
+        self._module_counter = 0
+
+    def request_stop(self):
+        """
+        The sequence stops after the ringdown being recorded.
+        """
+        self._stop_requested = True
+
+    def set_drive(self, frequency=None, voltage=None):
+        """
+        Sends all the drive settings in a single set. The drive stays disabled.
+        """
+        base_address = f"/{self.zinst_dev.dev_name}"
+        settings = [
+            (
+                base_address
+                + f"/sigouts/{self.output_channel}/enables/{self.drive_demod}",
+                0,
+            ),
+            (base_address + f"/sigouts/{self.output_channel}/on", 1),
+        ]
+        if frequency is not None:
+            settings.append((base_address + f"/oscs/{self.oscillator}/freq", frequency))
+        if voltage is not None:
+            output_range = self.zinst_dev.get_output_range(self.output_channel)
+            settings.append(
+                (
+                    base_address
+                    + f"/sigouts/{self.output_channel}/amplitudes/{self.drive_demod}",
+                    voltage / output_range,
+                )
+            )
+        self.zinst_dev.ziServer.set(settings)
+
+    def set_drive_enabled(self, enabled):
+        # Asynchronous set, no round trip to the device
+        self.zinst_dev.set_demod_output(
+            self.drive_demod, on_state=enabled, column=self.output_channel
+        )
+
+    def arm_module(self, record_duration):
+        """
+        Creates and configures a DAQ module, without executing it.
+        :return: the module name.
+        """
+        demod_dictionary = dict((demod, self.signals) for demod in self.recorded_demods)
+        # Explicit names: the default name depends on the number of modules, and two modules coexist here
+        module_name = f"ringdown_sequencer{self._module_counter}"
+        self._module_counter += 1
+        return self.zinst_dev.set_subscribe_daq(
+            demod_dictionary,
+            read_duration=record_duration,
+            burst_duration=self.burst_duration,
+            module_name=module_name,
+            demod_rates=self.demod_rates,
+        )
+
+    def release_module(self, module_name):
+        # The device keeps the module idle, and reuses it for the next ringdown
+        self.zinst_dev.remove_daqmodule(module_name)
+
+    def read_and_save(self, module_name, savefile):
+        daq_data = self.zinst_dev.daqmodules[module_name].read(True)
+        append_ringdown_data(
+            savefile,
+            self.zinst_dev.daqmodules_sigs[module_name],
+            daq_data,
+            self.zinst_dev.daqmodules_decimation[module_name],
+        )
+        if self.data_callback is not None:
+            self.data_callback(daq_data)
+
+    def run_mode(
+        self,
+        saving_dir,
+        ringdown_num=1,
+        frequency=None,
+        voltage=None,
+        drive_time=1.0,
+        pre_trigger=0.5,
+        decay_time=10.0,
+    ):
+        """
+        Records ringdown_num ringdowns of a mode.
+        :param saving_dir: the directory of the ringdown files, e.g. wafer/chip/mode1.
+        :param ringdown_num: the number of ringdowns.
+        :param frequency: optional, the drive frequency in Hz.
+        :param voltage: optional, the drive amplitude in V.
+        :param drive_time: the time during which the resonator is driven before each recording, in seconds.
+        :param pre_trigger: the time recorded before the drive is cut off, in seconds.
+        :param decay_time: the time recorded after the drive is cut off, in seconds.
+        :return: the list of the recorded files.
+        """
+        self._stop_requested = False
+        saving_dir = Path(saving_dir)
+        record_duration = pre_trigger + decay_time
+        recorded_files = []
+
+        self.set_drive(frequency, voltage)
+        next_module = self.arm_module(record_duration)
+        self.zinst_dev.sync()  # The only sync: the drive settings are applied before the first ringdown
+
+        for ringdown_idx in range(ringdown_num):
+            module_name, next_module = next_module, None
+
+            self.set_drive_enabled(True)
+            time.sleep(drive_time)
+
+            savefile = create_ringdown_file(
+                saving_dir,
+                self.zinst_dev.daqmodules_sigs[module_name],
+                clockbase=self.zinst_dev.clockbase,
+            )
+            self.zinst_dev.execute_daqmodule(module_name)
+            self._wait_and_save(module_name, savefile, pre_trigger)
+            self.set_drive_enabled(False)
+
+            # Prepare the next module while the decay is being recorded
+            if ringdown_idx < ringdown_num - 1 and not self._stop_requested:
+                next_module = self.arm_module(record_duration)
+
+            self._wait_and_save(module_name, savefile, None)
+            self.read_and_save(module_name, savefile)
+            self.release_module(module_name)
+            recorded_files.append(savefile)
+
+            if self._stop_requested:
+                break
+
+        if next_module is not None:
+            self.release_module(next_module)
+        self.recorded_files += recorded_files
+        return recorded_files
+
+    def _wait_and_save(self, module_name, savefile, duration):
+        """
+        Reads and saves the data every read_interval, for the given duration or, if None, until the module is done.
+        """
+        daq_module = self.zinst_dev.daqmodules[module_name]
+        start_time = time.time()
+        while not daq_module.finished():
+            elapsed = time.time() - start_time
+            if duration is not None and elapsed >= duration:
+                return
+            sleep_time = self.read_interval
+            if duration is not None:
+                sleep_time = min(sleep_time, duration - elapsed)
+            time.sleep(sleep_time)
+            self.read_and_save(module_name, savefile)
+
+    def run(self, chip_directory, mode_settings, ringdown_num=1, **kwargs):
+        """
+        Records the ringdowns of several modes of a chip.
+        :param chip_directory: the chip directory. The ringdowns of each mode are saved in chip_directory/mode#.
+        :param mode_settings: dictionary with the modes (python indexing) as keys, and the dictionaries of the
+                              run_mode arguments (e.g. frequency, voltage) as values.
+        :param ringdown_num: the number of ringdowns per mode.
+        :param kwargs: passed to run_mode, for all the modes.
+        :return: dictionary with the modes as keys, and the lists of the recorded files as values.
+        """
+        recorded = dict()
+        for mode, settings in mode_settings.items():
+            mode_kwargs = dict(kwargs)
+            mode_kwargs.update(settings)
+            recorded[mode] = self.run_mode(
+                Path(chip_directory) / f"mode{mode + 1}",
+                ringdown_num=ringdown_num,
+                **mode_kwargs,
+            )
+            if self._stop_requested:
+                break
+        self.set_drive_enabled(False)
+        return recorded
+
+
+def estimate_ringdown_time(Q, frequency, decades=2):
+    """
+    :return: the time in seconds for the amplitude of a mode to decay by the given number of decades, useful to choose
+             the decay_time of the sequencer.
+    """
+    gamma = 2 * pi * frequency / Q
+    return ceil(2 * decades * log(10) / gamma)
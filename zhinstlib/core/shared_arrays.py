@@ -0,0 +1,178 @@
+"""
+Transport of large arrays between processes through shared memory. The owner process (e.g. the analyzer) creates the
+blocks with a SharedArrayRegistry, and sends only the small handles to the worker processes, which attach to the same
+buffers without copying the data. The registry counts the references to each block, and unlinks the block when the
+last reference is released.
+"""
+
+import os
+import sys
+import weakref
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+
+SharedArrayHandle = namedtuple("SharedArrayHandle", ["name", "shape", "dtype"])
+
+# From python 3.13, the tracking of the blocks by the resource tracker can be disabled when opening them
+_has_track_argument = sys.version_info >= (3, 13)
+_is_tracked = os.name == "posix" and not _has_track_argument
+
+
+def _open_block(**kwargs):
+    """
+    Opens a SharedMemory that the resource tracker does not track. Otherwise, a worker process with its own resource
+    tracker would unlink the blocks it attached to when it exits, while the owner still uses them. The blocks are
+    unlinked by the registry instead.
+    """
+    if _has_track_argument:
+        return shared_memory.SharedMemory(track=False, **kwargs)
+    block = shared_memory.SharedMemory(**kwargs)
+    if _is_tracked:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+def _unlink_block(block):
+    if _is_tracked:
+        # SharedMemory.unlink unregisters the block from the resource tracker
+        resource_tracker.register(block._name, "shared_memory")
+    block.unlink()
+
+
+def _release_blocks(blocks, lingering):
+    for block, _ in blocks.values():
+        _close_block(block, lingering)
+        _unlink_block(block)
+    blocks.clear()
+
+
+class SharedArrayRegistry(object):
+    """
+    Owner side of the shared arrays: creates the shared memory blocks, and counts their references.
+    """
+
+    def __init__(self):
+        self._blocks = dict()  # Block name -> [SharedMemory, reference count]
+        self._lingering = []
+        # The blocks are not tracked by the resource tracker: unlink them when the registry is deleted or at exit
+        self._finalizer = weakref.finalize(
+            self, _release_blocks, self._blocks, self._lingering
+        )
+
+    def create(self, array):
+        """
+        Copies an array in a new shared memory block, with one reference.
+        :param array: the array.
+        :return: the handle of the block, and the array stored in the block.
+        """
+        array = np.asarray(array)
+        # A block cannot be empty
+        block = _open_block(create=True, size=max(array.nbytes, 1))
+        handle = SharedArrayHandle(block.name, array.shape, array.dtype.str)
+        shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared_array[...] = array
+        self._blocks[block.name] = [block, 1]
+        return handle, shared_array
+
+    def acquire(self, handle):
+        """
+        Adds a reference to a block, e.g. while a worker process uses it.
+        """
+        self._blocks[handle.name][1] += 1
+
+    def release(self, handle):
+        """
+        Removes a reference to a block. The block is unlinked when no reference is left.
+        """
+        block_ref = self._blocks[handle.name]
+        block_ref[1] -= 1
+        if block_ref[1] == 0:
+            self._blocks.pop(handle.name)
+            _close_block(block_ref[0], self._lingering)
+            _unlink_block(block_ref[0])
+
+    def release_all(self):
+        """
+        Unlinks all the blocks, whatever their reference count. To be called when the owner process exits.
+        """
+        _release_blocks(self._blocks, self._lingering)
+
+    def reference_count(self, handle):
+        return self._blocks[handle.name][1] if handle.name in self._blocks else 0
+
+    def nbytes(self):
+        """
+        :return: the size of all the blocks, in bytes.
+        """
+        return sum(block.size for block, _ in self._blocks.values())
+
+    def __len__(self):
+        return len(self._blocks)
+
+
+def attach_array(handle):
+    """
+    Worker side: attaches to a shared memory block, without copying it.
+    :param handle: the SharedArrayHandle.
+    :return: the array, and the SharedMemory. The SharedMemory must be closed with close_block when the array is not
+             used anymore.
+    """
+    block = _open_block(name=handle.name)
+    array = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=block.buf)
+    return array, block
+
+
+_lingering_blocks = []
+
+
+def close_block(block):
+    """
+    Closes the mapping of a block in the current process. If arrays still use the mapping, it is closed when they are
+    garbage collected.
+    """
+    _close_block(block, _lingering_blocks)
+
+
+def _close_block(block, lingering):
+    try:
+        block.close()
+    except BufferError:
+        # Numpy arrays still point to the buffer: keep the block alive, instead of failing in its __del__
+        lingering.append(block)
+    lingering[:] = [
+        lingering_block
+        for lingering_block in lingering
+        if not _try_close(lingering_block)
+    ]
+
+
+def _try_close(block):
+    try:
+        block.close()
+        return True
+    except BufferError:
+        return False
+
+
+@contextmanager
+def attached_arrays(handles):
+    """
+    Worker side: attaches to several blocks, and closes them on exit. The results that must outlive the context
+    have to be copied out of the arrays.
+    :param handles: iterable of SharedArrayHandle.
+    :return: the list of the arrays.
+    """
+    arrays, blocks = [], []
+    for handle in handles:
+        array, block = attach_array(handle)
+        arrays.append(array)
+        blocks.append(block)
+    try:
+        yield arrays
+    finally:
+        # Emptying the list also drops the references of the caller to the arrays
+        del arrays[:]
+        for block in blocks:
+            close_block(block)
@@ -1,8 +1,7 @@
-from zhinst.ziPython import ziDAQServer, ziListEnum
 import numpy as np
 from zhinstlib.helpers.helper_funcs import get_device_props
 import time
-from math import ceil
+from math import ceil, floor, log2, pi, sqrt
 from PyQt5.QtCore import QObject, pyqtSignal, pyqtSlot
 
 
@@ -17,6 +16,9 @@ class ziVirtualDevice(object):
                 device_props["apilevel"],
             ]
 
+        # zhinst is only imported when a device is created, so that the analysis never requires it
+        from zhinst.ziPython import ziDAQServer
+
         self.ziServer = ziDAQServer(*args, **kwargs)
         self.dev_name = dev_name
         self._baseaddress = f"/{dev_name}"
@@ -27,6 +29,16 @@ class ziVirtualDevice(object):
         self.clockbase = self.ziServer.getInt(self._baseaddress + "/clockbase")
         self.daqmodules = dict()
         self.daqmodules_sigs = dict()
+        # The decimation factor of each subscribed signal, applied when saving, see set_subscribe_daq
+        self.daqmodules_decimation = dict()
+        self._daqmodules_settings = dict()
+        # Modules removed with remove_daqmodule are kept configured, and reused by the next set_subscribe_daq
+        self._idle_daqmodules = []
+        self.max_idle_daqmodules = 2
+        self._streaming_nodes = None
+        self._sampling_rates = dict()
+        # The last rate requested by set_subscribe_daq for each demod, whose applied rate is in _sampling_rates
+        self._requested_rates = dict()
         self._daqstopRequested = False
 
         for key in self.demod_properties.keys():
@@ -52,6 +64,29 @@ class ziVirtualDevice(object):
 
         return node_names
 
+    def get_streaming_nodes(self, refresh=False):
+        """
+        :param refresh: if True, lists the nodes again instead of using the cached list.
+        :return: the set of the streaming nodes of the device, in lower case.
+        """
+        if self._streaming_nodes is None or refresh:
+            from zhinst.ziPython import ziListEnum
+
+            flags = (
+                ziListEnum.recursive | ziListEnum.absolute | ziListEnum.streamingonly
+            )
+            streaming_nodes = self.ziServer.listNodes(self._baseaddress, flags)
+            self._streaming_nodes = set(stream.lower() for stream in streaming_nodes)
+        return self._streaming_nodes
+
+    def refresh_device_cache(self):
+        """
+        Drops the cached streaming nodes and sampling rates, e.g. after they were changed from outside this object.
+        """
+        self._streaming_nodes = None
+        self._sampling_rates.clear()
+        self._requested_rates.clear()
+
     def request_stop(self):
         self._daqstopRequested = True
 
@@ -85,6 +120,70 @@ class ziVirtualDevice(object):
         else:
             return data[cmd]
 
+    def sweep_frequency(
+        self,
+        start=None,
+        stop=None,
+        points=100,
+        demod=0,
+        oscillator=0,
+        bandwidth=None,
+        settling_inaccuracy=1e-3,
+        averaging_samples=1,
+        timeout=600,
+        **kwargs,
+    ):
+        """
+        Runs a frequency sweep with the sweeper module, in a blocking fashion.
+        :param start: the start frequency in Hz.
+        :param stop: the stop frequency in Hz.
+        :param points: the number of frequency points, linearly spaced.
+        :param demod: the demodulator that is recorded.
+        :param oscillator: the oscillator that is swept.
+        :param bandwidth: the demodulator bandwidth in Hz. If None, the sweeper chooses it automatically.
+        :param settling_inaccuracy: the settling of the demodulator filter before recording each point.
+        :param averaging_samples: the number of samples averaged for each point.
+        :param timeout: the maximum duration of the sweep, in seconds.
+        :param kwargs: additional sweeper settings, e.g. "settling/time"=0.01.
+        :return: the frequency axis, the x and y quadratures.
+        """
+        sweeper = self.ziServer.sweep()
+        sweeper.set("device", self.dev_name)
+        sweeper.set("gridnode", f"oscs/{oscillator}/freq")
+        sweeper.set("start", start)
+        sweeper.set("stop", stop)
+        sweeper.set("samplecount", int(points))
+        sweeper.set("xmapping", 0)
+        if bandwidth is None:
+            sweeper.set("bandwidthcontrol", 2)
+        else:
+            sweeper.set("bandwidthcontrol", 0)
+            sweeper.set("bandwidth", bandwidth)
+        sweeper.set("settling/inaccuracy", settling_inaccuracy)
+        sweeper.set("averaging/sample", averaging_samples)
+        for keyword, value in kwargs.items():
+            sweeper.set(keyword, value)
+
+        demod_path = self._baseaddress + f"/demods/{demod}/sample"
+        sweeper.subscribe(demod_path)
+        sweeper.execute()
+        start_time = time.time()
+        while not sweeper.finished():
+            if time.time() - start_time > timeout:
+                sweeper.finish()
+                print("Sweep timed out, returning the partial data.")
+                break
+            time.sleep(0.05)
+
+        sweep_data = sweeper.read(True)
+        sweeper.unsubscribe("*")
+        sweeper.clear()
+
+        if demod_path not in sweep_data:
+            raise Exception("The sweeper returned no data.")
+        last_sweep = sweep_data[demod_path][-1][0]
+        return last_sweep["grid"], last_sweep["x"], last_sweep["y"]
+
     def set_pid_enabled(self, pid_num=0, enabled=False):
         if self._haspids:
             cmd = self._baseaddress + f"/pids/{pid_num}/enable"
@@ -92,6 +191,25 @@ class ziVirtualDevice(object):
         else:
             raise (Exception("Device has no PIDs"))
 
+    def reset_pids(self, pid_list=(0,), offset=0):
+        """
+        Resets the PIDs in a single transaction: all the PIDs are disabled, their aux offsets are set, and then they are
+        enabled again.
+        :param pid_list: the PIDs to reset. The PID n is assumed to drive the aux output n.
+        :param offset: the aux offset at which the PIDs restart.
+        """
+        if not self._haspids:
+            raise (Exception("Device has no PIDs"))
+
+        enable_cmd = self._baseaddress + "/pids/{:d}/enable"
+        offset_cmd = self._baseaddress + "/auxouts/{:d}/offset"
+        settings = (
+            [(enable_cmd.format(pid), 0) for pid in pid_list]
+            + [(offset_cmd.format(pid), offset) for pid in pid_list]
+            + [(enable_cmd.format(pid), 1) for pid in pid_list]
+        )
+        self.ziServer.set(settings)
+
     def set_subscribe_daq(
         self,
         demod_dictionary=dict(),
@@ -103,12 +221,21 @@ class ziVirtualDevice(object):
         autosaving_file_path=None,
         autosave_file_fmt="hdf5",
         triggernode="",
+        demod_rates=None,
         **kwargs,
     ):
         """
         Method that creates a daq module, adding it to the dictionary of the class daq modules. This method also sets
         the daq module settings. Returns the name of the module as specified in the daq modules dictionary, and a
         dictionary with the subscribed signals as keys. The dictionary items are empty lists.
+        If a module removed with remove_daqmodule is idle, it is reused instead: only the signals and the settings
+        that differ are sent again.
+        By default, all the demods are set to the highest of their sampling rates. With demod_rates, e.g. from
+        choose_demod_rates, each demod gets its own rate, rounded to a power of two fraction of the highest rate. The
+        device rounds the rates to its own discrete rates, so the applied rates are read back, and the module grid
+        follows the highest applied rate, so that the demods are time-aligned. A demod whose applied rate is a power
+        of two fraction of the grid rate can be decimated by this ratio when saved, see daqmodules_decimation, and the
+        number of grid columns is a multiple of all the ratios. The other demods are saved at the grid rate.
         """
         filefmt_dictionary = {"matlab": 0, "csv": 1, "xsm": 3, "hdf5": 4}
         daq_type_dict = {
@@ -155,11 +282,7 @@ class ziVirtualDevice(object):
             for sig in signals:
                 cmd_list.append(cmd_string.format(demod, sig))
 
-        flags = ziListEnum.recursive | ziListEnum.absolute | ziListEnum.streamingonly
-        streaming_nodes = self.ziServer.listNodes(self._baseaddress, flags)
-        streaming_nodes = [stream.lower() for stream in streaming_nodes]
-
-        daq_module = self.ziServer.dataAcquisitionModule()
+        streaming_nodes = self.get_streaming_nodes()
 
         for demod in demod_dictionary:
             demod_path = self._baseaddress + f"/demods/{demod}/sample"
@@ -167,53 +290,192 @@ class ziVirtualDevice(object):
                 print(f'Device {self.dev_name} does not have the requested demods.')
                 raise Exception("Demodulator streaming nodes unavailable.")
 
+        settings = dict()
         if triggernode:
-            daq_module.set("triggernode", self._baseaddress + f"/{triggernode}")
+            settings["triggernode"] = self._baseaddress + f"/{triggernode}"
 
+        decimations = dict.fromkeys(demod_dictionary, 1)
         if burst_duration is not None and read_duration is not None:
-            sampling_rate = max(
-                [self.get_sampling_rate(demod) for demod in demod_dictionary]
+            sampling_rates = self._apply_demod_rates(demod_dictionary, demod_rates)
+            sampling_rate = max(sampling_rates.values())
+            for demod, demod_rate in sampling_rates.items():
+                decimations[demod] = _rate_decimation(sampling_rate / demod_rate)
+
+            max_decimation = max(decimations.values())
+            num_cols = max_decimation * int(
+                ceil(sampling_rate * burst_duration / max_decimation)
             )
-
-            for demod in demod_dictionary:
-                self.set_sampling_rate(demod, sampling_rate)
-
-            num_cols = int(ceil(sampling_rate * burst_duration))
             if daq_type == 0:
                 num_bursts = int(ceil(read_duration / burst_duration))
-                daq_module.set("count", num_bursts)
-                daq_module.set("grid/cols", num_cols)
+                settings["count"] = num_bursts
+                settings["grid/cols"] = num_cols
 
             if interp_method != 4:
-                daq_module.set(
-                    "duration", burst_duration
-                )  # This parameter is read-only in exact acquisition
+                # This parameter is read-only in exact acquisition
+                settings["duration"] = burst_duration
 
-        daq_module.set("device", self.dev_name)
-        daq_module.set("type", daq_type)
-        daq_module.set("grid/mode", interp_method)
+        settings["device"] = self.dev_name
+        settings["type"] = daq_type
+        settings["grid/mode"] = interp_method
 
         for keyword, value in kwargs.items():
-            daq_module.set(keyword, value)
+            settings[keyword] = value
 
         if autosaving_file_path:
             saving_directory = str(autosaving_file_path.parent)
             filename = autosaving_file_path.name
-            daq_module.set("save/directory", saving_directory)
-            daq_module.set("save/filename", filename)
-            daq_module.set("save/fileformat", filefmt_idx)
-            daq_module.set("save/saveonread", True)
+            settings["save/directory"] = saving_directory
+            settings["save/filename"] = filename
+            settings["save/fileformat"] = filefmt_idx
+            settings["save/saveonread"] = True
         else:
-            daq_module.set("save/saveonread", False)
+            settings["save/saveonread"] = False
 
-        for requested_signal in cmd_list:
-            daq_module.subscribe(requested_signal)
+        daq_module, module_settings = self._acquire_daqmodule(cmd_list, settings)
+        for keyword, value in settings.items():
+            if keyword not in module_settings or module_settings[keyword] != value:
+                daq_module.set(keyword, value)
+                module_settings[keyword] = value
 
         self.daqmodules[module_name] = daq_module
         self.daqmodules_sigs[module_name] = cmd_list
+        # In exact mode there is no grid, the module returns the samples of each demod at its own rate
+        self.daqmodules_decimation[module_name] = dict(
+            (
+                cmd_string.format(demod, sig),
+                decimations[demod] if interp_method != 4 else 1,
+            )
+            for demod, signals in demod_dictionary.items()
+            for sig in signals
+        )
+        self._daqmodules_settings[module_name] = module_settings
 
         return module_name
 
+    def _apply_demod_rates(self, demod_dictionary, demod_rates=None):
+        """
+        Sets the sampling rates of the demods, and reads back the rates the device applied.
+        :param demod_rates: optional, dictionary with the requested rate of each demod. Default is the highest of the
+                            current rates for all the demods.
+        :return: dictionary with the demods as keys, and the applied sampling rates in Hz as values.
+        """
+        sampling_rates = dict(
+            (demod, self.get_sampling_rate(demod, use_cache=True))
+            for demod in demod_dictionary
+        )
+        if demod_rates is None:
+            requested_rates = dict.fromkeys(
+                demod_dictionary, max(sampling_rates.values())
+            )
+        else:
+            highest_rate = max(demod_rates[demod] for demod in demod_dictionary)
+            requested_rates = dict()
+            for demod in demod_dictionary:
+                ratio = highest_rate / demod_rates[demod]
+                requested_rates[demod] = highest_rate / 2 ** max(
+                    int(round(log2(ratio))), 0
+                )
+
+        # The applied rates are rounded by the device, so they are compared with the last request as well
+        changed_demods = [
+            demod
+            for demod in demod_dictionary
+            if sampling_rates[demod] != requested_rates[demod]
+            and self._requested_rates.get(demod) != requested_rates[demod]
+        ]
+        if not changed_demods:
+            return sampling_rates
+        for demod in changed_demods:
+            self.set_sampling_rate(demod, requested_rates[demod])
+        self.sync()
+        for demod in changed_demods:
+            sampling_rates[demod] = self.get_sampling_rate(demod)
+            self._requested_rates[demod] = requested_rates[demod]
+        return sampling_rates
+
+    def get_demod_bandwidth(self, demod=None):
+        """
+        :return: the -3 dB bandwidth of the demodulator filter in Hz, from its time constant and order.
+        """
+        base_cmd = self._baseaddress + f"/demods/{demod}"
+        timeconstant = self.ziServer.getDouble(base_cmd + "/timeconstant")
+        order = self.ziServer.getInt(base_cmd + "/order")
+        return sqrt(2 ** (1 / order) - 1) / (2 * pi * timeconstant)
+
+    def choose_demod_rates(
+        self,
+        demod_roles,
+        oversampling=8,
+        reference_resolution=1e-3,
+        frequency_rate=100,
+        max_ratio=64,
+    ):
+        """
+        Chooses the sampling rate of each demodulator from its role, for set_subscribe_daq(..., demod_rates=...):
+        - 'signal': the demodulator carries the ringdown, and is sampled at oversampling times its filter bandwidth;
+        - 'reference': the demodulator only carries the gate of the drive, and only needs to resolve its edges within
+          reference_resolution seconds;
+        - 'frequency': the demodulator only monitors the frequency, sampled at frequency_rate.
+        The rates are power of two fractions of the highest rate, at most max_ratio times slower. These are requested
+        rates: the device rounds them to its own discrete rates, and set_subscribe_daq reads back the applied ones.
+        :param demod_roles: dictionary with the demodulators (python indexing) as keys, and their roles as values.
+        :return: dictionary with the demodulators as keys, and the sampling rates in Hz as values.
+        """
+        required_rates = dict()
+        for demod, role in demod_roles.items():
+            if role == "signal":
+                required_rates[demod] = oversampling * self.get_demod_bandwidth(demod)
+            elif role == "reference":
+                required_rates[demod] = 1 / reference_resolution
+            elif role == "frequency":
+                required_rates[demod] = frequency_rate
+            else:
+                raise ValueError(
+                    f"The demod role {role} is not available. "
+                    f"Allowed values are ['signal', 'reference', 'frequency']"
+                )
+
+        highest_rate = max(required_rates.values())
+        demod_rates = dict()
+        for demod, required_rate in required_rates.items():
+            ratio = 2 ** floor(log2(highest_rate / required_rate))
+            demod_rates[demod] = highest_rate / min(ratio, max_ratio)
+        return demod_rates
+
+    def _acquire_daqmodule(self, cmd_list, settings):
+        """
+        Takes the idle module whose subscriptions overlap most with the requested signals, and subscribes it to the
+        requested signals only. A module is only reused if all the settings it was given are set again, so that no
+        setting of its previous use leaks into the new one. Otherwise, a new module is created.
+        :return: the module, and the dictionary of its current settings.
+        """
+        requested_signals = set(cmd_list)
+        candidates = [
+            idx
+            for idx, (_, _, module_settings) in enumerate(self._idle_daqmodules)
+            if set(module_settings).issubset(settings)
+        ]
+        if not candidates:
+            daq_module = self.ziServer.dataAcquisitionModule()
+            for requested_signal in cmd_list:
+                daq_module.subscribe(requested_signal)
+            return daq_module, dict()
+
+        best_idx = max(
+            candidates,
+            key=lambda idx: len(requested_signals & set(self._idle_daqmodules[idx][1])),
+        )
+        daq_module, subscribed_signals, module_settings = self._idle_daqmodules.pop(
+            best_idx
+        )
+        subscribed_signals = set(subscribed_signals)
+        for old_signal in subscribed_signals - requested_signals:
+            daq_module.unsubscribe(old_signal)
+        for requested_signal in cmd_list:
+            if requested_signal not in subscribed_signals:
+                daq_module.subscribe(requested_signal)
+        return daq_module, module_settings
+
     def read_daq_module(self, daq_module_name, clear_after_finish=False):
         daq_module = self.daqmodules[daq_module_name]
         daq_module_signals = self.daqmodules_sigs[daq_module_name]
@@ -243,8 +505,7 @@ class ziVirtualDevice(object):
             header_dictionary[signal] = temp_head_dicts
 
         if clear_after_finish:
-            self.daqmodules.pop(daq_module_name)
-            self.daqmodules_sigs.pop(daq_module_name)
+            self.remove_daqmodule(daq_module_name)
         return out_dictionary, (header_dictionary, read_dictionary)
 
     def execute_daqmodule(self, daq_module_name=None):
@@ -262,12 +523,39 @@ class ziVirtualDevice(object):
         self.daqmodules[daq_module_name].finish()
 
     def remove_daqmodule(self, daq_module_name=None):
+        """
+        Stops a module and removes it from the daqmodules. The module is kept idle, with its subscriptions and
+        settings, to be reused by set_subscribe_daq. Beyond max_idle_daqmodules idle modules, the module is cleared.
+        """
         if daq_module_name not in self.daqmodules.keys():
             raise Exception(
                 "The module has not been set and added to the daqmodules yet."
             )
         else:
-            self.daqmodules.pop(daq_module_name)
+            daq_module = self.daqmodules.pop(daq_module_name)
+            signals = self.daqmodules_sigs.pop(daq_module_name, [])
+            self.daqmodules_decimation.pop(daq_module_name, None)
+            module_settings = self._daqmodules_settings.pop(daq_module_name, dict())
+            daq_module.finish()
+            if len(self._idle_daqmodules) < self.max_idle_daqmodules:
+                self._idle_daqmodules.append((daq_module, signals, module_settings))
+            else:
+                daq_module.clear()
+
+    def clear_daqmodules(self):
+        """
+        Clears all the modules, both in use and idle, ending their threads.
+        """
+        for daq_module_name in list(self.daqmodules):
+            self.daqmodules[daq_module_name].finish()
+            self.daqmodules[daq_module_name].clear()
+        for daq_module, _, _ in self._idle_daqmodules:
+            daq_module.clear()
+        self.daqmodules.clear()
+        self.daqmodules_sigs.clear()
+        self.daqmodules_decimation.clear()
+        self._daqmodules_settings.clear()
+        self._idle_daqmodules = []
 
     def wait_daqmodule(self, daq_module_name=None):
         if daq_module_name not in self.daqmodules.keys():
@@ -349,6 +637,9 @@ class ziVirtualDevice(object):
     def set_sampling_rate(self, demod=None, sampling_rate=None):
         cmd = self._baseaddress + f"/demods/{demod}/rate"
         self.ziServer.setDouble(cmd, sampling_rate)
+        # The device rounds the rate to one of its discrete rates: the next get_sampling_rate reads it back
+        self._sampling_rates.pop(demod, None)
+        self._requested_rates.pop(demod, None)
 
     def get_available_demods(self):
         return len(self.ziServer.listNodes(self._baseaddress + "/demods"))
@@ -412,14 +703,33 @@ class ziVirtualDevice(object):
         else:
             raise (Exception('Device has no PIDs'))
 
-    def get_sampling_rate(self, demod=None):
+    def get_sampling_rate(self, demod=None, use_cache=False):
+        """
+        :param use_cache: if True, returns the last rate read by this object, if any, without asking the device. The
+                          rate is read again after each set_sampling_rate.
+        """
+        if use_cache and demod in self._sampling_rates:
+            return self._sampling_rates[demod]
         cmd = self._baseaddress + f"/demods/{demod}/rate"
-        return self.ziServer.getDouble(cmd)
+        self._sampling_rates[demod] = self.ziServer.getDouble(cmd)
+        return self._sampling_rates[demod]
 
     def sync(self):
         self.ziServer.sync()
 
 
+def _rate_decimation(ratio, tolerance=0.01):
+    """
+    :param ratio: the ratio between the grid rate and the sampling rate of a demod.
+    :return: the ratio rounded to an integer, if it is within tolerance of a power of two, else 1. A demod sampled
+             slower than the grid, but not by a power of two, is kept at the grid rate.
+    """
+    decimation = 2 ** max(int(round(log2(ratio))), 0)
+    if abs(ratio / decimation - 1) > tolerance:
+        return 1
+    return decimation
+
+
 class PyQtziVirtualDevice(ziVirtualDevice, QObject):
 
     signal_stop_daq = pyqtSignal()
@@ -431,3 +741,9 @@ class PyQtziVirtualDevice(ziVirtualDevice, QObject):
         )
 
         self.signal_stop_daq.connect(self.request_stop)
+
+    # A decorated slot follows the device when it is moved to another thread, e.g. when it is created by a
+    # DeviceWorker, while the connection to a plain method would stay in the thread that created the device
+    @pyqtSlot()
+    def request_stop(self):
+        super(PyQtziVirtualDevice, self).request_stop()
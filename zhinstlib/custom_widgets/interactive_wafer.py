@@ -1,75 +1,337 @@
-from PyQt5.QtWidgets import QWidget, QGridLayout, QLabel, QSpacerItem
+from PyQt5.QtWidgets import QWidget, QMenu, QApplication
 from PyQt5.QtWidgets import QSizePolicy
-from PyQt5.QtCore import pyqtSignal, Qt
-from zhinstlib.custom_widgets.mouse_interacting_lineedit import InteractingLineEdit
+from PyQt5.QtCore import pyqtSignal, Qt, QRectF, QSize
+from PyQt5.QtGui import QPainter, QColor, QBrush, QPen, QFont, QStaticText
+
+
+class ChipCell(object):
+    """
+    Lightweight chip of the InteractiveWafer. It has the same interface of the InteractingLineEdit that used to
+    represent a chip, but it is not a widget: it only stores its state, and asks the wafer to repaint its area when
+    the state changes.
+    """
+
+    def __init__(self, id, wafer):
+        self.id = id
+        self.rect = QRectF()
+        self._wafer = wafer
+        self.isclicked = False
+        self._data_uploaded = False
+        self._interaction_enabled = True
+        self._active_style = "standard"
+        self._text_lines = []
+        self.static_text = None
+
+    def _refresh(self):
+        self._wafer.update_cell(self)
+
+    def set_interacting(self, value):
+        self._interaction_enabled = value
+        self._refresh()
+
+    def unclick(self):
+        self.isclicked = False
+        self._refresh()
+        self._wafer.update_square(self.id)
+
+    def set_active_stylesheet(self, style_name):
+        if style_name not in self._wafer.styles.keys():
+            print("Invalid style list")
+        else:
+            self._active_style = style_name
+            self._refresh()
+
+    def get_style(self, hovered=False):
+        """
+        :return: the (brush, pen) tuple with which the chip must be painted.
+        """
+        style = self._wafer.styles[self._active_style]
+        if self.isclicked and "clicked" in style:
+            return style["clicked"]
+        elif hovered and self._interaction_enabled and "hover" in style:
+            return style["hover"]
+        return style["no hover"]
+
+    def isActivated(self):
+        return self._interaction_enabled
+
+    def setActivated(self, active):
+        self._interaction_enabled = active
+        if active is False:
+            self._active_style = "data missing"
+        else:
+            if self._data_uploaded:
+                self._active_style = "data loaded"
+            else:
+                self._active_style = "standard"
+        self._refresh()
+
+    def setDataUploaded(self, value):
+        if not self._interaction_enabled:
+            return
+
+        self._data_uploaded = value
+        if value is True:
+            self._active_style = "data loaded"
+        else:
+            self._active_style = "standard"
+        self._refresh()
+
+    def setChipDamaged(self, value):
+        if not self._interaction_enabled:
+            return
+
+        if value is True:
+            self._active_style = "damaged"
+        else:
+            self._active_style = "standard"
+        self._refresh()
+
+    def hasData(self):
+        return self._data_uploaded
+
+    def setText(self, text):
+        self._text_lines = [text] if text else []
+        self._update_static_text()
+
+    def append(self, text):
+        self._text_lines.append(text)
+        self._update_static_text()
+
+    def toPlainText(self):
+        return "\n".join(self._text_lines)
+
+    def _update_static_text(self):
+        if len(self._text_lines):
+            # The text layout is computed once here, and reused at every repaint
+            self.static_text = QStaticText("<br>".join(self._text_lines))
+            self.static_text.setTextFormat(Qt.RichText)
+            self.static_text.setTextWidth(self.rect.width() - 6)
+        else:
+            self.static_text = None
+        self._refresh()
 
 
 class InteractiveWafer(QWidget):
+    """
+    Map of the chips of a wafer. All the chips are painted by this widget in a single paint pass, and the mouse
+    events are mapped to the chips with the grid arithmetics, so that large wafers stay responsive.
+    """
 
     signal_id_changed = pyqtSignal(str)
     signal_id_damaged = pyqtSignal(str, bool)
 
+    _spacing = 3
+    _label_size = 14
+
     def __init__(self, rows=1, cols=1, fixed_size=100, *args, **kwargs):
         super(InteractiveWafer, self).__init__()
         self.rows = rows
         self.cols = cols
         self.fixed_size = fixed_size  # The size of the square side
         self.chip_collection = dict()
+        self._grid_ids = dict()
+        self._hovered = None
+        self._origin = (0, 0)
+        self.styles = self.make_styles()
+        self.label_font = QFont()
+        self.label_font.setBold(True)
+        self.label_font.setPixelSize(10)
+        self.text_font = QFont()
+        self.text_font.setPixelSize(10)
         self.do_grid()
         self.current_active = None
         self.setAutoFillBackground(False)
+        self.setMouseTracking(True)
+        self.setSizePolicy(QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding))
+
+    @staticmethod
+    def make_styles():
+        """
+        The brushes and pens of the chips, created once for all the chips.
+        """
+
+        def style(background, border_color, border_width):
+            pen = QPen(QColor(*border_color))
+            pen.setWidth(border_width)
+            pen.setJoinStyle(Qt.MiterJoin)
+            return QBrush(QColor(*background)), pen
+
+        return {
+            "standard": {
+                "no hover": style((204, 204, 204), (0, 0, 0), 1),
+                "hover": style((204, 204, 204), (255, 0, 0), 3),
+                "clicked": style((255, 183, 67), (0, 148, 49), 3),
+            },
+            "data loaded": {
+                "no hover": style((155, 225, 199), (0, 0, 0), 1),
+                "hover": style((155, 225, 199), (0, 118, 19), 3),
+                "clicked": style((158, 255, 245), (0, 148, 49), 3),
+            },
+            "data missing": {"no hover": style((150, 150, 150), (0, 0, 0), 1)},
+            "damaged": {
+                "no hover": style((255, 189, 193), (0, 0, 0), 1),
+                "hover": style((255, 189, 193), (255, 0, 0), 3),
+                "clicked": style((255, 86, 98), (0, 148, 49), 3),
+            },
+        }
 
     def do_grid(self):
-        layout = QGridLayout()
-        self.setLayout(layout)
-
-        for ii in range(1, self.rows + 1):
-            for jj in range(1, self.cols + 1):
-                if jj == 1:
-                    widgy = QLabel(str(ii))
-                    widgy.setStyleSheet(
-                        "font-weight: bold; color:black; font-size:10px"
-                    )
-                    layout.addWidget(widgy, ii + 1, jj, Qt.AlignVCenter)
-
-                    # This widget is used for centering purposes
-                    widgy = QLabel(str(ii))
-                    widgy.setStyleSheet("font-weight: bold; color:rgba(0,0,0,0)")
-                    layout.addWidget(widgy, ii + 1, jj + self.cols + 1, Qt.AlignVCenter)
-                if ii == 1:
-                    widgy = QLabel(chr(ord("A") + jj - 1))
-                    widgy.setStyleSheet(
-                        "font-weight: bold; color:black; font-size:10px"
-                    )
-                    layout.addWidget(widgy, ii, jj + 1, Qt.AlignHCenter)
-
-                    # This widget is used for centering purposes
-                    widgy = QLabel(chr(ord("A") + jj - 1))
-                    widgy.setStyleSheet("font-weight: bold; color:rgba(0,0,0,0)")
-                    layout.addWidget(widgy, ii + self.rows + 1, jj + 1, Qt.AlignHCenter)
-
-        for ii in range(2, self.rows + 2):
-            for jj in range(2, self.cols + 2):
-                if (ii != 2 and ii != self.rows + 1) or (
-                    jj != 2 and jj != self.cols + 1
+        for ii in range(self.rows):
+            for jj in range(self.cols):
+                # The four corners of the grid are not chips
+                if (ii != 0 and ii != self.rows - 1) or (
+                    jj != 0 and jj != self.cols - 1
                 ):
-                    temp_id = chr(ord("A") + jj - 2) + str(ii - 1)
-                    widgy = InteractingLineEdit(temp_id, self.fixed_size)
-                    self.chip_collection[temp_id] = widgy
-                    widgy.signal_widget_clicked.connect(self.update_square)
-                    widgy.signal_damaged.connect(self.marked_damaged)
-                    layout.addWidget(widgy, ii, jj)
-
-        # Add four spacers on the four square corners to center the chips
-        hor_spacer = QSpacerItem(40, 20, QSizePolicy.Expanding, QSizePolicy.Minimum)
-        ver_spacer = QSpacerItem(20, 40, QSizePolicy.Minimum, QSizePolicy.Expanding)
-
-        layout.addItem(hor_spacer, 1, 0)
-        layout.addItem(hor_spacer, 1, self.cols + 3)
-        layout.addItem(ver_spacer, 0, 1)
-        layout.addItem(ver_spacer, self.rows + 3, 1)
-        layout.setHorizontalSpacing(3)
-        layout.setVerticalSpacing(3)
+                    temp_id = chr(ord("A") + jj) + str(ii + 1)
+                    self.chip_collection[temp_id] = ChipCell(temp_id, self)
+                    self._grid_ids[(ii, jj)] = temp_id
+        self.layout_cells()
+
+    def grid_size(self):
+        """
+        :return: the width and height of the chip grid, labels included.
+        """
+        pitch = self.fixed_size + self._spacing
+        return (
+            self.cols * pitch - self._spacing + 2 * self._label_size,
+            self.rows * pitch - self._spacing + 2 * self._label_size,
+        )
+
+    def sizeHint(self):
+        return QSize(*self.grid_size())
+
+    def minimumSizeHint(self):
+        return self.sizeHint()
+
+    def layout_cells(self):
+        """
+        Computes the area of each chip, with the grid centered in the widget.
+        """
+        grid_width, grid_height = self.grid_size()
+        self._origin = (
+            max((self.width() - grid_width) // 2, 0) + self._label_size,
+            max((self.height() - grid_height) // 2, 0) + self._label_size,
+        )
+        pitch = self.fixed_size + self._spacing
+        for (ii, jj), chipID in self._grid_ids.items():
+            cell = self.chip_collection[chipID]
+            cell.rect = QRectF(
+                self._origin[0] + jj * pitch,
+                self._origin[1] + ii * pitch,
+                self.fixed_size,
+                self.fixed_size,
+            )
+            if cell.static_text is not None:
+                cell.static_text.setTextWidth(cell.rect.width() - 6)
+
+    def resizeEvent(self, event):
+        self.layout_cells()
+        super(InteractiveWafer, self).resizeEvent(event)
+
+    def chip_at(self, pos):
+        """
+        :param pos: the position in widget coordinates.
+        :return: the chip at the given position, or None.
+        """
+        pitch = self.fixed_size + self._spacing
+        x_pos, y_pos = pos.x() - self._origin[0], pos.y() - self._origin[1]
+        if x_pos < 0 or y_pos < 0:
+            return None
+        jj, x_rem = divmod(int(x_pos), pitch)
+        ii, y_rem = divmod(int(y_pos), pitch)
+        # The positions in the spacing between the chips do not belong to any chip
+        if x_rem >= self.fixed_size or y_rem >= self.fixed_size:
+            return None
+        chipID = self._grid_ids.get((ii, jj), None)
+        if chipID is None:
+            return None
+        return self.chip_collection[chipID]
+
+    def update_cell(self, cell):
+        self.update(cell.rect.toAlignedRect())
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        exposed = QRectF(event.rect())
+
+        painter.setFont(self.label_font)
+        painter.setPen(QColor(0, 0, 0))
+        pitch = self.fixed_size + self._spacing
+        for ii in range(self.rows):
+            label_rect = QRectF(
+                self._origin[0] - self._label_size,
+                self._origin[1] + ii * pitch,
+                self._label_size,
+                self.fixed_size,
+            )
+            if label_rect.intersects(exposed):
+                painter.drawText(label_rect, Qt.AlignCenter, str(ii + 1))
+        for jj in range(self.cols):
+            label_rect = QRectF(
+                self._origin[0] + jj * pitch,
+                self._origin[1] - self._label_size,
+                self.fixed_size,
+                self._label_size,
+            )
+            if label_rect.intersects(exposed):
+                painter.drawText(label_rect, Qt.AlignCenter, chr(ord("A") + jj))
+
+        painter.setFont(self.text_font)
+        for chipID, cell in self.chip_collection.items():
+            if not cell.rect.intersects(exposed):
+                continue
+            brush, pen = cell.get_style(hovered=(chipID == self._hovered))
+            half_width = pen.width() / 2
+            painter.setBrush(brush)
+            painter.setPen(pen)
+            painter.drawRect(
+                cell.rect.adjusted(half_width, half_width, -half_width, -half_width)
+            )
+            if cell.static_text is not None:
+                painter.setPen(QColor(0, 0, 0))
+                painter.drawStaticText(
+                    int(cell.rect.x()) + 3, int(cell.rect.y()) + 3, cell.static_text
+                )
+        painter.end()
+
+    def set_hovered(self, chipID):
+        if chipID == self._hovered:
+            return
+        previous = self._hovered
+        self._hovered = chipID
+        for hover_id in (previous, chipID):
+            if hover_id is not None:
+                self.update_cell(self.chip_collection[hover_id])
+
+    def mouseMoveEvent(self, event):
+        cell = self.chip_at(event.pos())
+        self.set_hovered(cell.id if cell is not None else None)
+        super(InteractiveWafer, self).mouseMoveEvent(event)
+
+    def leaveEvent(self, event):
+        self.set_hovered(None)
+        super(InteractiveWafer, self).leaveEvent(event)
+
+    def mousePressEvent(self, event):
+        cell = self.chip_at(event.pos())
+        if cell is None or not cell.isActivated():
+            super(InteractiveWafer, self).mousePressEvent(event)
+            return
+
+        if event.button() == Qt.LeftButton:
+            cell.isclicked = not cell.isclicked
+            self.update_cell(cell)
+            self.update_square(cell.id)
+        elif event.button() == Qt.RightButton:
+            menu = QMenu()
+            damaged = menu.addAction("Mark as damaged")
+            usable = menu.addAction("Mark as usable")
+            chosen = menu.exec_(event.globalPos())
+            if chosen == damaged:
+                self.marked_damaged(cell.id, True)
+            elif chosen == usable:
+                self.marked_damaged(cell.id, False)
 
     def update_square(self, id):
         if not self.current_active:
@@ -93,7 +355,9 @@ if __name__ == "__main__":
     import sys
 
     app = QApplication(sys.argv)
-    window = test()
+    window = InteractiveWafer(15, 15, 60)
+    window.chip_collection["B2"].setDataUploaded(True)
+    window.chip_collection["B2"].setText("f<sub>0</sub> = 1.000 MHz")
+    window.chip_collection["B2"].append("Q = 1.000 M")
     window.show()
     sys.exit(app.exec_())
-    # sys.exit()
@@ -0,0 +1,135 @@
+import numpy as np
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, pyqtSlot
+
+
+class _PlotTaskSignals(QObject):
+    signal_data_ready = pyqtSignal(int, object)
+
+
+class PlotDataTask(QRunnable):
+    """
+    Prepares the plot data of a single demodulator on a worker thread. The task checks at every step whether a newer
+    request has been issued in the meantime, and silently drops its work if that is the case.
+    """
+
+    def __init__(self, request_id, refresher, demod_container, quadrature, max_data):
+        super(PlotDataTask, self).__init__()
+        self.request_id = request_id
+        self.refresher = refresher
+        self.demod_container = demod_container
+        self.quadrature = quadrature
+        self.max_data = max_data
+        self.signals = _PlotTaskSignals()
+
+    def is_stale(self):
+        return not self.refresher.is_current(self.request_id)
+
+    def run(self):
+        if self.is_stale():
+            return
+
+        demod_data = self.demod_container
+        if self.quadrature == 0:
+            quadrature, scaling, ylabel = demod_data.x_quad, 1e3, "Amplitude (mV)"
+        elif self.quadrature == 1:
+            quadrature, scaling, ylabel = demod_data.y_quad, 1e3, "Amplitude (mV)"
+        elif self.quadrature == 2:
+            quadrature, scaling, ylabel = demod_data.r_quad, 1e3, "Amplitude (mV)"
+        else:
+            quadrature, scaling, ylabel = demod_data.phase_quad, 1, "Phase (rad)"
+
+        x_ax, y_ax = self.downsample(demod_data.time_axis, quadrature)
+        if self.is_stale():
+            return
+
+        # Scale only after downsampling, so that no full-size copy of the quadrature is ever allocated
+        if scaling != 1:
+            y_ax = y_ax * scaling
+
+        fit_data = None
+        if (self.quadrature == 2) and demod_data.isFitted():
+            fit_data = demod_data.get_fitted_data()
+            fit_data[1] *= scaling
+        if self.is_stale():
+            return
+
+        plot_data = {"x": x_ax, "y": y_ax, "ylabel": ylabel, "fit": fit_data}
+        self.signals.signal_data_ready.emit(self.request_id, plot_data)
+
+    def downsample(self, x, y):
+        """
+        Same resampling used by the DownsamplerPlotDataItem, done here so that the GUI thread receives data that are
+        already small enough to be plotted directly.
+        """
+        if len(x) > self.max_data:
+            new_x = np.linspace(x[0], x[-1], int(self.max_data))
+            new_y = np.interp(new_x, x, y)
+            return new_x, new_y
+        return x, y
+
+
+class PlotRefresher(QObject):
+    """
+    Coalesces and debounces the plot refresh requests. Only the most recent request is prepared, on a single worker
+    thread, and only the result of the most recent request is delivered through signal_plot_ready.
+    """
+
+    signal_plot_ready = pyqtSignal(object)
+
+    def __init__(self, debounce_ms=40, max_data=60000, parent=None):
+        super(PlotRefresher, self).__init__(parent)
+        self.max_data = max_data
+        self._latest_id = 0
+        self._pending = None
+
+        self._debounce_timer = QTimer(self)
+        self._debounce_timer.setSingleShot(True)
+        self._debounce_timer.setInterval(debounce_ms)
+        self._debounce_timer.timeout.connect(self._dispatch)
+
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+
+    def is_current(self, request_id):
+        return request_id == self._latest_id
+
+    def request(self, demod_container, quadrature):
+        """
+        :param demod_container: the DemodulatorDataContainer to be plotted
+        :param quadrature: the quadrature id, as in the quadrature radio buttons (0: x, 1: y, 2: r, 3: phase)
+        """
+        self._latest_id += 1
+        self._pending = (self._latest_id, demod_container, quadrature)
+        self._debounce_timer.start()
+
+    def cancel(self):
+        """
+        Invalidates all the pending and running requests.
+        """
+        self._latest_id += 1
+        self._pending = None
+        self._debounce_timer.stop()
+        self._pool.clear()
+
+    def wait_for_done(self, timeout_ms=-1):
+        return self._pool.waitForDone(timeout_ms)
+
+    @pyqtSlot()
+    def _dispatch(self):
+        if self._pending is None:
+            return
+        request_id, demod_container, quadrature = self._pending
+        self._pending = None
+
+        # Remove the tasks that have not started yet, they are stale anyway
+        self._pool.clear()
+        task = PlotDataTask(
+            request_id, self, demod_container, quadrature, self.max_data
+        )
+        task.signals.signal_data_ready.connect(self._deliver)
+        self._pool.start(task)
+
+    @pyqtSlot(int, object)
+    def _deliver(self, request_id, plot_data):
+        if self.is_current(request_id):
+            self.signal_plot_ready.emit(plot_data)
@@ -1,8 +1,8 @@
 from PyQt5.QtWidgets import QDialog, QFileDialog
-from PyQt5 import uic
 from PyQt5.QtCore import pyqtSignal
 from pathlib import Path
 import os
+from zhinstlib.helpers.ui_loader import load_ui
 
 
 class ChooseModeDialog(QDialog):
@@ -17,7 +17,7 @@ class ChooseModeDialog(QDialog):
         this_dir = Path(__file__).resolve()
         ui_file = this_dir.parents[1] / "ui_files" / "wafer_folder_selection.ui"
         super(ChooseModeDialog, self).__init__()
-        uic.loadUi(ui_file, self)
+        load_ui(ui_file, self)
 
         self.createButton.clicked.connect(self.create_load)
         self.loadButton.clicked.connect(self.create_load)
@@ -50,7 +50,7 @@ class WaferDialogGui(QDialog):
         this_dir = Path(__file__).resolve()
         ui_file = this_dir.parents[1] / "ui_files" / "wafer_dialog.ui"
         super(WaferDialogGui, self).__init__()
-        uic.loadUi(str(ui_file), self)
+        load_ui(ui_file, self)
 
         rows = self.rowsBox.setValue(5)
         cols = self.colsBox.setValue(5)
@@ -0,0 +1,185 @@
+"""
+Headless analysis of a whole wafer, without the GUI: the ringdowns of every chip and mode are loaded, chunkified and
+fitted, the Q factors are averaged, and the results are exported as in the wafer analyzer. The chips are processed in
+parallel on a pool of processes. Usage from the command line:
+
+    python -m zhinstlib.data_processing.batch_analysis path/to/wafer --reference-demod 2 --signal-demod 1
+"""
+
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from zhinstlib.core.custom_data_containers import RingdownDataContainer
+from zhinstlib.helpers.characterization_helpers import (
+    read_wafer_info,
+    find_wafer_chips,
+    write_wafer_results,
+)
+
+
+def analyze_chip(
+    wafer_directory, chipID, mode, zurich_id, reference_demod, signal_demod
+):
+    """
+    Loads, chunkifies and fits all the ringdowns of a chip and mode.
+    :param wafer_directory: the wafer directory.
+    :param chipID: the chip ID, e.g. 'C4'.
+    :param mode: the mode, in python indexing.
+    :param zurich_id: the lock-in ID, used to find the demodulators in the h5 files.
+    :param reference_demod: the reference demodulator used to chunkify the ringdowns, in python indexing.
+    :param signal_demod: the demodulator carrying the decays, in python indexing.
+    :return: (chipID, mode, frequency, Q, number of fitted decays, list of the fit failure messages). Frequency and
+             Q are None if no decay could be fitted.
+    """
+    ringdown_path = Path(wafer_directory) / chipID / f"mode{mode + 1}"
+    basepath = f"{zurich_id}/demods"
+
+    ringdown_collection = RingdownDataContainer()
+    for ringdown in sorted(ringdown_path.glob("*h5")):
+        ringdown_collection.load_ringdown(ringdown, basepath)
+
+    # The chunks of each ringdown are appended at the end, so the next raw ringdown is always the first one
+    for _ in range(ringdown_collection.get_ringdown_num()):
+        ringdown_collection.chunkify_ringdown(0, reference_demod)
+
+    failures = []
+    for ringdown_idx in range(ringdown_collection.get_ringdown_num()):
+        fit_successful, fail_string = ringdown_collection.fit_ringdown(
+            ringdown_idx, signal_demod
+        )
+        if not fit_successful:
+            failures.append(fail_string)
+
+    fitted_num = ringdown_collection.get_ringdown_num() - len(failures)
+    if fitted_num == 0:
+        return chipID, mode, None, None, 0, failures
+
+    frequency, Q = ringdown_collection.calculate_Qs(signal_demod)
+    if not (np.isfinite(frequency) and np.isfinite(Q)):
+        return chipID, mode, None, None, 0, failures
+    return chipID, mode, frequency, Q, fitted_num, failures
+
+
+def analyze_wafer(
+    wafer_directory,
+    reference_demod=1,
+    signal_demod=0,
+    modes=None,
+    workers=None,
+    write_results=True,
+):
+    """
+    Analyzes all the chips and modes of a wafer on a pool of processes.
+    :param wafer_directory: the wafer directory, containing wafer_info.txt.
+    :param reference_demod: the reference demodulator used to chunkify the ringdowns, in python indexing.
+    :param signal_demod: the demodulator carrying the decays, in python indexing.
+    :param modes: optional, list of the modes to analyze, in python indexing. Default is all the available modes.
+    :param workers: optional, the number of processes. Default is the number of processors.
+    :param write_results: if True, the wafer image and result_data.txt are written in results/mode# for each mode.
+    :return: dictionary with the modes as keys, and the lists of [chip ID, frequency, Q, additional info] as values.
+             A chip whose analysis raises, e.g. because of a corrupted file, is reported and skipped, so that the
+             results of the other chips are still written.
+    """
+    wafer_directory = Path(wafer_directory)
+    rows, cols, _, zurich_id = read_wafer_info(wafer_directory)
+    chips_per_mode = find_wafer_chips(wafer_directory)
+    if modes is None:
+        modes = sorted(chips_per_mode.keys())
+
+    tasks = [
+        (wafer_directory, chipID, mode, zurich_id, reference_demod, signal_demod)
+        for mode in modes
+        for chipID in sorted(chips_per_mode.get(mode, []))
+    ]
+
+    results = dict((mode, []) for mode in modes)
+    if len(tasks) == 0:
+        print(f"No chip data found in {wafer_directory}.")
+        return results
+
+    failed_chips = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        future_tasks = dict(
+            (executor.submit(analyze_chip, *task), task) for task in tasks
+        )
+        for future in as_completed(future_tasks):
+            exception = future.exception()
+            if exception is not None:
+                _, chipID, mode = future_tasks[future][:3]
+                print(
+                    f"Analysis of chip {chipID}, mode {mode + 1} failed: {exception!r}"
+                )
+                failed_chips.append((chipID, mode))
+                continue
+
+            chipID, mode, frequency, Q, fitted_num, failures = future.result()
+            for fail_string in failures:
+                print(fail_string, f"Occured at chip {chipID}, mode {mode + 1}.")
+            if Q is None:
+                print(f"No decay fitted for chip {chipID}, mode {mode + 1}.")
+                continue
+            print(
+                f"Chip {chipID}, mode {mode + 1}: f0 = {frequency / 1e6:.3f} MHz, "
+                f"Q = {Q / 1e6:.3f} M ({fitted_num} decays)."
+            )
+            results[mode].append([chipID, frequency, Q, None])
+
+    # The chips complete in any order
+    for data_list in results.values():
+        data_list.sort(key=lambda chip_data: chip_data[0])
+    if failed_chips:
+        failed_list = ", ".join(
+            f"{chipID} (mode {mode + 1})" for chipID, mode in failed_chips
+        )
+        print(f"The analysis failed for {len(failed_chips)} chips: {failed_list}.")
+
+    if write_results:
+        for mode, data_list in results.items():
+            result_dir = wafer_directory / "results" / f"mode{mode + 1}"
+            write_wafer_results(result_dir, (rows, cols), data_list)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit the ringdowns of all the chips and modes of a wafer, and export the results."
+    )
+    parser.add_argument(
+        "wafer_directory", help="The wafer folder, with wafer_info.txt."
+    )
+    parser.add_argument(
+        "--reference-demod",
+        type=int,
+        default=2,
+        help="The reference demodulator, numbered as in the lock-in (from 1).",
+    )
+    parser.add_argument(
+        "--signal-demod",
+        type=int,
+        default=1,
+        help="The demodulator carrying the decays, numbered as in the lock-in (from 1).",
+    )
+    parser.add_argument(
+        "--modes", type=int, nargs="+", default=None, help="The modes, from 1."
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    # No display is needed to save the wafer images
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+    analyze_wafer(
+        args.wafer_directory,
+        reference_demod=args.reference_demod - 1,
+        signal_demod=args.signal_demod - 1,
+        modes=None if args.modes is None else [mode - 1 for mode in args.modes],
+        workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -20,36 +20,41 @@ def chunkify_timetrace(signal, reference):
     return signal_chunks
 
 
-def chunkify_timetrace(signal, reference):
+def chunk_boundaries(reference):
     """
-    :param signal: can be a (N,) array or a (M,N) array
+    Finds the chunks of a trace from its reference: a chunk starts at a falling edge of the reference, and stops at
+    the next rising edge.
     :param reference: a (N,) TTL-like array containing the reference to chunkify
-    :return: list of chunkified signal
+    :return: list of (start, stop) index pairs of the chunks, to be used as slices. The stop of the last chunk is None
+             when the chunk extends to the end of the trace.
     """
-    if signal.ndim == 1:
-        signal = signal[np.newaxis, :]
-    idxs = np.arange(0, signal.shape[1] - 1)
-
     reference = np.where(reference >= reference.mean(), 1, 0).astype(int)
+    idxs = np.arange(0, len(reference) - 1)
 
     diff_ref = np.diff(reference)
     diff_nonzero = diff_ref != 0
 
     diff_ref, idxs = diff_ref[diff_nonzero], idxs[diff_nonzero]
 
-    signal_chunks = []
-    # TODO: clean up this horrible mess of if clauses
-    for ii in range(len(idxs) - 1):
-        if (diff_ref[ii] == -1) and (diff_ref[ii + 1] == 1):
-            signal_chunks.append(signal[:, idxs[ii] : idxs[ii + 1]])
+    chunk_starts = (diff_ref[:-1] == -1) & (diff_ref[1:] == 1)
+    boundaries = list(zip(idxs[:-1][chunk_starts], idxs[1:][chunk_starts]))
 
     if diff_ref[-1] == -1:
-        signal_chunks.append(signal[:, idxs[-1] :])
+        boundaries.append((idxs[-1], None))
+
+    return boundaries
 
+
+def chunkify_timetrace(signal, reference):
+    """
+    :param signal: can be a (N,) array or a (M,N) array
+    :param reference: a (N,) TTL-like array containing the reference to chunkify
+    :return: list of chunkified signal
+    """
     if signal.ndim == 1:
-        signal_chunks = signal_chunks[0]
+        signal = signal[np.newaxis, :]
 
-    return signal_chunks
+    return [signal[:, start:stop] for start, stop in chunk_boundaries(reference)]
 
 
 def special_chunkification(signal, reference, spike_SNR=1000, reference_percs=[1, 10]):
@@ -2,6 +2,11 @@ import numpy as np
 import h5py
 from pathlib import Path
 import shutil
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
 
 def remap_ZIfiles_dir(
@@ -11,6 +16,9 @@ def remap_ZIfiles_dir(
     target_dir=None,
     experiment_name="",
     init_counter=0,
+    mode="copy",
+    workers=1,
+    index_name="remapped_index.h5",
 ):
     """
     Function that remaps the h5 files saved by Zurich Instruments lock-in into a single folder. The h5 files are named
@@ -21,7 +29,18 @@ def remap_ZIfiles_dir(
     :param target_dir: The folder into which the files will be copied.
     :param experiment_name: optional, the name of the experiment to prepend to the h5 file names.
     :param init_counter: optional, the number ID of the first file name.
+    :param mode: optional, how the files are remapped. 'copy' copies the files. 'hardlink' creates hard links to the
+                 original files (same filesystem only, no data copied), and writes a manifest.txt with the original
+                 paths. 'vds' does not create any numbered file, but a single index_name file in which every
+                 numbered file is a group of virtual datasets pointing at the original files.
+    :param workers: optional, the number of threads used to copy the files in 'copy' mode.
+    :param index_name: optional, the name of the index file in 'vds' mode.
     """
+    if mode not in ["copy", "hardlink", "vds"]:
+        raise Exception(
+            "Please provide an accepted mode. Options are 'copy', 'hardlink' or 'vds'."
+        )
+
     if type(parent_fold) is str:
         parent_fold = Path(parent_fold)
 
@@ -45,24 +64,96 @@ def remap_ZIfiles_dir(
 
     if not target_dir.is_dir():
         target_dir.mkdir()
+    if len(list(target_dir.glob("*.h5"))) > 0:
+        print("Folder already contains files, copying aborted.")
+        return
+
+    remap_list = []
     for ii, sub_fold in enumerate(chosen_folders):
         fold_els = list(sub_fold.glob("*.h5"))
         if len(fold_els) == 1:
-            item_path = sub_fold / fold_els[0]
+            item_path = fold_els[0]
+            target_filename = _remapped_filename(init_counter + ii, experiment_name)
+            remap_list.append((item_path, target_dir / target_filename))
+
+    if mode == "copy":
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # list() propagates the exceptions of the copies
+                list(executor.map(lambda paths: shutil.copy(*paths), remap_list))
+        else:
+            for item_path, target_filename in remap_list:
+                shutil.copy(item_path, target_filename)
+    elif mode == "hardlink":
+        with open(target_dir / "manifest.txt", "w") as manifest:
+            for item_path, target_filename in remap_list:
+                os.link(item_path, target_filename)
+                manifest.write(f"{target_filename.name}\t{item_path.resolve()}\n")
+    else:
+        _write_vds_index(target_dir / index_name, remap_list)
 
-            target_filename = "{:d}".format(init_counter + ii)
-            if len(target_filename) == 1:
-                target_filename = experiment_name + "0" + target_filename
 
-            target_filename += ".h5"
+def _remapped_filename(counter, experiment_name):
+    target_filename = "{:d}".format(counter)
+    if len(target_filename) == 1:
+        target_filename = experiment_name + "0" + target_filename
 
-            target_filename = target_dir / target_filename
+    return target_filename + ".h5"
 
-            if ii == 0 and len(list(target_dir.glob("*.h5"))) > 0:
-                print("Folder already contains files, copying aborted.")
-                break
 
-            shutil.copy(item_path, target_filename)
+# Version of the h5reader index, stored in its sidecar cache
+_index_version = 2
+
+
+def _visit_linked_items(group, callback, _prefix="", _ancestors=()):
+    """
+    Like h5py visititems, but an object with several hard links is visited under each of its paths, e.g. the timestamp
+    datasets shared by the signals of a demodulator, see create_ringdown_file. Soft and external links are not
+    followed, as with visititems.
+    :param group: the h5py group or file.
+    :param callback: function called with the path relative to group, and the object.
+    """
+    _ancestors = _ancestors + (group.id,)
+    for name in group:
+        if not isinstance(group.get(name, getlink=True), h5py.HardLink):
+            continue
+        obj = group[name]
+        if isinstance(obj, h5py.Group) and obj.id in _ancestors:
+            # A hard link to one of its own parents would never end
+            continue
+        path = _prefix + name
+        callback(path, obj)
+        if isinstance(obj, h5py.Group):
+            _visit_linked_items(obj, callback, path + "/", _ancestors)
+
+
+def _write_vds_index(index_file, remap_list):
+    """
+    Writes an h5 file in which each remapped file is a group, containing one virtual dataset for each dataset of the
+    original file. Only the metadata of the original files are read. The file attributes of the groups store the
+    original paths.
+    """
+    with h5py.File(index_file, "w") as index:
+        for item_path, target_filename in remap_list:
+            item_path = item_path.resolve()
+            file_group = index.create_group(target_filename.stem)
+            file_group.attrs["source_file"] = str(item_path)
+
+            dataset_list = []
+
+            def collect_datasets(name, obj):
+                if isinstance(obj, h5py.Dataset):
+                    dataset_list.append((name, obj.shape, obj.dtype))
+
+            with h5py.File(item_path, "r") as source:
+                _visit_linked_items(source, collect_datasets)
+
+            for dset_name, shape, dtype in dataset_list:
+                layout = h5py.VirtualLayout(shape=shape, dtype=dtype)
+                layout[...] = h5py.VirtualSource(
+                    str(item_path), dset_name, shape=shape, dtype=dtype
+                )
+                file_group.create_virtual_dataset(dset_name, layout)
 
 
 def get_h5_signals(h5file):
@@ -112,67 +203,114 @@ def get_h5_signals(h5file):
 
 class h5reader:
     """
-    Class to quickly check all the available paths in a hdf5 file.
+    Class to quickly check all the available paths in a hdf5 file. The tree is built together with an index of the
+    datasets (shape, dtype and chunking), which is cached in a json sidecar file next to the hdf5 file, and reused as
+    long as the hdf5 file is not modified.
     """
 
-    def __init__(self, h5file):
+    sidecar_suffix = ".index.json"
+
+    def __init__(self, h5file, use_cache=True):
         self.h5file = h5file
-        self.h5file_instance = None
+        self.use_cache = use_cache
         self.h5tree = None
-        self.queue = None
+        self.h5index = None
 
     def set_h5file(self, new_h5path):
         self.h5file = new_h5path
+        self.h5tree = None
+        self.h5index = None
 
     def read_tree(self, depth=1000):
         """
-        Build the tree with breadth-first search.
+        Build the tree of the datasets. The groups deeper than depth are not expanded, and are listed in the tree.
         """
-        self.h5file_instance = h5py.File(self.h5file, "r")
-        self.h5tree = []
-
-        self.queue = list(self.h5file_instance.keys())
+        if self.h5index is None:
+            self.h5index = self.read_index()
 
-        depth_ctr = 0
-        while len(self.queue) and depth_ctr < depth:
-            self.read_layer()
-            depth_ctr += 1
-        if depth_ctr == depth:
-            self.h5tree += self.queue
+        self.h5tree = []
+        for h5path, props in self.h5index.items():
+            level = h5path.count("/") + 1
+            if (level <= depth and props["type"] == "dataset") or level == depth + 1:
+                self.h5tree.append(h5path)
 
         self.h5tree = sorted(self.h5tree)
-        self.h5file_instance.close()
-        self.h5file_instance = None
 
         return self.h5tree
 
+    def read_index(self):
+        """
+        :return: dictionary with the paths of all the groups and datasets as keys. The values are dictionaries with
+                 the type ('group' or 'dataset') and, for the datasets, the shape, dtype and chunks.
+        """
+        file_stat = Path(self.h5file).stat()
+        # The index version invalidates the sidecars written by older versions of the indexer
+        file_key = [file_stat.st_mtime_ns, file_stat.st_size, _index_version]
+        sidecar = Path(str(self.h5file) + self.sidecar_suffix)
+
+        if self.use_cache and sidecar.is_file():
+            try:
+                with open(sidecar, "r") as cache_file:
+                    cached = json.load(cache_file)
+                if cached["file_key"] == file_key:
+                    return cached["index"]
+            except (OSError, ValueError, KeyError):
+                pass
+
+        h5index = dict()
+
+        def index_item(name, obj):
+            if isinstance(obj, h5py.Dataset):
+                h5index[name] = {
+                    "type": "dataset",
+                    "shape": list(obj.shape),
+                    "dtype": obj.dtype.str,
+                    "chunks": list(obj.chunks) if obj.chunks is not None else None,
+                }
+            else:
+                h5index[name] = {"type": "group"}
+
+        with h5py.File(self.h5file, "r") as file:
+            _visit_linked_items(file, index_item)
+
+        if self.use_cache:
+            try:
+                with open(sidecar, "w") as cache_file:
+                    json.dump({"file_key": file_key, "index": h5index}, cache_file)
+            except OSError:
+                # E.g. read-only folder, the index is simply not cached
+                pass
+
+        return h5index
+
     def print_tree(self):
         for ii, line in enumerate(self.h5tree):
             print("{:s} ({:d})".format(line, ii))
 
-    def read_layer(self):
-        new_queue = []
-        while len(self.queue):
-            h5path = self.queue.pop()
-            h5layer = self.h5file_instance[h5path]
-            if not isinstance(h5layer, h5py.Dataset):
-                h5path += "/"
-                new_paths = list(map(h5path.__add__, h5layer.keys()))
-                new_queue += new_paths
-            else:
-                self.h5tree.append(h5path)
-
-        self.queue = new_queue
+    def get_datasets(self, dsetpath_list, selections=None):
+        """
+        Read the datasets. Only the selected parts are read from the file.
+        :param dsetpath_list: list of the dataset paths.
+        :param selections: optional. Either a single selection, applied to all the datasets, or a list with a
+                           selection for each dataset. A selection is anything that can index an h5py dataset, e.g.
+                           slice(0, None, 10) or (slice(None), slice(0, 100)). None reads the whole dataset.
+        :return: list of arrays.
+        """
+        if not isinstance(selections, list):
+            selections = [selections] * len(dsetpath_list)
 
-    def get_datasets(self, dsetpath_list):
         dset_list = []
         with h5py.File(self.h5file, "r") as file:
-            for dset_path in dsetpath_list:
-                dset = file[dset_path][:]
+            for dset_path, selection in zip(dsetpath_list, selections):
+                if selection is None:
+                    dset = file[dset_path][()]
+                else:
+                    dset = file[dset_path][selection]
                 dset_list.append(dset)
 
         return dset_list
 
+
 def get_base_h5path(h5file):
     """
     Finds the base path to the demodulators, in a standard hdf5 path save by the ZI lock-in. Not to be used with
@@ -198,139 +336,368 @@ def get_base_h5path(h5file):
     return demod_path
 
 
-def import_ringdowns(
-    folder_path, signal_demod="0", reference_demod="1", file_type="custom"
+_ringdown_file_types = ["custom", "zi", "custom2", "zi_sample"]
+
+
+@lru_cache(maxsize=32)
+def _detect_ringdown_schema_cached(h5file, mtime_ns, signal_demod):
+    with h5py.File(h5file, "r") as file:
+        chunk_groups = [key for key in file.keys() if key.isdigit()]
+        if len(chunk_groups) > 1:
+            # Multiple acquisition chunks, which need to be concatenated
+            return "custom", ""
+
+    base_path = get_base_h5path(h5file)
+    with h5py.File(h5file, "r") as file:
+        demod_group = file[base_path + f"{signal_demod}"]
+        if "sample.x" in demod_group and "value" in demod_group["sample.x"]:
+            return "zi", base_path
+        elif "sample.r" in demod_group and "value" in demod_group["sample.r"]:
+            return "custom2", base_path
+        elif "sample" in demod_group and "x" in demod_group["sample"]:
+            return "zi_sample", base_path
+
+    raise Exception(f"Unknown ringdown file structure in {h5file}.")
+
+
+def detect_ringdown_schema(h5file, signal_demod="0"):
+    """
+    Detects the structure of a ringdown h5 file. The result is cached, as long as the file is not modified.
+    :param h5file: the h5 file path.
+    :param signal_demod: the signal demodulator, used to probe the available signals.
+    :return: (file_type, base_path). The file type is one of 'custom' (chunked ZI file, read with get_h5_signals),
+             'zi' (sample.x/value datasets), 'custom2' (sample.r/value datasets), 'zi_sample' (sample/x datasets).
+    """
+    h5file = str(h5file)
+    return _detect_ringdown_schema_cached(
+        h5file, Path(h5file).stat().st_mtime_ns, str(signal_demod)
+    )
+
+
+def _read_ringdown_file(h5file, file_type, base_path, signal_demod, reference_demod):
+    if file_type == "custom":
+        data_dictionary = get_h5_signals(h5file)
+        signal_name = [
+            signal for signal in data_dictionary.keys() if signal[0] == signal_demod
+        ][0]
+        ref_name = [
+            signal for signal in data_dictionary.keys() if signal[0] == reference_demod
+        ][0]
+
+        signal_array, ref_array = (
+            data_dictionary[signal_name],
+            data_dictionary[ref_name],
+        )
+
+        tstamp = signal_array[:, 0]
+        signal_norm = signal_array[:, 1]
+        trigger = ref_array[:, 1]
+    elif file_type == "custom2":
+        with h5py.File(h5file, "r") as file:
+            tstamp = file[base_path + f"{signal_demod}/sample.r/timestamp"][:]
+
+            signal_norm = file[base_path + f"{signal_demod}/sample.r/value"][:]
+            trigger = file[base_path + f"{reference_demod}/sample.r/value"][:]
+    else:
+        if file_type == "zi":
+            timestamp_path, x_path, y_path = (
+                "sample.x/timestamp",
+                "sample.x/value",
+                "sample.y/value",
+            )
+        else:
+            timestamp_path, x_path, y_path = "sample/timestamp", "sample/x", "sample/y"
+
+        with h5py.File(h5file, "r") as file:
+            tstamp = file[base_path + f"{signal_demod}/{timestamp_path}"][:]
+            signal_norm = _read_amplitude(
+                file, base_path + f"{signal_demod}/", x_path, y_path
+            )
+            trigger = _read_amplitude(
+                file, base_path + f"{reference_demod}/", x_path, y_path
+            )
+            if len(trigger) != len(tstamp):
+                # The reference was recorded at a different rate: take its last sample before each signal sample
+                ref_tstamp = file[base_path + f"{reference_demod}/{timestamp_path}"][
+                    : len(trigger)
+                ]
+                trigger = trigger[
+                    np.searchsorted(ref_tstamp, tstamp, side="right").clip(1) - 1
+                ]
+
+    return tstamp, signal_norm, trigger
+
+
+def _read_amplitude(file, demod_path, x_path, y_path):
+    """
+    Reads the two quadratures and returns their modulus, computed in place in the x array, without any complex
+    temporary.
+    """
+    x_quad = file[demod_path + x_path][:]
+    y_quad = file[demod_path + y_path][:]
+    return np.hypot(x_quad, y_quad, out=x_quad)
+
+
+def iter_ringdowns(
+    folder_path,
+    signal_demod="0",
+    reference_demod="1",
+    file_type="auto",
+    threshold_reference=True,
+    prefetch=False,
 ):
+    """
+    Generator that yields the ringdowns of a folder one file at a time, so that only one ringdown (two, when
+    prefetching) is in memory at any time.
+    :param folder_path: the folder containing the h5 files.
+    :param signal_demod: str, the signal demodulator.
+    :param reference_demod: str, the reference demodulator.
+    :param file_type: 'auto' to detect the file structure from the first file, otherwise one of 'custom', 'zi',
+                      'custom2', 'zi_sample'.
+    :param threshold_reference: if True, the reference is converted to a 0/1 array using its mean as threshold.
+    :param prefetch: if True, the next file is read on a separate thread while the current ringdown is processed.
+    :return: generator of [timestamp, signal amplitude, reference] lists.
+    """
     if type(folder_path) is str:
         folder_path = Path(folder_path)
-    if file_type not in ["custom", "zi","custom2"]: #TODO: remove the emergency patch of adding custom2 as file structure
+    if file_type != "auto" and file_type not in _ringdown_file_types:
         raise Exception(
-            "Please provide an accepted file type. Options are 'custom' or 'zi'."
+            f"Please provide an accepted file type. Options are 'auto' or {_ringdown_file_types}."
         )
 
     h5file_list = list(map(str, folder_path.glob("*.h5")))
-    if file_type == "zi" or file_type == "custom2":
-        common_h5_path = get_base_h5path(h5file_list[0])
-
-    ringdown_list = []
-    for h5file in h5file_list:
-        if file_type == "custom":
-            data_dictionary = get_h5_signals(h5file)
-            signal_name = [
-                signal for signal in data_dictionary.keys() if signal[0] == signal_demod
-            ][0]
-            ref_name = [
-                signal
-                for signal in data_dictionary.keys()
-                if signal[0] == reference_demod
-            ][0]
-
-            signal_array, ref_array = (
-                data_dictionary[signal_name],
-                data_dictionary[ref_name],
-            )
-
-            tstamp = signal_array[:, 0]
-            signal_norm = signal_array[:, 1]
-            trigger = ref_array[:, 1]
-        elif file_type == "custom2": #TODO: this elif needs to go asap
-            with h5py.File(h5file, "r") as file:
-                tstamp = file[common_h5_path + f"{signal_demod}/sample.r/timestamp"][:]
+    if len(h5file_list) == 0:
+        return
 
-                signal_norm = file[common_h5_path + f"{signal_demod}/sample.r/value"][:]
-                trigger = file[common_h5_path + f"{reference_demod}/sample.r/value"][:]
-        else:
-            with h5py.File(h5file, "r") as file:
-                tstamp = file[common_h5_path + f"{signal_demod}/sample.x/timestamp"][:]
+    if file_type == "auto":
+        file_type, base_path = detect_ringdown_schema(h5file_list[0], signal_demod)
+    elif file_type == "custom":
+        base_path = ""
+    else:
+        base_path = get_base_h5path(h5file_list[0])
 
-                x_sig, y_sig = (
-                    file[common_h5_path + f"{signal_demod}/sample.x/value"],
-                    file[common_h5_path + f"{signal_demod}/sample.y/value"],
-                )
-                x_ref, y_ref = (
-                    file[common_h5_path + f"{reference_demod}/sample.x/value"],
-                    file[common_h5_path + f"{reference_demod}/sample.y/value"],
-                )
+    def read_file(h5file):
+        return _read_ringdown_file(
+            h5file, file_type, base_path, signal_demod, reference_demod
+        )
 
-                signal_norm = np.abs(x_sig[:] + 1j * y_sig[:])
+    if prefetch:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_read = executor.submit(read_file, h5file_list[0])
+            for h5file in h5file_list[1:] + [None]:
+                file_data = next_read.result()
+                if h5file is not None:
+                    next_read = executor.submit(read_file, h5file)
+                yield _bundle_ringdown(*file_data, threshold_reference)
+    else:
+        for h5file in h5file_list:
+            yield _bundle_ringdown(*read_file(h5file), threshold_reference)
 
-                trigger = np.abs(x_ref[:] + 1j * y_ref[:])
 
+def _bundle_ringdown(tstamp, signal_norm, trigger, threshold_reference):
+    if threshold_reference:
         trigger = np.where(trigger >= trigger.mean(), 1, 0).astype(int)
 
-        shortest_len = min(len(signal_norm), len(trigger))
+    shortest_len = min(len(signal_norm), len(trigger))
 
-        output_array = [tstamp, signal_norm, trigger]
+    output_array = [tstamp, signal_norm, trigger]
 
-        output_array = [array[:shortest_len] for array in output_array]
+    return [array[:shortest_len] for array in output_array]
 
-        ringdown_list.append(output_array)
 
-    return ringdown_list
+def import_ringdowns(
+    folder_path, signal_demod="0", reference_demod="1", file_type="custom"
+):
+    """
+    Imports all the ringdowns of a folder in a list. For folders that do not fit in memory, use iter_ringdowns.
+    """
+    if file_type not in ["auto"] + _ringdown_file_types:
+        raise Exception(
+            "Please provide an accepted file type. Options are 'custom' or 'zi'."
+        )
+
+    return list(
+        iter_ringdowns(
+            folder_path,
+            signal_demod=signal_demod,
+            reference_demod=reference_demod,
+            file_type=file_type,
+        )
+    )
 
 
 def import_ringdowns_v2(
     folder_path, signal_demod="0", reference_demod="1", file_type="custom"
 ):
     # Doesn't rescale the reference to be either zero or one, just imports the raw data
-    if type(folder_path) is str:
-        folder_path = Path(folder_path)
     if file_type not in ["custom", "zi"]:
         raise Exception(
             "Please provide an accepted file type. Options are 'custom' or 'zi'."
         )
 
-    h5file_list = list(map(str, folder_path.glob("*.h5")))
-    if file_type == "zi":
-        common_h5_path = get_base_h5path(h5file_list[0])
-
-    ringdown_list = []
-    for h5file in h5file_list:
-        if file_type == "custom":
-            data_dictionary = get_h5_signals(h5file)
-            signal_name = [
-                signal for signal in data_dictionary.keys() if signal[0] == signal_demod
-            ][0]
-            ref_name = [
-                signal
-                for signal in data_dictionary.keys()
-                if signal[0] == reference_demod
-            ][0]
-
-            signal_array, ref_array = (
-                data_dictionary[signal_name],
-                data_dictionary[ref_name],
-            )
+    # Here the 'zi' files are the ones with the sample/x structure
+    file_type = "zi_sample" if file_type == "zi" else file_type
+    return list(
+        iter_ringdowns(
+            folder_path,
+            signal_demod=signal_demod,
+            reference_demod=reference_demod,
+            file_type=file_type,
+            threshold_reference=False,
+        )
+    )
 
-            tstamp = signal_array[:, 0]
-            signal_norm = signal_array[:, 1]
-            trigger = ref_array[:, 1]
-        else:
-            with h5py.File(h5file, "r") as file:
-                tstamp = file[common_h5_path + f"{signal_demod}/sample/timestamp"][:]
 
-                x_sig, y_sig = (
-                    file[common_h5_path + f"{signal_demod}/sample/x"],
-                    file[common_h5_path + f"{signal_demod}/sample/y"],
-                )
-                x_ref, y_ref = (
-                    file[common_h5_path + f"{reference_demod}/sample/x"],
-                    file[common_h5_path + f"{reference_demod}/sample/y"],
+def _timestamp_owners(sig_paths):
+    """
+    The signals of a demodulator share the same timestamps, which are stored once per demodulator, under the first
+    signal of that demodulator.
+    :return: dictionary with the signal paths as keys, and the path of the signal holding the timestamps as values.
+    """
+    demod_owners = dict()
+    owners = dict()
+    for path in sig_paths:
+        demod_path = path.rsplit("/", 1)[0]
+        owners[path] = demod_owners.setdefault(demod_path, path)
+    return owners
+
+
+def create_ringdown_file(saving_dir, sig_paths, clockbase=None, libver=None):
+    """
+    Creates the h5 file of a new ringdown recording, with an empty resizable value dataset for each signal. The
+    timestamps are stored as int64 clock ticks, in a single dataset per demodulator, which is hard linked as the
+    timestamp dataset of each of its signals. The files are numbered in the order they are created: ringdown0000.h5,
+    ringdown0001.h5, ...
+    :param saving_dir: the directory of the ringdowns, e.g. wafer/chip/mode1. Created if it does not exist.
+    :param sig_paths: the subscribed signal paths, e.g. /dev1347/demods/0/sample.x
+    :param clockbase: optional, the device clockbase in Hz, saved as the clockbase attribute of the file.
+    :param libver: optional, the h5py library version bounds of the file. Must be 'latest' for SWMR writing.
+    :return: the path of the new file.
+    """
+    saving_dir = Path(saving_dir)
+    saving_dir.mkdir(parents=True, exist_ok=True)
+
+    file_num = len(list(saving_dir.glob("*h5")))
+    savefile = saving_dir / "ringdown{:04d}.h5".format(file_num)
+    with h5py.File(savefile, "w", libver=libver) as h5file:
+        if clockbase is not None:
+            h5file.attrs["clockbase"] = clockbase
+        h5kwargs = {"shape": (0,), "maxshape": (None,)}
+        for path, owner in _timestamp_owners(sig_paths).items():
+            if path == owner:
+                h5file.create_dataset(
+                    name=path + "/timestamp", dtype=np.int64, **h5kwargs
                 )
+            else:
+                h5file[path + "/timestamp"] = h5file[owner + "/timestamp"]
+            h5file.create_dataset(name=path + "/value", dtype=np.float64, **h5kwargs)
+
+    return savefile
 
-                signal_norm = np.abs(x_sig[:] + 1j * y_sig[:])
 
-                trigger = np.abs(x_ref[:] + 1j * y_ref[:])
+def _append_to_dataset(dataset, data):
+    dataset.resize((dataset.shape[0] + len(data),))
+    dataset[-len(data) :] = data
+
+
+def append_ringdown_data(savefile, sig_paths, daq_data, decimation=None):
+    """
+    Appends the data returned by a DAQ module read to a ringdown file created with create_ringdown_file.
+    :param savefile: the path of the ringdown file.
+    :param sig_paths: the subscribed signal paths.
+    :param daq_data: the flat dictionary returned by the DAQ module read.
+    :param decimation: optional, dictionary with the signal paths as keys, and the factor by which each signal is
+                       decimated as values, e.g. ziVirtualDevice.daqmodules_decimation[module_name].
+    """
+    with h5py.File(savefile, "a") as file:
+        _append_ringdown_bursts(file, sig_paths, daq_data, decimation)
 
-        shortest_len = min(len(signal_norm), len(trigger))
 
-        output_array = [tstamp, signal_norm, trigger]
+def _append_ringdown_bursts(file, sig_paths, daq_data, decimation=None):
+    returned_data = dict(
+        (signal_path.lower(), bursts) for signal_path, bursts in daq_data.items()
+    )
+    decimation = dict() if decimation is None else decimation
+
+    for signal_path, owner in _timestamp_owners(sig_paths).items():
+        signal_bursts = returned_data.get(signal_path.lower(), [])
+        if len(signal_bursts) == 0:
+            continue
+        # The number of columns of a burst is a multiple of the factor, so the decimated samples stay evenly spaced
+        factor = decimation.get(signal_path, 1)
+        value_tot = np.concatenate(
+            [signal_burst["value"][0, ::factor] for signal_burst in signal_bursts]
+        )
+        if len(value_tot) == 0:
+            continue
+
+        _append_to_dataset(file[signal_path + "/value"], value_tot)
+        if signal_path == owner:
+            time_ax_tot = np.concatenate(
+                [
+                    signal_burst["timestamp"][0, ::factor]
+                    for signal_burst in signal_bursts
+                ]
+            ).astype(np.int64)
+            _append_to_dataset(file[signal_path + "/timestamp"], time_ax_tot)
+
+
+class RingdownFileWriter(object):
+    """
+    Writes a ringdown file during the acquisition. The file stays open in SWMR (single writer, multiple readers) mode,
+    so that it can be read while it is written, e.g. with RingdownDataContainer.load_ringdown(..., swmr=True). The
+    data are flushed every flush_interval seconds, and the readers only see the flushed data.
+    """
+
+    def __init__(
+        self,
+        saving_dir,
+        sig_paths,
+        clockbase=None,
+        flush_interval=1.0,
+        decimation=None,
+    ):
+        """
+        :param saving_dir: the directory of the ringdowns, e.g. wafer/chip/mode1.
+        :param sig_paths: the subscribed signal paths, e.g. /dev1347/demods/0/sample.x
+        :param clockbase: optional, the device clockbase in Hz.
+        :param flush_interval: the minimum time between two flushes, in seconds.
+        :param decimation: optional, the decimation factor of each signal, see append_ringdown_data.
+        """
+        self.sig_paths = sig_paths
+        self.decimation = decimation
+        self.flush_interval = flush_interval
+        # All the datasets must exist before the SWMR mode is started
+        self.savefile = create_ringdown_file(
+            saving_dir, sig_paths, clockbase=clockbase, libver="latest"
+        )
+        self._file = h5py.File(self.savefile, "a", libver="latest")
+        self._file.swmr_mode = True
+        self._last_flush = time.monotonic()
+
+    def append(self, daq_data):
+        """
+        :param daq_data: the flat dictionary returned by the DAQ module read.
+        """
+        _append_ringdown_bursts(self._file, self.sig_paths, daq_data, self.decimation)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._file.flush()
+        self._last_flush = time.monotonic()
 
-        output_array = [array[:shortest_len] for array in output_array]
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            self._file.close()
+            self._file = None
 
-        ringdown_list.append(output_array)
+    def __enter__(self):
+        return self
 
-    return ringdown_list
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 if __name__ == "__main__":
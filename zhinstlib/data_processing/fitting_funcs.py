@@ -1,36 +1,126 @@
+"""
+All the fitting functions are broadcast-safe: the parameters can be arrays of shape (M, 1), in which case the functions
+return an (M, N) array, one row per parameter set. The *_jac functions return the analytic Jacobian with respect to
+the free parameters, with shape (..., N, P), as required by the jac argument of scipy.optimize.curve_fit.
+"""
 import numpy as np
 
 
+def _stack_jacobian(*columns):
+    return np.stack(np.broadcast_arrays(*columns), axis=-1)
+
+
 def lorentz_func(freqs, freq0, FWHM, amp):
 
     return amp * (FWHM / 2) ** 2 / ((FWHM / 2) ** 2 + np.square(freqs - freq0))
 
 
+def lorentz_func_jac(freqs, freq0, FWHM, amp):
+    half_width_sq = (FWHM / 2) ** 2
+    detuning = freqs - freq0
+    inv_den = 1 / (half_width_sq + np.square(detuning))
+    shape = half_width_sq * inv_den
+
+    d_freq0 = 2 * amp * shape * detuning * inv_den
+    d_fwhm = amp * FWHM / 2 * np.square(detuning) * np.square(inv_den)
+    return _stack_jacobian(d_freq0, d_fwhm, shape)
+
+
 def normalized_nlin_rdown(t, gamma, gamma_nlin, y0):
-    return (
-        np.exp(-gamma * t / 2)
-        / np.sqrt(1 + gamma_nlin * (1 - np.exp(-gamma * t)) / (4 * gamma))
-        + y0
-    )
+    decay = np.exp(-gamma * t)
+    return np.sqrt(decay / (1 + gamma_nlin * (1 - decay) / (4 * gamma))) + y0
+
+
+def normalized_nlin_rdown_jac(t, gamma, gamma_nlin, y0):
+    return nlin_rdown_jac(t, gamma, gamma_nlin, y0, 1)[..., :3]
 
 
 def nlin_rdown(t, gamma, gamma_nlin, y0, A):
+    decay = np.exp(-gamma * t)
     return (
-        A
-        * np.exp(-gamma * t / 2)
-        / np.sqrt(1 + A ** 2 * gamma_nlin * (1 - np.exp(-gamma * t)) / (4 * gamma))
+        A * np.sqrt(decay / (1 + A ** 2 * gamma_nlin * (1 - decay) / (4 * gamma)))
         + y0
     )
 
 
+def nlin_rdown_jac(t, gamma, gamma_nlin, y0, A):
+    decay = np.exp(-gamma * t)
+    nlin_factor = A ** 2 * gamma_nlin / (4 * gamma)
+    den = 1 + nlin_factor * (1 - decay)
+    sqrt_decay = np.sqrt(decay)
+    model = A * sqrt_decay / np.sqrt(den)  # Without the offset
+    half_model_over_den = model / (2 * den)
+
+    d_den_d_gamma = nlin_factor * (t * decay - (1 - decay) / gamma)
+    d_gamma = -t * model / 2 - half_model_over_den * d_den_d_gamma
+    d_gamma_nlin = -half_model_over_den * A ** 2 * (1 - decay) / (4 * gamma)
+    d_y0 = np.ones_like(model)
+    d_amp = model / A - half_model_over_den * 2 * nlin_factor * (1 - decay) / A
+    return _stack_jacobian(d_gamma, d_gamma_nlin, d_y0, d_amp)
+
+
 def lin_rdown(t, gamma, y0, A):
     return A * np.exp(-gamma * t / 2) + y0
 
 
+def lin_rdown_jac(t, gamma, y0, A):
+    decay = np.exp(-gamma * t / 2)
+    return _stack_jacobian(-A * t * decay / 2, np.ones_like(decay), decay)
+
+
 def lin_rdown_v2(t, gamma, y0, A):
     return np.sqrt(A ** 2 * np.exp(-gamma * t) + y0 ** 2)
 
 
+def lin_rdown_v2_jac(t, gamma, y0, A):
+    decay = np.exp(-gamma * t)
+    model = np.sqrt(A ** 2 * decay + y0 ** 2)
+    return _stack_jacobian(
+        -(A ** 2) * t * decay / (2 * model), y0 / model, A * decay / model
+    )
+
+
+_jacobians = {
+    lorentz_func: lorentz_func_jac,
+    normalized_nlin_rdown: normalized_nlin_rdown_jac,
+    nlin_rdown: nlin_rdown_jac,
+    lin_rdown: lin_rdown_jac,
+    lin_rdown_v2: lin_rdown_v2_jac,
+}
+
+
+def get_jacobian(fitfunc):
+    """
+    :param fitfunc: one of the fitting functions of this module.
+    :return: the analytic Jacobian of the function, or None if it is not available. None makes curve_fit fall back to
+             the finite-difference Jacobian.
+    """
+    return _jacobians.get(fitfunc, None)
+
+
+def batch_evaluate(fitfunc, x_axis, par_matrix):
+    """
+    Evaluate a fitting function for many parameter sets at once.
+    :param fitfunc: the fitting function.
+    :param x_axis: (N,) array, the x axis.
+    :param par_matrix: (M, P) array, one parameter set per row.
+    :return: (M, N) array.
+    """
+    par_matrix = np.atleast_2d(par_matrix)
+    return fitfunc(np.asarray(x_axis)[None, :], *par_matrix.T[:, :, None])
+
+
+def batch_jacobian(fitfunc, x_axis, par_matrix):
+    """
+    Same as batch_evaluate, for the Jacobian of the fitting function.
+    :return: (M, N, P) array.
+    """
+    par_matrix = np.atleast_2d(par_matrix)
+    return get_jacobian(fitfunc)(
+        np.asarray(x_axis)[None, :], *par_matrix.T[:, :, None]
+    )
+
+
 def parametric_gain(phi_res=np.array([]), phi_par=0, kpkT_ratio=0):
     if isinstance(kpkT_ratio, np.ndarray):
         if not isinstance(phi_res, np.ndarray):
@@ -0,0 +1,328 @@
+import numpy as np
+import re
+from zhinstlib.data_processing.fitting_funcs import nlin_rdown, nlin_rdown_jac
+
+
+class RecursiveLogFit(object):
+    """
+    Weighted recursive least squares fit of log(amplitude) = log(A) - gamma * t / 2. The data are accumulated in
+    information form, so each block of data is added with a couple of vectorized sums, and the fit can be updated at
+    any time without keeping the data in memory.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._info_matrix = np.zeros((2, 2))
+        self._info_vector = np.zeros(2)
+        self.point_num = 0
+
+    def update(self, time_axis, amplitude):
+        """
+        :param time_axis: the times of the samples, relative to the start of the decay.
+        :param amplitude: the decay amplitude. Only positive values are used.
+        """
+        valid = amplitude > 0
+        time_axis, amplitude = time_axis[valid], amplitude[valid]
+        if len(amplitude) == 0:
+            return
+        # The noise of log(r) scales as 1/r, hence the r^2 weights
+        weights = np.square(amplitude)
+        log_amp = np.log(amplitude)
+
+        sum_w, sum_wt, sum_wtt = (
+            weights.sum(),
+            weights @ time_axis,
+            weights @ np.square(time_axis),
+        )
+        self._info_matrix += np.array([[sum_w, sum_wt], [sum_wt, sum_wtt]])
+        self._info_vector += np.array(
+            [weights @ log_amp, (weights * time_axis) @ log_amp]
+        )
+        self.point_num += len(amplitude)
+
+    def solve(self):
+        """
+        :return: (gamma, amplitude), or None if there are not enough data yet.
+        """
+        if self.point_num < 3 or np.linalg.det(self._info_matrix) <= 0:
+            return None
+        log_amp0, slope = np.linalg.solve(self._info_matrix, self._info_vector)
+        return -2 * slope, np.exp(log_amp0)
+
+
+class _DecayWindow(object):
+    """
+    The data of the decay that is being recorded. The data are kept with a decimation that doubles every time the
+    buffer fills up, so that the memory stays bounded for arbitrarily long decays.
+    """
+
+    def __init__(self, start_time, max_points):
+        self.start_time = start_time
+        self.max_points = max_points
+        self.initial_amplitude = None
+        self.linear_fit = RecursiveLogFit()
+        self.time_axis = np.empty(0)
+        self.amplitude = np.empty(0)
+        self._stride = 1
+        self._offset = 0
+        self.estimate = None  # [gamma, Q]
+        self.nonlinear_pars = None
+        self.points_at_last_nlfit = 0
+
+    def add(self, time_axis, amplitude):
+        self.linear_fit.update(time_axis, amplitude)
+
+        self.time_axis = np.concatenate(
+            (self.time_axis, time_axis[self._offset :: self._stride])
+        )
+        self.amplitude = np.concatenate(
+            (self.amplitude, amplitude[self._offset :: self._stride])
+        )
+        self._offset = (self._offset - len(amplitude)) % self._stride
+        while len(self.amplitude) > self.max_points:
+            self.time_axis, self.amplitude = self.time_axis[::2], self.amplitude[::2]
+            self._stride *= 2
+            self._offset = 0
+
+
+class OnlineRingdownEstimator(object):
+    """
+    Estimates the resonance frequency and Q factor while the ringdowns are being recorded. The data are fed with the
+    dictionaries returned by the DAQ module read. The reference-off windows are found on the fly with a hysteresis
+    threshold on the reference amplitude, and each decay is fitted with a recursive linear fit of log(amplitude).
+    When enough data are available, the fit is refined with the nonlinear ringdown model.
+    """
+
+    _path_pattern = re.compile(r"/demods/(\d+)/sample\.(\w+)$")
+
+    def __init__(
+        self,
+        signal_demod=0,
+        reference_demod=1,
+        clockbase=1,
+        min_amplitude_ratio=0.05,
+        hysteresis=(0.3, 0.7),
+        nonlinear_min_points=500,
+        nonlinear_max_points=2000,
+        convergence_tol=0.02,
+        min_decays=2,
+        min_reference_contrast=0.5,
+    ):
+        """
+        :param signal_demod: the demodulator carrying the decays, in python indexing.
+        :param reference_demod: the demodulator carrying the TTL-like reference, in python indexing.
+        :param clockbase: the device clockbase, used to convert the timestamps in seconds.
+        :param min_amplitude_ratio: the decay data below this fraction of the initial amplitude are not used, to
+                                    avoid biasing the fit with the noise floor.
+        :param hysteresis: the lower and upper thresholds of the reference, as fractions of its observed range.
+        :param nonlinear_min_points: the number of points in a decay after which the nonlinear fit is used.
+        :param nonlinear_max_points: the maximum number of points kept in memory for the nonlinear fit.
+        :param convergence_tol: the relative standard error of Q below which the estimate is considered converged.
+        :param min_decays: the minimum number of completed decays before the estimate can be considered converged.
+        :param min_reference_contrast: the minimum range of the reference, relative to its maximum, for the reference
+                                       levels to be considered detected.
+        """
+        self.signal_demod = signal_demod
+        self.reference_demod = reference_demod
+        self.clockbase = clockbase
+        self.min_amplitude_ratio = min_amplitude_ratio
+        self.hysteresis = hysteresis
+        self.nonlinear_min_points = nonlinear_min_points
+        self.nonlinear_max_points = nonlinear_max_points
+        self.convergence_tol = convergence_tol
+        self.min_decays = min_decays
+        self.min_reference_contrast = min_reference_contrast
+        self.reset()
+
+    def reset(self):
+        self._ref_min, self._ref_max = np.inf, -np.inf
+        self._reference_high = None
+        self._window = None
+        self._frequency_sum, self._frequency_num = 0.0, 0
+        self.completed_Qs = []
+        self._updated = False
+
+    def feed(self, daq_data):
+        """
+        :param daq_data: the flat dictionary returned by the read method of a DAQ module.
+        """
+        bursts = dict()
+        for signal_path, signal_bursts in daq_data.items():
+            match = self._path_pattern.search(signal_path.lower())
+            if match is not None:
+                bursts[(int(match.group(1)), match.group(2))] = signal_bursts
+
+        for signal_burst in bursts.get((self.signal_demod, "frequency"), []):
+            frequency = signal_burst["value"][0, :]
+            self._frequency_sum += frequency.sum()
+            self._frequency_num += len(frequency)
+
+        required = [
+            (self.signal_demod, "x"),
+            (self.signal_demod, "y"),
+            (self.reference_demod, "x"),
+            (self.reference_demod, "y"),
+        ]
+        if not all(key in bursts for key in required):
+            return
+
+        for sig_x, sig_y, ref_x, ref_y in zip(*[bursts[key] for key in required]):
+            sample_num = min(
+                sig_x["value"].shape[1],
+                sig_y["value"].shape[1],
+                ref_x["value"].shape[1],
+                ref_y["value"].shape[1],
+            )
+            if sample_num == 0:
+                continue
+            time_axis = sig_x["timestamp"][0, :sample_num] / self.clockbase
+            amplitude = np.hypot(
+                sig_x["value"][0, :sample_num], sig_y["value"][0, :sample_num]
+            )
+            reference = np.hypot(
+                ref_x["value"][0, :sample_num], ref_y["value"][0, :sample_num]
+            )
+            self._process_block(time_axis, amplitude, reference)
+
+    def _process_block(self, time_axis, amplitude, reference):
+        self._ref_min = min(self._ref_min, reference.min())
+        self._ref_max = max(self._ref_max, reference.max())
+        ref_range = self._ref_max - self._ref_min
+        # Until both reference levels have been seen, the range is only made of noise
+        if ref_range <= self.min_reference_contrast * abs(self._ref_max):
+            return
+
+        low_thresh = self._ref_min + self.hysteresis[0] * ref_range
+        high_thresh = self._ref_min + self.hysteresis[1] * ref_range
+
+        # Hysteresis: the state only changes when crossing the opposite threshold. The state of every sample is
+        # obtained by propagating forward the last crossing.
+        crossing = np.full(len(reference), -1, dtype=np.int8)
+        crossing[reference <= low_thresh] = 0
+        crossing[reference >= high_thresh] = 1
+        crossing_idxs = np.where(crossing >= 0)[0]
+        if self._reference_high is None:
+            if len(crossing_idxs) == 0:
+                return
+            self._reference_high = bool(crossing[crossing_idxs[0]])
+
+        last_crossing = np.maximum.accumulate(
+            np.where(crossing >= 0, np.arange(len(reference)), -1)
+        )
+        state = np.where(
+            last_crossing >= 0,
+            crossing[np.maximum(last_crossing, 0)],
+            int(self._reference_high),
+        ).astype(bool)
+
+        previous_state = np.concatenate(([self._reference_high], state[:-1]))
+        edges = np.where(state != previous_state)[0]
+        boundaries = np.concatenate(([0], edges, [len(state)]))
+        for start, stop in zip(boundaries[:-1], boundaries[1:]):
+            if stop <= start:
+                continue
+            if state[start] != self._reference_high:
+                self._reference_high = bool(state[start])
+                if self._reference_high:
+                    self._close_window()
+                else:
+                    self._window = _DecayWindow(
+                        time_axis[start], self.nonlinear_max_points
+                    )
+            if not self._reference_high and self._window is not None:
+                self._add_to_window(time_axis[start:stop], amplitude[start:stop])
+
+    def _add_to_window(self, time_axis, amplitude):
+        window = self._window
+        if window.initial_amplitude is None:
+            window.initial_amplitude = amplitude[0]
+        above_floor = amplitude >= self.min_amplitude_ratio * window.initial_amplitude
+        if not above_floor.any():
+            return
+        window.add(time_axis[above_floor] - window.start_time, amplitude[above_floor])
+        self._update_window_estimate()
+
+    def _update_window_estimate(self):
+        window = self._window
+        linear_result = window.linear_fit.solve()
+        if linear_result is None:
+            return
+        gamma, amp = linear_result
+
+        points = window.linear_fit.point_num
+        # Refine with the nonlinear model, but only every time the data have grown by a half, to keep it cheap
+        if (
+            points >= self.nonlinear_min_points
+            and points >= 1.5 * window.points_at_last_nlfit
+        ):
+            window.points_at_last_nlfit = points
+            if window.nonlinear_pars is not None:
+                p0 = window.nonlinear_pars
+            else:
+                p0 = [gamma, 0, 0, amp]
+            from scipy.optimize import curve_fit
+
+            try:
+                optimal_pars, _ = curve_fit(
+                    nlin_rdown,
+                    window.time_axis,
+                    window.amplitude,
+                    p0=p0,
+                    jac=nlin_rdown_jac,
+                    bounds=([0, 0, -np.inf, 0], [np.inf, np.inf, np.inf, np.inf]),
+                    maxfev=2000,
+                )
+                window.nonlinear_pars = optimal_pars
+            except (RuntimeError, ValueError):
+                pass
+        if window.nonlinear_pars is not None:
+            gamma = window.nonlinear_pars[0]
+
+        if gamma > 0 and self._frequency_num > 0:
+            window.estimate = [gamma, 2 * np.pi * self.get_frequency() / gamma]
+            self._updated = True
+
+    def _close_window(self):
+        if self._window is not None and self._window.estimate is not None:
+            self.completed_Qs.append(self._window.estimate[1])
+            self._updated = True
+        self._window = None
+
+    def get_frequency(self):
+        if self._frequency_num == 0:
+            return None
+        return self._frequency_sum / self._frequency_num
+
+    def has_updates(self):
+        return self._updated
+
+    def get_estimate(self):
+        """
+        :return: (frequency, Q), the provisional estimate. The Q is the mean over the completed decays or, if none is
+                 completed yet, the estimate of the decay being recorded. None if no estimate is available.
+        """
+        self._updated = False
+        if len(self.completed_Qs):
+            Q = np.mean(self.completed_Qs)
+        elif self._window is not None and self._window.estimate is not None:
+            Q = self._window.estimate[1]
+        else:
+            return None
+        return self.get_frequency(), Q
+
+    def has_converged(self):
+        """
+        The estimate is converged when the relative standard error of the Qs of the completed decays falls below
+        the convergence tolerance.
+        """
+        decay_num = len(self.completed_Qs)
+        if decay_num < max(self.min_decays, 2):
+            return False
+        rel_std_err = (
+            np.std(self.completed_Qs, ddof=1)
+            / np.sqrt(decay_num)
+            / np.mean(self.completed_Qs)
+        )
+        return rel_std_err < self.convergence_tol
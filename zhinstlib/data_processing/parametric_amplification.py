@@ -0,0 +1,266 @@
+"""
+Parametric amplification model and phase-sweep fits.
+
+The gain of fitting_funcs.parametric_gain only depends on the phase combination psi = 2 * phi_res - phi_par and on the
+ratio r = kp/kT:
+
+    G = sqrt(1 + r^2 - 2 r cos(psi)) / |1 - r^2|
+
+The functions here use this closed form, so that large grids are evaluated blockwise within a memory budget, the gain
+can be tabulated once on a (r, psi) grid, and measured phase sweeps can be inverted to kp/kT with a grid search
+followed by a vectorized refinement.
+"""
+
+import numpy as np
+from functools import lru_cache
+
+
+def parametric_gain_psi(psi, kpkT_ratio):
+    """
+    :param psi: the phase combination 2 * phi_res - phi_par.
+    :param kpkT_ratio: the kp/kT ratio. Must be smaller than one in absolute value.
+    :return: the parametric gain, with the broadcast shape of the inputs.
+    """
+    return np.sqrt(1 + np.square(kpkT_ratio) - 2 * kpkT_ratio * np.cos(psi)) / np.abs(
+        1 - np.square(kpkT_ratio)
+    )
+
+
+def iter_parametric_gain_blocks(
+    phi_res, phi_par, kpkT_ratio, max_bytes=256e6, dtype=np.float32
+):
+    """
+    Evaluates the gain on the phi_res x phi_par x kpkT_ratio grid, in blocks along the phi_res axis. Each block,
+    including the temporaries, fits into max_bytes.
+    :return: generator of (phi_res slice, (B, P, K) gain block).
+    """
+    phi_res, phi_par, kpkT_ratio = (
+        np.atleast_1d(np.asarray(phi_res, dtype=dtype)),
+        np.atleast_1d(np.asarray(phi_par, dtype=dtype)),
+        np.atleast_1d(np.asarray(kpkT_ratio, dtype=dtype)),
+    )
+    # Roughly three arrays of the block size are alive at the same time
+    row_bytes = 3 * len(phi_par) * len(kpkT_ratio) * np.dtype(dtype).itemsize
+    rows_per_block = max(int(max_bytes // row_bytes), 1)
+
+    ratio = kpkT_ratio[None, None, :]
+    ratio_terms = (1 + np.square(ratio), 2 * ratio, np.abs(1 - np.square(ratio)))
+    for start in range(0, len(phi_res), rows_per_block):
+        block_slice = slice(start, min(start + rows_per_block, len(phi_res)))
+        psi = 2 * phi_res[block_slice, None, None] - phi_par[None, :, None]
+        block = np.cos(psi) * (-ratio_terms[1])
+        block += ratio_terms[0]
+        np.sqrt(block, out=block)
+        block /= ratio_terms[2]
+        yield block_slice, block
+
+
+def parametric_gain_blockwise(
+    phi_res, phi_par, kpkT_ratio, max_bytes=256e6, dtype=np.float32, out=None
+):
+    """
+    Same result as fitting_funcs.parametric_gain for array inputs, with shape (R, P, K), but computed blockwise in
+    the requested dtype. The output can be preallocated, e.g. as a numpy memmap, for grids that do not fit in memory.
+    :param max_bytes: the memory budget of the temporaries.
+    :param dtype: the dtype of the computation and of the output.
+    :param out: optional, (R, P, K) array into which the result is written.
+    """
+    shape = (np.size(phi_res), np.size(phi_par), np.size(kpkT_ratio))
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape:
+        raise ValueError(f"The output array must have shape {shape}.")
+
+    for block_slice, block in iter_parametric_gain_blocks(
+        phi_res, phi_par, kpkT_ratio, max_bytes=max_bytes, dtype=dtype
+    ):
+        out[block_slice] = block
+    return out
+
+
+@lru_cache(maxsize=8)
+def _build_gain_table(ratio_min, ratio_max, ratio_points, psi_points):
+    ratios = np.linspace(ratio_min, ratio_max, ratio_points)
+    # The last psi point is 2 pi, a copy of the first one, so that the interpolation wraps around
+    psis = np.linspace(0, 2 * np.pi, psi_points + 1)
+    table = parametric_gain_psi(psis[None, :], ratios[:, None])
+    table.setflags(write=False)
+    return ratios, psis, table
+
+
+class ParametricGainTable(object):
+    """
+    The parametric gain tabulated on a (kp/kT, psi) grid. The tables are cached, so creating a table with the same
+    grid is free. Evaluating the table only requires a linear interpolation along psi for the tabulated ratios.
+    """
+
+    def __init__(self, ratio_max=0.99, ratio_points=199, psi_points=720, ratio_min=0):
+        self.ratios, self.psis, self.table = _build_gain_table(
+            ratio_min, ratio_max, ratio_points, psi_points
+        )
+        self.psi_step = self.psis[1] - self.psis[0]
+        self.psi_points = psi_points
+
+    def evaluate_rows(self, psi, ratio_idxs=None):
+        """
+        :param psi: (N,) array of phases.
+        :param ratio_idxs: optional, the indices of the tabulated ratios to use. Default is all.
+        :return: (R, N) array of gains, one row per tabulated ratio.
+        """
+        table = self.table if ratio_idxs is None else self.table[ratio_idxs]
+        position = np.mod(psi, 2 * np.pi) / self.psi_step
+        lower = np.minimum(position.astype(int), self.psi_points - 1)
+        fraction = position - lower
+        return table[:, lower] * (1 - fraction) + table[:, lower + 1] * fraction
+
+    def __call__(self, phi_res, phi_par, kpkT_ratio):
+        """
+        Interpolated gain for arbitrary ratios (bilinear interpolation). The inputs are broadcast together.
+        """
+        psi, ratio = np.broadcast_arrays(2 * np.asarray(phi_res) - phi_par, kpkT_ratio)
+        ratio_pos = (ratio - self.ratios[0]) / (self.ratios[1] - self.ratios[0])
+        ratio_pos = np.clip(ratio_pos, 0, len(self.ratios) - 1)
+        ratio_low = np.minimum(ratio_pos.astype(int), len(self.ratios) - 2)
+        ratio_frac = ratio_pos - ratio_low
+
+        psi_pos = np.mod(psi, 2 * np.pi) / self.psi_step
+        psi_low = np.minimum(psi_pos.astype(int), self.psi_points - 1)
+        psi_frac = psi_pos - psi_low
+
+        low_row = self.table[ratio_low, psi_low] * (1 - psi_frac)
+        low_row += self.table[ratio_low, psi_low + 1] * psi_frac
+        high_row = self.table[ratio_low + 1, psi_low] * (1 - psi_frac)
+        high_row += self.table[ratio_low + 1, psi_low + 1] * psi_frac
+        return low_row * (1 - ratio_frac) + high_row * ratio_frac
+
+
+def _sweep_psi(phases, offsets, swept):
+    if swept == "par":
+        return offsets - phases
+    elif swept == "res":
+        return 2 * phases - offsets
+    else:
+        raise ValueError("The swept phase must be either 'par' or 'res'.")
+
+
+def _sweep_model_and_jacobian(phases, pars, swept):
+    """
+    :param phases: (N,) array. :param pars: (M, 3) array of [ratio, phase offset, scale].
+    :return: (M, N) model, (M, N, 3) Jacobian.
+    """
+    ratio, offset, scale = pars[:, 0:1], pars[:, 1:2], pars[:, 2:3]
+    psi = _sweep_psi(phases[None, :], offset, swept)
+    cos_psi, sin_psi = np.cos(psi), np.sin(psi)
+    sqrt_num = np.sqrt(1 + np.square(ratio) - 2 * ratio * cos_psi)
+    den = 1 - np.square(ratio)
+    gain = sqrt_num / den
+
+    d_ratio = (ratio - cos_psi) / (sqrt_num * den) + 2 * ratio * gain / den
+    d_offset = ratio * sin_psi / (sqrt_num * den)
+    if swept == "res":
+        d_offset = -d_offset
+    jacobian = np.stack(
+        np.broadcast_arrays(scale * d_ratio, scale * d_offset, gain), axis=-1
+    )
+    return scale * gain, jacobian
+
+
+def fit_phase_sweep(
+    phases,
+    gains,
+    swept="par",
+    fit_scale=False,
+    gain_table=None,
+    offset_points=360,
+    max_bytes=256e6,
+    max_iter=50,
+    tol=1e-10,
+):
+    """
+    Inverts measured phase sweeps of the parametric gain to kp/kT. First a grid search over the tabulated ratios and
+    offset_points phase offsets, evaluated blockwise within max_bytes, then a vectorized Gauss-Newton refinement of all
+    the sweeps at once.
+    :param phases: (N,) array, the swept phase in radians.
+    :param gains: (N,) or (M, N) array, the measured gain of one or more sweeps over the same phases.
+    :param swept: 'par' if the parametric pump phase is swept, 'res' if the resonator drive phase is swept.
+    :param fit_scale: if True, an overall scale factor of the gain is also fitted (e.g. uncalibrated gains).
+    :param gain_table: optional, a ParametricGainTable. The default table is used otherwise.
+    :param offset_points: the number of phase offsets in the grid search.
+    :param max_bytes: the memory budget of the grid search.
+    :param max_iter: the maximum number of refinement iterations.
+    :param tol: the relative decrease of the residuals below which the refinement stops.
+    :return: (M, 3) array of [kp/kT ratio, phase offset, scale] and the (M,) array of residual sums of squares.
+    """
+    phases = np.asarray(phases, dtype=np.float64)
+    gains = np.atleast_2d(np.asarray(gains, dtype=np.float64))
+    if gain_table is None:
+        gain_table = ParametricGainTable()
+
+    offsets = np.linspace(0, 2 * np.pi, offset_points, endpoint=False)
+    ratio_num = len(gain_table.ratios)
+
+    # Grid search: model of shape (ratios, offsets, phases), evaluated in blocks of offsets
+    offsets_per_block = max(int(max_bytes // (8 * 3 * ratio_num * len(phases))), 1)
+    best_cost = np.full(len(gains), np.inf)
+    best_pars = np.zeros((len(gains), 3))
+    gain_sq_sum = np.sum(np.square(gains), axis=1)
+    for start in range(0, offset_points, offsets_per_block):
+        block_offsets = offsets[start : start + offsets_per_block]
+        psi = _sweep_psi(phases[None, :], block_offsets[:, None], swept)
+        model = gain_table.evaluate_rows(psi.ravel()).reshape(
+            ratio_num, len(block_offsets), len(phases)
+        )
+        cross = np.einsum("rop,mp->mro", model, gains)
+        model_sq = np.einsum("rop,rop->ro", model, model)
+        if fit_scale:
+            # Optimal scale for every candidate: cost = |g|^2 - (g.m)^2 / |m|^2
+            cost = gain_sq_sum[:, None, None] - np.square(cross) / model_sq[None]
+        else:
+            cost = gain_sq_sum[:, None, None] - 2 * cross + model_sq[None]
+        flat_idx = np.argmin(cost.reshape(len(gains), -1), axis=1)
+        block_best = cost.reshape(len(gains), -1)[np.arange(len(gains)), flat_idx]
+        improved = block_best < best_cost
+        ratio_idx, offset_idx = np.unravel_index(flat_idx, cost.shape[1:])
+        best_cost[improved] = block_best[improved]
+        best_pars[improved, 0] = gain_table.ratios[ratio_idx[improved]]
+        best_pars[improved, 1] = block_offsets[offset_idx[improved]]
+        if fit_scale:
+            scale = (
+                cross[np.arange(len(gains)), ratio_idx, offset_idx]
+                / model_sq[ratio_idx, offset_idx]
+            )
+            best_pars[improved, 2] = scale[improved]
+        else:
+            best_pars[improved, 2] = 1
+
+    # Gauss-Newton refinement, vectorized over the sweeps
+    free_pars = 3 if fit_scale else 2
+    pars = best_pars.copy()
+    model, _ = _sweep_model_and_jacobian(phases, pars, swept)
+    cost = np.sum(np.square(gains - model), axis=1)
+    active = np.ones(len(gains), dtype=bool)
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        rows = np.where(active)[0]
+        model, jacobian = _sweep_model_and_jacobian(phases, pars[rows], swept)
+        jacobian = jacobian[:, :, :free_pars]
+        residuals = gains[rows] - model
+        jtj = np.einsum("mni,mnj->mij", jacobian, jacobian)
+        jtr = np.einsum("mni,mn->mi", jacobian, residuals)
+        step = (np.linalg.pinv(jtj) @ jtr[:, :, None])[:, :, 0]
+
+        new_pars = pars[rows].copy()
+        new_pars[:, :free_pars] += step
+        new_pars[:, 0] = np.clip(new_pars[:, 0], 0, 1 - 1e-9)
+        new_model, _ = _sweep_model_and_jacobian(phases, new_pars, swept)
+        new_cost = np.sum(np.square(gains[rows] - new_model), axis=1)
+
+        improved = new_cost < cost[rows]
+        pars[rows[improved]] = new_pars[improved]
+        converged = ~improved | ((cost[rows] - new_cost) <= tol * cost[rows])
+        cost[rows[improved]] = new_cost[improved]
+        active[rows[converged]] = False
+
+    pars[:, 1] = np.mod(pars[:, 1], 2 * np.pi)
+    return pars, cost
@@ -1,5 +1,6 @@
 import numpy as np
-from numpy.fft import fft, fftfreq, fftshift
+from numpy.fft import fft, fftfreq, fftshift, rfft, rfftfreq
+from numpy.lib.stride_tricks import as_strided
 from scipy.optimize import curve_fit
 from zhinstlib.data_processing import fitting_funcs
 
@@ -33,9 +34,8 @@ def power_spectrum(
     pspectrum = tstep * np.square(np.abs(fouried)) / chunk_len
 
     if shift_freq:
-        shifted = fftshift(np.row_stack((freq_axis, pspectrum)), axes=1)
-        freq_axis = shifted[0, :]
-        pspectrum = shifted[1:, :]
+        freq_axis = fftshift(freq_axis)
+        pspectrum = fftshift(pspectrum, axes=1)
 
     if return_average:
         pspectrum = pspectrum.mean(axis=0)
@@ -43,6 +43,168 @@ def power_spectrum(
     return freq_axis, pspectrum
 
 
+def _get_window(window, segment_len):
+    if isinstance(window, np.ndarray):
+        if len(window) != segment_len:
+            raise ValueError("The window length must match the segment length.")
+        return window
+    if window in ["boxcar", None]:
+        return np.ones(segment_len)
+    elif window == "hann":
+        return np.hanning(segment_len)
+    elif window == "hamming":
+        return np.hamming(segment_len)
+    elif window == "blackman":
+        return np.blackman(segment_len)
+    else:
+        raise ValueError(
+            f"The window {window} is not available. "
+            "Allowed values are 'hann', 'hamming', 'blackman', 'boxcar', or an array."
+        )
+
+
+class WelchAccumulator(object):
+    """
+    Computes the one-sided power spectral density with Welch's method: the signal is split into overlapping windowed
+    segments, and their periodograms are averaged. The signal can be fed block by block, the samples that do not fill
+    a complete segment are carried over to the next block. Only the running sum of the periodograms is kept in memory,
+    so the memory used does not depend on the signal length.
+    """
+
+    def __init__(
+        self,
+        sampling_rate,
+        segment_len,
+        overlap=0.5,
+        window="hann",
+        segments_per_batch=64,
+        workers=None,
+    ):
+        """
+        :param sampling_rate: the sampling rate of the signal, in Hz.
+        :param segment_len: int, the number of samples of each segment.
+        :param overlap: the overlap between consecutive segments, as a fraction of the segment length.
+        :param window: the window name ('hann', 'hamming', 'blackman', 'boxcar') or an array of length segment_len.
+        :param segments_per_batch: the number of segments that are transformed at once. Limits the memory used.
+        :param workers: optional, the number of threads used for the FFT. Requires scipy.fft, otherwise the numpy
+                        single-threaded FFT is used.
+        """
+        if not (0 <= overlap < 1):
+            raise ValueError("The overlap must be in the interval [0, 1).")
+        self.sampling_rate = sampling_rate
+        self.segment_len = int(segment_len)
+        self.step = max(int(round(self.segment_len * (1 - overlap))), 1)
+        self.segments_per_batch = segments_per_batch
+        self.window = _get_window(window, self.segment_len)
+        self.workers = workers
+        self._rfft = self._get_rfft()
+        self.reset()
+
+    def _get_rfft(self):
+        if self.workers is not None:
+            try:
+                from scipy import fft as scipy_fft
+
+                return lambda data: scipy_fft.rfft(data, axis=1, workers=self.workers)
+            except ImportError:
+                pass
+        return lambda data: rfft(data, axis=1)
+
+    def reset(self):
+        self._psd_sum = np.zeros(self.segment_len // 2 + 1)
+        self._carry = np.empty(0)
+        self.segment_num = 0
+
+    def update(self, block):
+        """
+        :param block: (N,) real array, the next block of the signal.
+        """
+        buffer = np.concatenate((self._carry, np.asarray(block, dtype=np.float64)))
+        if len(buffer) < self.segment_len:
+            self._carry = buffer
+            return
+
+        segment_num = (len(buffer) - self.segment_len) // self.step + 1
+        # A read-only view of the overlapping segments, no data are copied here
+        segments = as_strided(
+            buffer,
+            shape=(segment_num, self.segment_len),
+            strides=(buffer.strides[0] * self.step, buffer.strides[0]),
+            writeable=False,
+        )
+        for start in range(0, segment_num, self.segments_per_batch):
+            batch = segments[start : start + self.segments_per_batch] * self.window
+            transformed = self._rfft(batch)
+            self._psd_sum += np.square(transformed.real).sum(axis=0)
+            self._psd_sum += np.square(transformed.imag).sum(axis=0)
+
+        self.segment_num += segment_num
+        self._carry = buffer[segment_num * self.step :].copy()
+
+    def result(self):
+        """
+        :return: the frequency axis and the averaged one-sided power spectral density (in units^2/Hz).
+        """
+        if self.segment_num == 0:
+            raise Exception(
+                "No complete segment has been accumulated yet. Feed more data or decrease the segment length."
+            )
+        freq_axis = rfftfreq(self.segment_len, 1 / self.sampling_rate)
+        scaling = 1 / (self.sampling_rate * np.square(self.window).sum())
+        psd = self._psd_sum * scaling / self.segment_num
+        # All the bins are doubled except DC and, for even lengths, the Nyquist one
+        if self.segment_len % 2 == 0:
+            psd[1:-1] *= 2
+        else:
+            psd[1:] *= 2
+        return freq_axis, psd
+
+
+def welch_spectrum(
+    timetrace,
+    signal,
+    time_chunk=1,
+    overlap=0.5,
+    window="hann",
+    block_len=2 ** 20,
+    workers=None,
+):
+    """
+    Welch power spectral density of a signal. The signal is read block by block, so it can be a numpy memory-mapped
+    array or a h5py dataset, and it is never loaded in memory as a whole.
+    :param timetrace: the time axis, only the first two values are used to get the sampling rate. Alternatively, the
+                      sampling rate as a float.
+    :param signal: (N,) real array-like, supporting slicing.
+    :param time_chunk: the duration of each segment, in seconds.
+    :param overlap: the overlap between consecutive segments, as a fraction of the segment length.
+    :param window: the window applied to each segment.
+    :param block_len: the number of samples read at once.
+    :param workers: optional, the number of threads used for the FFT.
+    :return: the frequency axis and the one-sided power spectral density.
+    """
+    if np.isscalar(timetrace):
+        sampling_rate = timetrace
+    else:
+        sampling_rate = 1 / (timetrace[1] - timetrace[0])
+
+    segment_len = int(round(time_chunk * sampling_rate))
+    if segment_len > len(signal):
+        raise (
+            Exception(
+                "The requested time chunk exceeds the total signal length. Decrease the time_chunk value."
+            )
+        )
+
+    accumulator = WelchAccumulator(
+        sampling_rate, segment_len, overlap=overlap, window=window, workers=workers
+    )
+    block_len = max(int(block_len), segment_len)
+    for start in range(0, len(signal), block_len):
+        accumulator.update(signal[start : start + block_len])
+
+    return accumulator.result()
+
+
 def get_Q_factor(ringdown, res_freq, threshold=200e-6, *args, **kwargs):
     timetrace, decay = ringdown[:, 0], np.copy(ringdown[:, 1])
     decay /= decay.max()
@@ -53,6 +215,7 @@ def get_Q_factor(ringdown, res_freq, threshold=200e-6, *args, **kwargs):
 
     fit_guess = [gamma_guess, 0, 0, 1]
 
+    kwargs.setdefault("jac", fitting_funcs.nlin_rdown_jac)
     fit_result, _ = curve_fit(
         fitting_funcs.nlin_rdown, timetrace, decay, p0=fit_guess, *args, **kwargs
     )
@@ -0,0 +1,195 @@
+"""
+Peak finding and Lorentzian fits on many spectra at once, e.g. the chunk spectra returned by
+signals.power_spectrum(..., return_average=False). Every operation works on the whole (M, N) spectra matrix, so there
+is no python loop over the spectra.
+"""
+
+import numpy as np
+from zhinstlib.data_processing.fitting_funcs import lorentz_func, lorentz_func_jac
+
+
+def find_lorentzian_peaks(freq_axis, pspectra, freq_range=None):
+    """
+    Finds the highest peak of each spectrum and estimates its Lorentzian parameters.
+    :param freq_axis: (N,) array, the frequency axis. Must be monotonically increasing.
+    :param pspectra: (M, N) array, one spectrum per row. A (N,) array is treated as a single spectrum.
+    :param freq_range: optional, [min, max] frequency interval in which the peaks are searched.
+    :return: (M, 3) array of guesses [freq0, FWHM, amp], and the (M,) array of the spectra backgrounds.
+    """
+    pspectra = np.atleast_2d(pspectra)
+    bin_num = pspectra.shape[1]
+    freq_step = freq_axis[1] - freq_axis[0]
+
+    background = np.median(pspectra, axis=1)
+    search_spectra = pspectra
+    if freq_range is not None:
+        out_of_range = (freq_axis < freq_range[0]) | (freq_axis > freq_range[1])
+        search_spectra = np.where(out_of_range[None, :], -np.inf, pspectra)
+
+    rows = np.arange(pspectra.shape[0])
+    peak_idxs = np.argmax(search_spectra, axis=1)
+    amp = pspectra[rows, peak_idxs] - background
+
+    # Half maximum crossings on the left and right of each peak
+    bin_idxs = np.arange(bin_num)[None, :]
+    half_max = (background + amp / 2)[:, None]
+    below_half = pspectra < half_max
+    left_idxs = np.where(below_half & (bin_idxs < peak_idxs[:, None]), bin_idxs, -1)
+    left_idxs = left_idxs.max(axis=1)
+    right_idxs = np.where(
+        below_half & (bin_idxs > peak_idxs[:, None]), bin_idxs, bin_num
+    )
+    right_idxs = right_idxs.min(axis=1)
+
+    # Linear interpolation of the crossing points. If no crossing is found, the edge of the spectrum is used.
+    left_freq = _interpolate_crossing(
+        freq_axis, pspectra, rows, left_idxs, left_idxs + 1, half_max[:, 0]
+    )
+    right_freq = _interpolate_crossing(
+        freq_axis, pspectra, rows, right_idxs - 1, right_idxs, half_max[:, 0]
+    )
+    fwhm = np.maximum(right_freq - left_freq, freq_step)
+
+    guesses = np.column_stack((freq_axis[peak_idxs], fwhm, amp))
+    return guesses, background
+
+
+def _interpolate_crossing(freq_axis, pspectra, rows, idx_low, idx_high, level):
+    bin_num = len(freq_axis)
+    idx_low_c, idx_high_c = np.clip(idx_low, 0, bin_num - 1), np.clip(
+        idx_high, 0, bin_num - 1
+    )
+    val_low, val_high = pspectra[rows, idx_low_c], pspectra[rows, idx_high_c]
+    delta = val_high - val_low
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = np.where(delta != 0, (level - val_low) / delta, 0.5)
+    fraction = np.clip(fraction, 0, 1)
+    freq = freq_axis[idx_low_c] + fraction * (
+        freq_axis[idx_high_c] - freq_axis[idx_low_c]
+    )
+
+    # Crossing not found: use the edge of the spectrum
+    freq = np.where(idx_low < 0, freq_axis[0], freq)
+    freq = np.where(idx_high >= bin_num, freq_axis[-1], freq)
+    return freq
+
+
+def batch_lorentz_fit(
+    freq_axis,
+    pspectra,
+    p0,
+    background=None,
+    fit_span=5,
+    max_iter=100,
+    tol=1e-8,
+):
+    """
+    Fits a Lorentzian to every spectrum at once, with a vectorized Levenberg-Marquardt algorithm. Each spectrum has
+    its own damping factor, and the fits that have converged are not updated anymore.
+    :param freq_axis: (N,) array, the frequency axis.
+    :param pspectra: (M, N) array, one spectrum per row.
+    :param p0: (M, 3) array of initial guesses [freq0, FWHM, amp], e.g. from find_lorentzian_peaks.
+    :param background: optional, (M,) array subtracted from each spectrum before fitting.
+    :param fit_span: only the data within fit_span * FWHM (of the guess) from the peak are fitted.
+    :param max_iter: the maximum number of iterations.
+    :param tol: the relative decrease of the residuals below which a fit is considered converged.
+    :return: (M, 3) array of fit results [freq0, FWHM, amp], and the (M,) boolean array of the successful fits.
+    """
+    pspectra = np.atleast_2d(pspectra)
+    p0 = np.atleast_2d(np.asarray(p0, dtype=np.float64))
+    if background is not None:
+        pspectra = pspectra - np.asarray(background)[:, None]
+
+    # Only a window of bins around each peak is fitted. The windows are gathered in an (M, K) matrix, K being the
+    # widest window, and the bins outside the window of each spectrum get a zero weight.
+    bin_num = len(freq_axis)
+    freq_step = abs(freq_axis[1] - freq_axis[0])
+    center_idxs = np.clip(np.searchsorted(freq_axis, p0[:, 0]), 0, bin_num - 1)
+    half_widths = np.ceil(fit_span * np.abs(p0[:, 1]) / freq_step).astype(int)
+    max_half_width = min(int(half_widths.max()), bin_num // 2)
+    offsets = np.arange(-max_half_width, max_half_width + 1)[None, :]
+    window_idxs = center_idxs[:, None] + offsets
+    in_window = (
+        (np.abs(offsets) <= half_widths[:, None])
+        & (window_idxs >= 0)
+        & (window_idxs < bin_num)
+    )
+    window_idxs = np.clip(window_idxs, 0, bin_num - 1)
+    rows = np.arange(len(p0))[:, None]
+
+    # Work in coordinates normalized to the guess, so that the fit is well conditioned whatever the frequency scale
+    freq_scale, amp_scale = np.abs(p0[:, 1:2]), np.abs(p0[:, 2:3])
+    freq_scale[freq_scale == 0], amp_scale[amp_scale == 0] = 1, 1
+    x_norm = (freq_axis[window_idxs] - p0[:, 0:1]) / freq_scale
+    y_norm = pspectra[rows, window_idxs] / amp_scale
+    weights = in_window.astype(np.float64)
+
+    pars = np.tile(np.array([0.0, 1.0, 1.0]), (len(p0), 1))
+    damping = np.full(len(p0), 1e-3)
+    active = np.ones(len(p0), dtype=bool)
+    cost = _weighted_cost(x_norm, y_norm, weights, pars)
+
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        rows = np.where(active)[0]
+        x_act, y_act, w_act = x_norm[rows], y_norm[rows], weights[rows]
+        p_act = pars[rows]
+
+        residuals = w_act * (y_act - lorentz_func(x_act, *p_act.T[:, :, None]))
+        jacobian = w_act[:, :, None] * lorentz_func_jac(x_act, *p_act.T[:, :, None])
+        jtj = np.einsum("mni,mnj->mij", jacobian, jacobian)
+        jtr = np.einsum("mni,mn->mi", jacobian, residuals)
+
+        diag = np.einsum("mii->mi", jtj)
+        lhs = jtj + (damping[rows, None] * diag)[:, :, None] * np.eye(3)[None, :, :]
+        try:
+            step = np.linalg.solve(lhs, jtr[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            # At least one of the systems is singular, fall back to the pseudo-inverse
+            step = (np.linalg.pinv(lhs) @ jtr[:, :, None])[:, :, 0]
+
+        new_pars = p_act + step
+        new_cost = _weighted_cost(x_act, y_act, w_act, new_pars)
+        improved = new_cost < cost[rows]
+
+        converged = improved & ((cost[rows] - new_cost) <= tol * cost[rows])
+        pars[rows[improved]] = new_pars[improved]
+        cost[rows[improved]] = new_cost[improved]
+        damping[rows] = np.where(improved, damping[rows] / 10, damping[rows] * 10)
+
+        converged |= damping[rows] > 1e10  # No step reduces the cost anymore
+        active[rows[converged]] = False
+
+    pars[:, 1] = np.abs(pars[:, 1])
+    success = np.isfinite(pars).all(axis=1) & (pars[:, 2] > 0) & ~active
+
+    fit_result = np.column_stack(
+        (
+            p0[:, 0] + pars[:, 0] * freq_scale[:, 0],
+            pars[:, 1] * freq_scale[:, 0],
+            pars[:, 2] * amp_scale[:, 0],
+        )
+    )
+    return fit_result, success
+
+
+def _weighted_cost(x_norm, y_norm, weights, pars):
+    model = lorentz_func(x_norm, *pars.T[:, :, None])
+    return np.sum(np.square(weights * (y_norm - model)), axis=1)
+
+
+def fit_spectral_peaks(freq_axis, pspectra, freq_range=None, **kwargs):
+    """
+    Finds and fits the highest Lorentzian peak of each spectrum. Convenient to track the drift of a mode over the
+    chunk spectra of a long record.
+    :param freq_axis: (N,) array, the frequency axis.
+    :param pspectra: (M, N) array, one spectrum per row.
+    :param freq_range: optional, [min, max] frequency interval in which the peaks are searched.
+    :param kwargs: passed to batch_lorentz_fit.
+    :return: (M, 3) array of fit results [freq0, FWHM, amp], and the (M,) boolean array of the successful fits.
+    """
+    guesses, background = find_lorentzian_peaks(freq_axis, pspectra, freq_range)
+    return batch_lorentz_fit(
+        freq_axis, pspectra, guesses, background=background, **kwargs
+    )
@@ -0,0 +1,333 @@
+"""
+Chunkification of ringdown files that do not fit in memory. The reference is read block by block from the h5 file,
+and thresholded with a hysteresis, so that noise around the threshold does not produce spurious edges. The state of
+the reference and the pending chunk are carried from one block to the next, so the memory used only depends on the
+block size. The chunk boundaries are the same as with data_manip.chunk_boundaries: a chunk starts at a falling edge of
+the reference, and stops at the next rising edge. Since the demodulators may be sampled at different rates, the
+boundaries are also converted to timestamps, and mapped to the samples of each dataset from its own timestamps.
+"""
+
+import numpy as np
+import h5py
+
+
+class StreamingChunkifier(object):
+    def __init__(
+        self,
+        h5file,
+        reference_paths,
+        block_size=2**20,
+        hysteresis=0.2,
+        thresholds=None,
+        timestamp_path=None,
+    ):
+        """
+        :param h5file: the path of the h5 file.
+        :param reference_paths: list of the paths of the reference datasets. With a single path, the dataset is the
+                                reference. With two paths, e.g. the x and y quadratures, the reference is their
+                                modulus.
+        :param block_size: the number of samples read at once.
+        :param hysteresis: the width of the hysteresis band, as a fraction of the difference between the high and low
+                           levels of the reference.
+        :param thresholds: optional, the (low, high) thresholds. The reference switches to high above the high
+                           threshold, and to low below the low threshold. Estimated with estimate_thresholds if not
+                           provided.
+        :param timestamp_path: optional, the path of the timestamp dataset of the reference. Default is the timestamp
+                               dataset next to the first reference dataset, e.g. sample.x/timestamp.
+        """
+        self.h5file = h5file
+        self.reference_paths = list(reference_paths)
+        self.block_size = int(block_size)
+        self.hysteresis = hysteresis
+        self.thresholds = thresholds
+        if timestamp_path is None:
+            timestamp_path = _timestamp_path(self.reference_paths[0])
+        self.timestamp_path = timestamp_path
+        self.boundaries = np.zeros((0, 2), dtype=np.int64)
+        self.tick_boundaries = np.zeros((0, 2), dtype=np.int64)
+
+    @classmethod
+    def from_ringdown_file(cls, h5file, h5file_demodpath, reference_demod, **kwargs):
+        """
+        :param h5file: the path of a ringdown file, as written by the wafer analyzer.
+        :param h5file_demodpath: the path to the demodulators in the h5 file, e.g. dev1347/demods
+        :param reference_demod: the reference demodulator, in python indexing.
+        """
+        demod_path = f"{h5file_demodpath}/{reference_demod}"
+        return cls(
+            h5file,
+            [demod_path + "/sample.x/value", demod_path + "/sample.y/value"],
+            **kwargs,
+        )
+
+    def get_length(self, file):
+        return min(len(file[path]) for path in self.reference_paths)
+
+    def read_reference(self, file, start, stop):
+        """
+        :return: the reference between the samples start and stop.
+        """
+        blocks = [file[path][start:stop] for path in self.reference_paths]
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.hypot(blocks[0], blocks[1], out=blocks[0])
+
+    def iter_reference_blocks(self, file):
+        """
+        :return: generator of (index of the first sample, reference block).
+        """
+        sample_num = self.get_length(file)
+        for start in range(0, sample_num, self.block_size):
+            stop = min(start + self.block_size, sample_num)
+            yield start, self.read_reference(file, start, stop)
+
+    def estimate_thresholds(self, method="sample", sample_windows=32):
+        """
+        Estimates the low and high levels of the reference, and places the hysteresis band halfway between them.
+        :param method: 'sample' to read only sample_windows windows evenly spread along the file, or 'pass' to read
+                       the whole reference once.
+        :param sample_windows: the number of windows read with the 'sample' method. Each window is a
+                               block_size / sample_windows long.
+        :return: the (low, high) thresholds.
+        """
+        with h5py.File(self.h5file, "r") as file:
+            if method == "sample":
+                sample_num = self.get_length(file)
+                window = max(self.block_size // sample_windows, 1)
+                starts = np.linspace(
+                    0, max(sample_num - window, 0), sample_windows
+                ).astype(int)
+                sample = np.concatenate(
+                    [
+                        self.read_reference(file, start, start + window)
+                        for start in np.unique(starts)
+                    ]
+                )
+                low_level, high_level = np.percentile(sample, [1, 99])
+            elif method == "pass":
+                low_level, high_level = np.inf, -np.inf
+                for _, block in self.iter_reference_blocks(file):
+                    low_level = min(low_level, block.min())
+                    high_level = max(high_level, block.max())
+            else:
+                raise Exception("The method must be either 'sample' or 'pass'.")
+
+        middle = (low_level + high_level) / 2
+        half_band = self.hysteresis * (high_level - low_level) / 2
+        self.thresholds = (middle - half_band, middle + half_band)
+        return self.thresholds
+
+    def find_chunks(self):
+        """
+        Reads the reference block by block, and finds the chunk boundaries. The boundaries are also converted to the
+        timestamps of the reference, see tick_boundaries.
+        :return: (K, 2) int64 array of the [start, stop) sample indices of the chunks in the reference.
+        """
+        if self.thresholds is None:
+            self.estimate_thresholds()
+        low_threshold, high_threshold = self.thresholds
+
+        boundaries = []
+        previous_state = None  # The state of the last sample of the previous block
+        # The start of the chunk that has not been closed by a rising edge yet
+        chunk_start = None
+        sample_num = 0
+        with h5py.File(self.h5file, "r") as file:
+            for block_start, block in self.iter_reference_blocks(file):
+                sample_num = block_start + len(block)
+                state = _hysteresis_state(
+                    block, low_threshold, high_threshold, previous_state
+                )
+                if state is None:
+                    continue
+                if previous_state is None:
+                    previous_state = state[0]
+
+                # The edges are given by the index of the last sample before the state changes, as in chunk_boundaries
+                edges = np.diff(state, prepend=previous_state)
+                edge_idxs = np.where(edges != 0)[0]
+                for edge_idx in edge_idxs:
+                    boundary = block_start + edge_idx - 1
+                    if edges[edge_idx] < 0:
+                        chunk_start = boundary
+                    elif chunk_start is not None:
+                        boundaries.append((chunk_start, boundary))
+                        chunk_start = None
+                previous_state = state[-1]
+
+            if chunk_start is not None:
+                boundaries.append((chunk_start, sample_num))
+            self.boundaries = np.array(boundaries, dtype=np.int64).reshape(-1, 2)
+            self.tick_boundaries = self._boundary_ticks(file)
+
+        return self.boundaries
+
+    def _boundary_ticks(self, file):
+        """
+        :return: the timestamps of the boundary samples of the reference. The end of the last chunk, if it stops at
+                 the end of the file, is just after the last timestamp.
+        """
+        timestamps = file[self.timestamp_path]
+        sample_num = min(self.get_length(file), len(timestamps))
+        if len(self.boundaries) == 0:
+            return np.zeros((0, 2), dtype=timestamps.dtype)
+
+        boundary_idxs = self.boundaries.clip(0, sample_num)
+        # h5py only reads increasing indices
+        read_idxs, inverse = np.unique(
+            boundary_idxs.clip(0, sample_num - 1), return_inverse=True
+        )
+        ticks = timestamps[read_idxs][inverse].reshape(boundary_idxs.shape)
+        if boundary_idxs[-1, 1] == sample_num:
+            ticks[-1, 1] = _next_timestamp(timestamps[sample_num - 1])
+        return ticks
+
+    def map_boundaries(self, file, timestamp_path):
+        """
+        Maps the chunk boundaries to a demodulator that may be sampled at a different rate than the reference: each
+        boundary becomes the first sample at or after the boundary timestamp. The timestamps are read block by block.
+        :param timestamp_path: the path of the timestamp dataset of the demodulator.
+        :return: (K, 2) int64 array of the [start, stop) sample indices of the chunks in the demodulator.
+        """
+        if timestamp_path == self.timestamp_path:
+            return self.boundaries
+        timestamps = file[timestamp_path]
+        # The boundaries never decrease, so the ones found in a block are the first of the remaining ones
+        ticks = self.tick_boundaries.ravel()
+        indices = np.full(len(ticks), len(timestamps), dtype=np.int64)
+        found_num = 0
+        for block_start in range(0, len(timestamps), self.block_size):
+            if found_num == len(ticks):
+                break
+            block = timestamps[block_start : block_start + self.block_size]
+            block_indices = np.searchsorted(block, ticks[found_num:], side="left")
+            block_found = int(np.count_nonzero(block_indices < len(block)))
+            indices[found_num : found_num + block_found] = (
+                block_start + block_indices[:block_found]
+            )
+            found_num += block_found
+        return indices.reshape(-1, 2)
+
+    def write_chunk_index(self, output_file, group_name="chunk_index"):
+        """
+        Writes the chunk boundaries, as sample indices of the reference and as timestamps, with the thresholds and the
+        reference paths as attributes.
+        :param output_file: the path of the h5 file. Can be the input file itself.
+        :param group_name: the name of the group of the index.
+        """
+        with h5py.File(output_file, "a") as file:
+            if group_name in file:
+                del file[group_name]
+            group = file.create_group(group_name)
+            group.create_dataset("boundaries", data=self.boundaries)
+            group.create_dataset("tick_boundaries", data=self.tick_boundaries)
+            group.attrs["thresholds"] = self.thresholds
+            group.attrs["reference_paths"] = self.reference_paths
+            group.attrs["timestamp_path"] = self.timestamp_path
+            group.attrs["source_file"] = str(self.h5file)
+
+    def write_chunks(self, output_file, dataset_paths):
+        """
+        Copies the chunks of datasets of the input file to chunk0000/<dataset path>, chunk0001/<dataset path>, ... in
+        the output file. The copy is done block by block. The chunks of each dataset are mapped from the timestamp
+        dataset next to it, see map_boundaries, so the datasets can be sampled at different rates.
+        :param output_file: the path of the h5 file, different from the input file.
+        :param dataset_paths: the paths of the datasets to chunk, e.g. the signal quadratures and the timestamps.
+        """
+        with h5py.File(self.h5file, "r") as infile, h5py.File(
+            output_file, "a"
+        ) as outfile:
+            dataset_boundaries = dict()
+            for path in dataset_paths:
+                timestamp_path = _timestamp_path(path)
+                if timestamp_path not in infile:
+                    raise Exception(
+                        f"The dataset {path} has no timestamps, its chunks cannot be found."
+                    )
+                if timestamp_path not in dataset_boundaries:
+                    dataset_boundaries[timestamp_path] = self.map_boundaries(
+                        infile, timestamp_path
+                    )
+
+            for chunk_idx in range(len(self.boundaries)):
+                for path in dataset_paths:
+                    source = infile[path]
+                    start, stop = dataset_boundaries[_timestamp_path(path)][chunk_idx]
+                    stop = min(stop, len(source))
+                    target = outfile.create_dataset(
+                        f"chunk{chunk_idx:04d}/{path.lstrip('/')}",
+                        shape=(stop - start,),
+                        dtype=source.dtype,
+                    )
+                    for block_start in range(start, stop, self.block_size):
+                        block_stop = min(block_start + self.block_size, stop)
+                        target[block_start - start : block_stop - start] = source[
+                            block_start:block_stop
+                        ]
+
+
+def _timestamp_path(dataset_path):
+    """
+    :return: the path of the timestamp dataset of a signal dataset, e.g. sample.x/value -> sample.x/timestamp. A
+             timestamp dataset is its own timestamp.
+    """
+    parent, name = (
+        dataset_path.rsplit("/", 1) if "/" in dataset_path else ("", dataset_path)
+    )
+    if name == "timestamp":
+        return dataset_path
+    return f"{parent}/timestamp" if parent else "timestamp"
+
+
+def _next_timestamp(timestamp):
+    """
+    :return: the smallest timestamp after timestamp, for integer clock ticks or float seconds.
+    """
+    if np.issubdtype(np.asarray(timestamp).dtype, np.integer):
+        return timestamp + 1
+    return np.nextafter(timestamp, np.inf)
+
+
+def _hysteresis_state(block, low_threshold, high_threshold, initial_state=None):
+    """
+    :param block: the reference block.
+    :param initial_state: the state before the block, or None at the start of the trace.
+    :return: the 0/1 state of each sample: the state only changes when the reference crosses the threshold opposite
+             to the current state. None if the state is not determined anywhere in the block.
+    """
+    levels = np.full(len(block), -1, dtype=np.int8)
+    levels[block <= low_threshold] = 0
+    levels[block >= high_threshold] = 1
+
+    # Each undetermined sample takes the level of the last determined sample
+    last_determined = np.where(levels >= 0, np.arange(len(block)), -1)
+    np.maximum.accumulate(last_determined, out=last_determined)
+    if initial_state is None:
+        determined_idxs = np.where(last_determined >= 0)[0]
+        if len(determined_idxs) == 0:
+            return None
+        initial_state = levels[determined_idxs[0]]
+
+    return np.where(
+        last_determined >= 0, levels[last_determined.clip(0)], initial_state
+    ).astype(np.int8)
+
+
+def chunkify_ringdown_file(
+    h5file, h5file_demodpath, reference_demod, output_file=None, **kwargs
+):
+    """
+    Finds the chunks of a ringdown file without loading it in memory, and writes the chunk index table.
+    :param h5file: the path of the ringdown file.
+    :param h5file_demodpath: the path to the demodulators in the h5 file, e.g. dev1347/demods
+    :param reference_demod: the reference demodulator, in python indexing.
+    :param output_file: optional, the file of the chunk index. Default is the ringdown file itself.
+    :param kwargs: passed to StreamingChunkifier.
+    :return: (K, 2) array of the [start, stop) sample indices of the chunks.
+    """
+    chunkifier = StreamingChunkifier.from_ringdown_file(
+        h5file, h5file_demodpath, reference_demod, **kwargs
+    )
+    boundaries = chunkifier.find_chunks()
+    chunkifier.write_chunk_index(h5file if output_file is None else output_file)
+    return boundaries
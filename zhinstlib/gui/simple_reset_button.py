@@ -10,20 +10,25 @@ import os
 from pathlib import Path
 import PyQt5.QtWidgets as qwid
 import PyQt5.QtCore as qcore
-from helpers.helper_funcs import get_device_props
 from zhinstlib.core.zinst_device import ziVirtualDevice
-import time
+from zhinstlib.core.pid_watchdog import PIDWatchdog
+from zhinstlib.core.device_worker import DeviceWorker
 
 
 class ResetButton(qwid.QWidget):
     def __init__(self, *args, **kwargs):
         super(ResetButton, self).__init__(*args, **kwargs)
-        self.timer = qcore.QTimer()
-        self.timer.setInterval(500)
-        self.timer.timeout.connect(self.check_and_reset)
+        self.watchdog = None
 
         self.zinst_dev = None
         self.connected = False
+        # All the device calls run on the worker thread, so that a slow server does not freeze the buttons
+        self.device_worker = DeviceWorker(parent=self)
+        self.device_worker.signal_connected.connect(self.device_connected)
+        self.device_worker.signal_command_done.connect(self.command_done)
+        self.device_worker.signal_command_failed.connect(self.command_failed)
+        self._connect_future = None
+        self._reset_future = None
 
         layout = qwid.QVBoxLayout()
 
@@ -60,68 +65,76 @@ class ResetButton(qwid.QWidget):
     def connect_to_dev(self):
         if not self.connected:
             device_id = self.text_edit.text()
-            props = get_device_props(device_id)
 
-            dev = ziVirtualDevice(
-                device_id,
-                props["serveraddress"],
-                props["serverport"],
-                props["apilevel"],
+            self.text_edit.setDisabled(True)
+            self.connect_button.setDisabled(True)
+            self._connect_future = self.device_worker.connect_device(
+                ziVirtualDevice, device_id, timeout=30
             )
-
-            if dev is not None:
-                self.connected = True
-                self.zinst_dev = dev
-                print("Connected.")
-                self.text_edit.setDisabled(True)
-                self.connect_button.setDisabled(True)
         else:
             print("Already connected.")
 
+    @qcore.pyqtSlot(object)
+    def device_connected(self, dev):
+        self.connected = True
+        self.zinst_dev = dev
+        print("Connected.")
+
+    @qcore.pyqtSlot(object, object)
+    def command_done(self, future, result):
+        if future is self._reset_future:
+            self._reset_future = None
+            self.reset_button.setDisabled(self.watchdog is not None)
+
+    @qcore.pyqtSlot(object, object)
+    def command_failed(self, future, error):
+        if future is self._connect_future:
+            print(f"Failed connecting: {error}")
+            self.text_edit.setDisabled(False)
+            self.connect_button.setDisabled(False)
+        elif future is self._reset_future:
+            print(f"Failed resetting the PIDs: {error}")
+            self._reset_future = None
+            self.reset_button.setDisabled(self.watchdog is not None)
+        else:
+            print(f"Device command failed: {error}")
+
+    def get_checked_pids(self):
+        return [ii for ii, cbox in enumerate(self.check_box_list) if cbox.isChecked()]
+
     @qcore.pyqtSlot()
     def reset_pids(self):
-        for ii, cbox in enumerate(self.check_box_list):
-            if cbox.isChecked():
-                self.zinst_dev.set_pid_enabled(ii, False)
-                self.zinst_dev.sync()
-                self.zinst_dev.set_aux_offset(ii, 0)
-                self.zinst_dev.sync()
-                self.zinst_dev.set_pid_enabled(ii, True)
+        checked_pids = self.get_checked_pids()
+        if len(checked_pids):
+            # The button is enabled again once the reset is done
+            self.reset_button.setDisabled(True)
+            self._reset_future = self.device_worker.call("reset_pids", checked_pids)
 
     @qcore.pyqtSlot(bool)
     def automatic_pid_reset(self, btn_clicked):
 
         if btn_clicked:
             self.activate_buttons(set_active=btn_clicked)
-            self.timer.start()
+            # The watchdog runs on its own thread, and checks every block of streamed PID data
+            self.watchdog = PIDWatchdog(
+                self.zinst_dev, pid_list=self.get_checked_pids()
+            )
+            self.watchdog.start()
             print("Started listening.")
         else:
-            self.timer.stop()
+            if self.watchdog is not None:
+                self.watchdog.stop()
+                self.watchdog = None
             self.activate_buttons(set_active=btn_clicked)
             print("Stopped listening.")
 
-    @qcore.pyqtSlot()
-    def check_and_reset(self):
-        for ii, aux_chan in enumerate(self.check_box_list):
-            if aux_chan.isChecked():
-                offset = self.zinst_dev.get_aux_offset(ii)
-                if (offset < -9) or (offset > 9):
-                    self.zinst_dev.set_pid_enabled(ii, False)
-                    self.zinst_dev.set_aux_offset(ii, 0)
-
-                    self.zinst_dev.set_pid_enabled(ii, True)
-                    tod = time.localtime()
-                    tod_mins = f"0{tod.tm_min}" if tod.tm_min // 10 == 0 else tod.tm_min
-                    print(
-                        f"Reset event at {tod.tm_hour}:{tod.tm_min} of {tod.tm_mday}/{tod.tm_mon}/{tod.tm_year}"
-                    )
-
     def activate_buttons(self, set_active=True):
         self.reset_button.setDisabled(set_active)
         for cbox in self.check_box_list:
             cbox.setDisabled(set_active)
 
 
-app = qwid.QApplication([])
-button = ResetButton()
-sys.exit(app.exec())
+if __name__ == "__main__":
+    app = qwid.QApplication([])
+    button = ResetButton()
+    sys.exit(app.exec())
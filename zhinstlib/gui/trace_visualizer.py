@@ -1,7 +1,8 @@
-from PyQt5 import QtCore, QtWidgets, uic
+from PyQt5 import QtCore, QtWidgets
 import os
 from pathlib import Path
 import sys
+from zhinstlib.helpers.ui_loader import load_ui
 
 
 class test_window(QtWidgets.QMainWindow):
@@ -9,7 +10,7 @@ class test_window(QtWidgets.QMainWindow):
         super(test_window, self).__init__()
         this_dir = Path(__file__).parents[1]
         ui_file = this_dir / "ui_files" / "trace_viewer.ui"
-        uic.loadUi(ui_file, self)
+        load_ui(ui_file, self)
         self.show()
 
 
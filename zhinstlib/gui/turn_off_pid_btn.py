@@ -11,6 +11,7 @@ import PyQt5.QtWidgets as qwid
 import PyQt5.QtCore as qcore
 from zhinstlib.helpers.helper_funcs import get_device_props
 from zhinstlib.core.zinst_device import ziVirtualDevice
+from zhinstlib.core.device_worker import DeviceWorker
 import time
 
 
@@ -20,6 +21,11 @@ class TurnOffPID_btn(qwid.QWidget):
 
         self.zinst_dev = None
         self.connected = False
+        # All the device calls run on the worker thread, so that a slow server does not freeze the buttons
+        self.device_worker = DeviceWorker(parent=self)
+        self.device_worker.signal_connected.connect(self.device_connected)
+        self.device_worker.signal_command_failed.connect(self.command_failed)
+        self._connect_future = None
 
         layout = qwid.QVBoxLayout()
 
@@ -58,33 +64,46 @@ class TurnOffPID_btn(qwid.QWidget):
             device_id = self.text_edit.text()
             props = get_device_props(device_id)
 
-            dev = ziVirtualDevice(
+            self.text_edit.setDisabled(True)
+            self.connect_button.setDisabled(True)
+            self._connect_future = self.device_worker.connect_device(
+                ziVirtualDevice,
                 device_id,
+                False,
                 props["serveraddress"],
                 props["serverport"],
                 props["apilevel"],
+                timeout=30,
             )
-
-            if dev is not None:
-                self.connected = True
-                self.zinst_dev = dev
-                print("Connected.")
-                self.text_edit.setDisabled(True)
-                self.connect_button.setDisabled(True)
         else:
             print("Already connected.")
 
+    @qcore.pyqtSlot(object)
+    def device_connected(self, dev):
+        self.connected = True
+        self.zinst_dev = dev
+        print("Connected.")
+
+    @qcore.pyqtSlot(object, object)
+    def command_failed(self, future, error):
+        if future is self._connect_future:
+            print(f"Failed connecting: {error}")
+            self.text_edit.setDisabled(False)
+            self.connect_button.setDisabled(False)
+        else:
+            print(f"Device command failed: {error}")
+
     @qcore.pyqtSlot(bool)
     def turn_off_pids(self, value):
         btn_object = self.sender()
         pid_num = int(btn_object.text()[-1])
 
         if value:
-            self.zinst_dev.set_pid_enabled(pid_num, True)
+            self.device_worker.set("set_pid_enabled", pid_num, True)
         else:
-            self.zinst_dev.set_pid_enabled(pid_num, False)
+            self.device_worker.set("set_pid_enabled", pid_num, False)
             default_value = self.txt_edit_list[pid_num].text()
-            self.zinst_dev.set_aux_offset(pid_num, float(default_value))
+            self.device_worker.set("set_aux_offset", pid_num, float(default_value))
 
 
 app = qwid.QApplication([])
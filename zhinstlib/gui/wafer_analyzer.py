@@ -1,19 +1,31 @@
 import numpy as np
 from PyQt5.QtCore import pyqtSignal, pyqtSlot, QTimer, Qt
-from PyQt5.QtWidgets import QMainWindow, QCheckBox, QApplication, QButtonGroup
+from PyQt5.QtWidgets import (
+    QMainWindow,
+    QCheckBox,
+    QApplication,
+    QButtonGroup,
+    QLabel,
+    QInputDialog,
+)
 from PyQt5.QtGui import QIcon
-from PyQt5 import uic
 import os
 import sys
 from pathlib import Path
-from math import sqrt, floor
+from math import sqrt, floor, ceil
 import pyqtgraph as pg
-import re
 import h5py
 import datetime
-from operator import itemgetter
+import time
 
 from zhinstlib.core.zinst_device import PyQtziVirtualDevice
+from zhinstlib.core.device_worker import DeviceWorker
+from zhinstlib.core.live_buffers import LiveDemodBuffers
+from zhinstlib.core.acquisition_controller import (
+    AcquisitionController,
+    choose_burst_duration,
+)
+from zhinstlib.data_processing.online_fit import OnlineRingdownEstimator
 from zhinstlib.core.custom_data_containers import (
     LockinData,
     RingdownDataContainer,
@@ -22,8 +34,77 @@ from zhinstlib.core.custom_data_containers import (
 )
 from zhinstlib.custom_widgets.wafer_dialogs import WaferDialogGui, ChooseModeDialog
 from zhinstlib.custom_widgets.interactive_wafer import InteractiveWafer
-from zhinstlib.helpers.characterization_helpers import create_wafer
+from zhinstlib.helpers.characterization_helpers import (
+    read_wafer_info,
+    find_wafer_chips,
+    write_wafer_results,
+)
 from zhinstlib.custom_widgets.graph_widget_selbox import DownsamplerPlotDataItem
+from zhinstlib.custom_widgets.plot_refresher import PlotRefresher
+from zhinstlib.helpers.ui_loader import load_ui
+from zhinstlib.data_processing.file_io import RingdownFileWriter
+
+
+def _start_daq_acquisition(zi_device, demod_dictionary, demod_roles=None):
+    """
+    Runs on the device worker thread: sets the demod rates, subscribes a DAQ module, and starts it.
+    :param demod_dictionary: the demods (python indexing) as keys, and the lists of their signals as values.
+    :param demod_roles: optional, the roles of the demods for choose_demod_rates. By default, all the demods are
+                        recorded at the same rate.
+    :return: dictionary with the module name, the subscribed signal paths, their decimation factors, the applied
+             rate of the DAQ grid and the burst duration.
+    """
+    demods = list(demod_dictionary)
+    demod_rates = None
+    if demod_roles is not None:
+        demod_rates = zi_device.choose_demod_rates(demod_roles)
+        requested_rate = max(demod_rates.values())
+    else:
+        requested_rate = max(
+            zi_device.get_sampling_rate(demod, use_cache=True) for demod in demods
+        )
+    signal_num = sum(len(signals) for signals in demod_dictionary.values())
+    burst_duration = choose_burst_duration(requested_rate, signal_num)
+
+    module_name = zi_device.set_subscribe_daq(
+        demod_dictionary,
+        read_duration=9000,
+        burst_duration=burst_duration,
+        demod_rates=demod_rates,
+    )
+    # The rates applied by the device were read back by set_subscribe_daq
+    grid_rate = max(
+        zi_device.get_sampling_rate(demod, use_cache=True) for demod in demods
+    )
+    zi_device.sync()
+    zi_device.execute_daqmodule(module_name)
+    return {
+        "module_name": module_name,
+        "sig_paths": zi_device.daqmodules_sigs[module_name],
+        "decimation": zi_device.daqmodules_decimation[module_name],
+        "grid_rate": grid_rate,
+        "burst_duration": burst_duration,
+    }
+
+
+def _read_daq_acquisition(zi_device, module_name):
+    """
+    Runs on the device worker thread.
+    :return: the flat dictionary read from the DAQ module, and the time spent reading, in seconds.
+    """
+    read_start = time.perf_counter()
+    daq_data = zi_device.daqmodules[module_name].read(True)
+    return daq_data, time.perf_counter() - read_start
+
+
+def _stop_daq_acquisition(zi_device):
+    """
+    Runs on the device worker thread: stops and removes all the DAQ modules of the device, including a module whose
+    start timed out on the GUI side but completed on the device.
+    """
+    for module_name in list(zi_device.daqmodules):
+        zi_device.stop_daqmodule(module_name)
+        zi_device.remove_daqmodule(module_name)
 
 
 class WaferAnalyzer(QMainWindow):
@@ -35,7 +116,7 @@ class WaferAnalyzer(QMainWindow):
         super(WaferAnalyzer, self).__init__()
         self.this_dir = Path(__file__).resolve()
         ui_file = self.this_dir.parents[1] / "ui_files" / "wafer_analyzer.ui"
-        uic.loadUi(ui_file, self)
+        load_ui(ui_file, self)
 
         self.rows = 1
         self.cols = 1
@@ -54,22 +135,56 @@ class WaferAnalyzer(QMainWindow):
         self.waferfitcontainer = (
             WaferFitContainer()
         )  # A dict that stores in memory the fit results, even when the data are deleted
+        # Memory budget of the loaded data of each mode, in bytes. The least recently viewed chips are evicted
+        # beyond it, and reloaded when selected again.
+        self.memory_budget = 4e9
 
         # Setting and attributes used in the wafer creation mode
+        # The device is only called from the worker thread, through device_worker, so that the window stays
+        # responsive. The GUI thread only reads the attributes set at the connection, e.g. the clockbase.
         self.zi_device = None
-        self._saving_timeout = 2000
+        self.device_worker = DeviceWorker(parent=self)
+        self.device_worker.signal_connected.connect(self.device_connected)
+        self.device_worker.signal_command_done.connect(self.device_command_done)
+        self.device_worker.signal_command_failed.connect(self.device_command_failed)
+        self._connect_future = None
+        self._demods_future = None
+        self._start_future = None
+        self._read_future = None
+        # Adapts the read interval to the read and save times, and counts the lost samples
+        self._acquisition_controller = AcquisitionController()
+        self._last_read_duration = 0
         self._daqmodule_name = None
         self._sig_paths = None
+        self._saving_dir = Path()
+        self._subscribe_demods = []
         self._current_savefile = Path()
+        self._ringdown_writer = None
+
+        # Live view of the acquisition. The buffers cover roughly _live_view_seconds of data, and the plot is
+        # refreshed at most _live_view_fps times per second.
+        self._live_buffers = None
+        self._live_view_seconds = 120
+        self._live_view_points = 20000
+        self._live_view_fps = 10
+        self._live_view_timer = QTimer()
+        self._live_view_timer.setInterval(int(1000 / self._live_view_fps))
+        self._live_view_timer.timeout.connect(self.update_live_plot)
+        self._live_view_timer.timeout.connect(self.update_live_Q)
+        self._online_estimator = None
 
         self._saving_timer = QTimer()
         self._saving_timer.timeout.connect(self.acquire_data)
+        # The saving is connected first, so that the live view never delays it
         self.signal_data_acquired.connect(self.save_data, Qt.QueuedConnection)
+        self.signal_data_acquired.connect(self.feed_live_view, Qt.QueuedConnection)
+        self.signal_data_acquired.connect(self.feed_online_fit, Qt.QueuedConnection)
         self.signal_data_saved.connect(self.display_file_size, Qt.QueuedConnection)
         self.signal_data_uploaded.connect(
             self.set_loaded_cell_style, Qt.QueuedConnection
         )
         self.actionExportMode.triggered.connect(self.export_data)
+        self.actionSetMemoryBudget.triggered.connect(self.set_memory_budget)
         ######
 
         window_icon = QIcon(
@@ -125,6 +240,17 @@ class WaferAnalyzer(QMainWindow):
         self.dataPlotWidget.addItem(self.data_plot)
         self.dataPlotWidget.addItem(self.fit_plot)
 
+        # The plot data are prepared on a worker thread, and only the latest request is drawn
+        self.plot_refresher = PlotRefresher(
+            max_data=self.data_plot.max_data, parent=self
+        )
+        self.plot_refresher.signal_plot_ready.connect(self.draw_plot_data)
+
+        self.memoryLabel = QLabel()
+        self.statusBar().addPermanentWidget(self.memoryLabel)
+        self.acquisitionLabel = QLabel()
+        self.statusBar().addPermanentWidget(self.acquisitionLabel)
+
         # Signal connections
         self.executionButton.toggled.connect(self.set_chip_interaction)
         self.loadSelectedButton.clicked.connect(self.load_single_ringdown)
@@ -189,24 +315,17 @@ class WaferAnalyzer(QMainWindow):
         :param directory: the directory of the wafer
         """
         for mode in range(self.mode_num):
-            wcont = WaferDataContainer(mode)
+            wcont = WaferDataContainer(mode, memory_budget=self.memory_budget)
             self.wafer_list.append(wcont)
 
-        pattern_chip = r"([A-Z])(\d+)"
-        pattern_mode = r"mode(\d+)"
-        for wafer_directory_content in directory.iterdir():
-            if wafer_directory_content.is_dir():
-                match = re.match(pattern_chip, wafer_directory_content.name)
-                if match is not None:
-                    chipID = match.group(0)
-                    for chip_directory_content in wafer_directory_content.iterdir():
-                        match = re.match(pattern_mode, chip_directory_content.name)
-                        if match is not None:
-                            mode_num = int(match.group(1)) - 1
-                            self.wafer_list[mode_num].add_available_chip(chipID)
+        for mode_num, chipIDs in find_wafer_chips(directory).items():
+            for chipID in chipIDs:
+                self.wafer_list[mode_num].add_available_chip(chipID)
 
     def set_active_chip(self, id):
         self.active_chip = id
+        if self.wafer_list[self.active_mode].was_evicted(id):
+            self.load_ringdowns(id, self.active_mode)
         self.update_spinbox()
         self.refresh_plot()
 
@@ -251,26 +370,58 @@ class WaferAnalyzer(QMainWindow):
                 self.mode_num,
             )
             for ii in range(self.mode_num):
-                self.wafer_list.append(WaferDataContainer(ii))
+                self.wafer_list.append(
+                    WaferDataContainer(ii, memory_budget=self.memory_budget)
+                )
             self.connect_to_zurich(lockinID)
         elif self._creation_mode == 1:
             for ii in range(self.mode_num):
-                self.wafer_list.append(WaferDataContainer(ii))
+                self.wafer_list.append(
+                    WaferDataContainer(ii, memory_budget=self.memory_budget)
+                )
             self.connect_to_zurich(lockinID)
         self.add_wafer_layout()
 
     def connect_to_zurich(self, lockinID):
-        try:
-            self.zi_device = PyQtziVirtualDevice(lockinID)
-        except:
-            print(f"Failed connecting to {lockinID}. Aborted.")
-            self.abort_window()
-        demods = self.zi_device.get_available_demods()
-        self.add_demodulators(demods)
+        self.statusBar().showMessage(f"Connecting to {lockinID}...")
+        self._connect_future = self.device_worker.connect_device(
+            PyQtziVirtualDevice, lockinID, timeout=60
+        )
 
-        # Connect the signal required to stop or start the acquisition
-        self.executionButton.clicked.connect(self.initialize_daq_module)
-        self.executionButton.clicked.connect(self.stop_acquisition)
+    def device_connected(self, device):
+        self.zi_device = device
+        self._demods_future = self.device_worker.call("get_available_demods")
+
+    def device_command_done(self, future, result):
+        if future is self._demods_future:
+            self.statusBar().clearMessage()
+            self.add_demodulators(result)
+
+            # Connect the signal required to stop or start the acquisition
+            self.executionButton.clicked.connect(self.initialize_daq_module)
+            self.executionButton.clicked.connect(self.stop_acquisition)
+        elif future is self._start_future:
+            self._start_future = None
+            self.start_acquisition(result)
+        elif future is self._read_future:
+            # The reads that complete after the acquisition is stopped are not matched, and dropped
+            self._read_future = None
+            temp_data, self._last_read_duration = result
+            self.signal_data_acquired.emit(temp_data)
+
+    def device_command_failed(self, future, error):
+        if future is self._connect_future or future is self._demods_future:
+            print(f"Failed connecting to {self.zurich_id}: {error}. Aborted.")
+            self.abort_window()
+        elif future is self._start_future:
+            print(f"Failed starting the acquisition: {error}")
+            self.executionButton.setChecked(False)
+            self.stop_acquisition(False)
+        elif future is self._read_future:
+            self._read_future = None
+            print(f"Failed reading the acquisition: {error}")
+        else:
+            print(f"Device command failed: {error}")
 
     def initialize_daq_module(self, buttonval):
         if buttonval is not True:
@@ -284,8 +435,6 @@ class WaferAnalyzer(QMainWindow):
             )
             desired_signals = ["x", "y", "frequency"]
 
-            stream_read_kwargs = {"read_duration": 9000, "burst_duration": 0.5}
-
             subscribe_demods = []
             for chbox in self.demod_collection:
                 if chbox.isChecked():
@@ -301,84 +450,124 @@ class WaferAnalyzer(QMainWindow):
             demod_dictionary = dict(
                 zip(subscribe_demods, [desired_signals] * len(subscribe_demods))
             )
-
-            self._daqmodule_name = self.zi_device.set_subscribe_daq(
-                demod_dictionary, **stream_read_kwargs
-            )
-            self._sig_paths = self.zi_device.daqmodules_sigs[self._daqmodule_name]
-
-            ### Now create the saving folder if it doesn't exist
-            saving_dir.mkdir(parents=True, exist_ok=True)
-
-            ### Now create the h5 file. First get the h5 files in the folder, to pick the file name.
-            file_num = len(list(saving_dir.glob("*h5")))
-            file_num = str(file_num)
-            ringdown_name = (
-                4 - len(file_num)
-            ) * "0" + file_num  # Eg: file_num = 3, then ringdown_name = 0003
-            self._current_savefile = saving_dir / f"ringdown{ringdown_name}.h5"
-            with h5py.File(self._current_savefile, "w") as h5file:
-                h5kwargs = {"shape": (0,), "maxshape": (None,), "dtype": np.float64}
-                for path in self._sig_paths:
-                    h5file.create_dataset(name=path + "/timestamp", **h5kwargs)
-                    h5file.create_dataset(name=path + "/value", **h5kwargs)
-
+            self._saving_dir = saving_dir
+            self._subscribe_demods = subscribe_demods
             self.disableNonAcqWidgets(True)
-            ####Synchronize and start acquisition
-            self.zi_device.sync()
-            self.zi_device.execute_daqmodule(self._daqmodule_name)
-            self._saving_timer.start(self._saving_timeout)
+            self.statusBar().showMessage("Starting the acquisition...")
+            self._start_future = self.device_worker.submit(
+                _start_daq_acquisition,
+                self.zi_device,
+                demod_dictionary,
+                self.choose_demod_roles(subscribe_demods),
+                timeout=30,
+            )
         else:
             pass
             self.executionButton.setChecked(False)
 
-    def acquire_data(self):
-        temp_data = self.zi_device.daqmodules[self._daqmodule_name].read(True)
-        self.signal_data_acquired.emit(temp_data)
+    def start_acquisition(self, daq_settings):
+        """
+        Called once the DAQ module has been started by the device worker, see _start_daq_acquisition.
+        """
+        self.statusBar().clearMessage()
+        self._daqmodule_name = daq_settings["module_name"]
+        self._sig_paths = daq_settings["sig_paths"]
+        self._acquisition_controller = AcquisitionController(
+            burst_duration=daq_settings["burst_duration"]
+        )
 
-    def save_data(self, temp_data):
-        if isinstance(temp_data, dict):
-            returned_sig_paths = [
-                signal_path.lower() for signal_path in temp_data.keys()
-            ]
-        else:
-            return
+        # The file stays open in SWMR mode, so that it can be loaded during the acquisition
+        self._ringdown_writer = RingdownFileWriter(
+            self._saving_dir,
+            self._sig_paths,
+            clockbase=self.zi_device.clockbase,
+            decimation=daq_settings["decimation"],
+        )
+        self._current_savefile = self._ringdown_writer.savefile
 
-        for signal_path in self._sig_paths:
-            if signal_path in returned_sig_paths:
-                # If the subscribed signal is present in the read data paths, read it, and then append it to the
-                # h5 file.
-                time_ax_tot, value_tot = np.array([]), np.array([])
-                for ii, signal_burst in enumerate(temp_data[signal_path.lower()]):
-                    time_ax = signal_burst["timestamp"][0, :]
-                    value = signal_burst["value"][0, :]
+        self.start_live_view(self._subscribe_demods, daq_settings["grid_rate"])
+        self.start_online_fit(self._subscribe_demods)
+        self._saving_timer.start(int(1000 * self._acquisition_controller.read_interval))
 
-                    time_ax_tot = np.concatenate((time_ax_tot, time_ax))
-                    value_tot = np.concatenate((value_tot, value))
+    def choose_demod_roles(self, subscribed_demods):
+        """
+        With bandwidth-aware rates, the demod of the reference combobox only records the drive gate, and is sampled
+        slower than the signal demods.
+        :return: the demod roles of ziVirtualDevice.choose_demod_rates, or None to record all the demods at the same
+                 rate.
+        """
+        reference_text = self.referenceDemodComboBox.currentText()
+        if not self.actionBandwidthRates.isChecked() or reference_text == "":
+            return None
+        reference_demod = int(reference_text) - 1
+        if reference_demod not in subscribed_demods:
+            return None
+        return dict(
+            (demod, "reference" if demod == reference_demod else "signal")
+            for demod in subscribed_demods
+        )
 
-                with h5py.File(self._current_savefile, "a") as file:
-                    dset_time = file[signal_path + "/timestamp"]
-                    dset_value = file[signal_path + "/value"]
+    def acquire_data(self):
+        # A slow read is not queued again while it is still pending
+        if self._daqmodule_name is None or self._read_future is not None:
+            return
+        self._read_future = self.device_worker.submit(
+            _read_daq_acquisition, self.zi_device, self._daqmodule_name
+        )
 
-                    dset_time.resize((dset_time.shape[0] + len(time_ax_tot),))
-                    dset_value.resize((dset_value.shape[0] + len(value_tot),))
+    def save_data(self, temp_data):
+        if not isinstance(temp_data, dict) or self._ringdown_writer is None:
+            return
 
-                    dset_time[-len(time_ax_tot) :] = time_ax_tot
-                    dset_value[-len(value_tot) :] = value_tot
+        save_start = time.perf_counter()
+        self._ringdown_writer.append(temp_data)
+        self.refresh_live_ringdowns()
+        self.update_read_interval(
+            temp_data, self._last_read_duration, time.perf_counter() - save_start
+        )
 
         filesizeMb = self._current_savefile.stat().st_size / 1e6
         self.signal_data_saved.emit(filesizeMb)
 
+    def update_read_interval(self, temp_data, read_duration, save_duration):
+        """
+        Checks the read for lost samples, and adapts the interval of the next reads.
+        """
+        read_interval = self._acquisition_controller.record_read(
+            temp_data, read_duration, save_duration
+        )
+        if self._saving_timer.isActive():
+            self._saving_timer.setInterval(int(1000 * read_interval))
+        self.acquisitionLabel.setText(self._acquisition_controller.summary())
+
+    def refresh_live_ringdowns(self):
+        """
+        Reads the new samples of the file being recorded, if it has been loaded during the acquisition.
+        """
+        if self.chipandmode_areLoaded(self.active_chip, self.active_mode):
+            active_wafer = self.wafer_list[self.active_mode]
+            ringdown_container = active_wafer.get_ringdowns(self.active_chip)
+            if ringdown_container.refresh_live_ringdowns():
+                evicted_chips = active_wafer.update_chip_memory(self.active_chip)
+                self.remove_evicted_chips(self.active_mode, evicted_chips)
+
     def stop_acquisition(self, buttonval):
         if buttonval is False and self.active_chip:
-            if self._daqmodule_name:
-                self.zi_device.stop_daqmodule(self._daqmodule_name)
-                # Read one last time
-                self.zi_device.remove_daqmodule(self._daqmodule_name)
-                self._saving_timer.stop()
+            self._saving_timer.stop()
+            if self._daqmodule_name or self._start_future is not None:
+                # Queued after the start and the pending read, so that the module is stopped once it exists
+                self.device_worker.submit(_stop_daq_acquisition, self.zi_device)
+            self._start_future = None
+            self._read_future = None
+            if self._ringdown_writer is not None:
+                self._ringdown_writer.close()
+                self._ringdown_writer = None
+                self.refresh_live_ringdowns()
             self._daqmodule_name = None
             self._sig_paths = None
             self._current_savefile = Path()
+            self.stop_live_view()
+            self.stop_online_fit()
             self.display_file_size(0.0)
             self.disableNonAcqWidgets(False)
 
@@ -386,19 +575,137 @@ class WaferAnalyzer(QMainWindow):
         enabled = not value
         for chbox in self.demod_collection:
             chbox.setEnabled(enabled)
-        self.loadSelectedButton.setEnabled(enabled)
         self.loadAllButton.setEnabled(enabled)
         self.modeSelector.setEnabled(enabled)
-        self.ringdownSpinBox.setEnabled(enabled)
-        self.demodComboBox.setEnabled(enabled)
-        self.clearSelectedMemoryBtn.setEnabled(enabled)
         self.clearAllMemoryBtn.setEnabled(enabled)
-        self.chunkifyBtn.setEnabled(enabled)
-        self.fitBtn.setEnabled(enabled)
-        self.dataPlotWidget.setEnabled(enabled)
-        for btngroup in [self.quadratureRadioButtons, self.linlogRadioButtons]:
-            for button in btngroup.buttons():
-                button.setEnabled(enabled)
+        # The ringdowns of the active chip can still be loaded, chunkified and fitted during the acquisition, since
+        # the file being recorded is read in SWMR mode.
+        # The plot, the quadrature and the demod selection stay enabled, since they are used by the live view
+        self.linScaleRadioBtn.setEnabled(enabled)
+        self.logScaleRadioBtn.setEnabled(enabled)
+
+    def start_live_view(self, subscribed_demods, sampling_rate):
+        """
+        :param sampling_rate: the rate of the DAQ grid, in Hz.
+        """
+        decimation = ceil(
+            sampling_rate * self._live_view_seconds / self._live_view_points
+        )
+        self._live_buffers = LiveDemodBuffers(
+            capacity=self._live_view_points,
+            decimation=decimation,
+            clockbase=self.zi_device.clockbase,
+        )
+
+        self.plot_refresher.cancel()
+        self.fit_plot.clear()
+        self.data_plot.clear()
+        self.demodComboBox.blockSignals(True)
+        self.demodComboBox.clear()
+        for demod in subscribed_demods:
+            self.demodComboBox.addItem(str(demod + 1))
+        self.demodComboBox.blockSignals(False)
+
+        self._live_view_timer.start()
+
+    def stop_live_view(self):
+        self._live_view_timer.stop()
+        self._live_buffers = None
+        self.data_plot.clear()
+        self.demodComboBox.blockSignals(True)
+        self.demodComboBox.clear()
+        self.demodComboBox.blockSignals(False)
+        self.update_plotting_demod_comboboxes(self.ringdownSpinBox.value())
+
+    def feed_live_view(self, temp_data):
+        if self._live_buffers is not None and isinstance(temp_data, dict):
+            self._live_buffers.feed(temp_data)
+
+    def update_live_plot(self, force=False):
+        """
+        Called by the live view timer, so the plot is never refreshed faster than the live view frame rate.
+        """
+        if self._live_buffers is None:
+            return
+        if not (force or self._live_buffers.has_updates()):
+            return
+        if self.demodComboBox.currentText() == "":
+            return
+
+        demod = int(self.demodComboBox.currentText()) - 1
+        requested_quad = self.quadratureRadioButtons.checkedId()
+        live_data = self._live_buffers.get_quadrature(demod, requested_quad)
+        if live_data is None:
+            return
+
+        timestamp, plot_quad = live_data
+        if requested_quad == 3:
+            self.dataPlotWidget.setLabel("left", "Phase (rad)")
+        else:
+            # The live data are already a copy, they can be scaled in place
+            plot_quad *= 1e3
+            self.dataPlotWidget.setLabel("left", "Amplitude (mV)")
+        self.dataPlotWidget.setLabel("bottom", "Time (s)")
+        self.data_plot.setData(timestamp, plot_quad)
+
+    def start_online_fit(self, subscribed_demods):
+        """
+        The signal and reference demods are taken from the fit and reference comboboxes, when they match the
+        subscribed demods. Otherwise, the first subscribed demod is assumed to be the signal, the second the reference.
+        """
+        if len(subscribed_demods) < 2:
+            self._online_estimator = None
+            return
+
+        signal_demod, reference_demod = subscribed_demods[0], subscribed_demods[1]
+        for combobox in [self.fitDemodComboBox, self.referenceDemodComboBox]:
+            text = combobox.currentText()
+            if text == "" or (int(text) - 1) not in subscribed_demods:
+                break
+        else:
+            signal_demod = int(self.fitDemodComboBox.currentText()) - 1
+            reference_demod = int(self.referenceDemodComboBox.currentText()) - 1
+
+        self._online_estimator = OnlineRingdownEstimator(
+            signal_demod=signal_demod,
+            reference_demod=reference_demod,
+            clockbase=self.zi_device.clockbase,
+        )
+
+    def stop_online_fit(self):
+        if self._online_estimator is not None:
+            self._online_estimator = None
+            self.statusBar().clearMessage()
+            self.update_chip_info(self.active_mode, self.active_chip)
+
+    def feed_online_fit(self, temp_data):
+        if self._online_estimator is not None and isinstance(temp_data, dict):
+            self._online_estimator.feed(temp_data)
+
+    def update_live_Q(self):
+        """
+        Publishes the provisional frequency and Q of the chip being measured.
+        """
+        if self._online_estimator is None or not self._online_estimator.has_updates():
+            return
+        estimate = self._online_estimator.get_estimate()
+        if estimate is None:
+            return
+
+        frequency, Q = estimate
+        chip = self.interactive_wafer.chip_collection[self.active_chip]
+        chip.setText("f<sub>0</sub> = {:.3f} MHz".format(frequency / 1e6))
+        chip.append("Q ~ {:.3f} M (live)".format(Q / 1e6))
+
+        decay_num = len(self._online_estimator.completed_Qs)
+        if self._online_estimator.has_converged():
+            self.statusBar().showMessage(
+                f"Q converged after {decay_num} ringdowns: the measurement can be stopped."
+            )
+        else:
+            self.statusBar().showMessage(
+                f"Q not converged yet ({decay_num} ringdowns)."
+            )
 
     def set_wafer_mode_and_dir(self, directory, mode):
         if not isinstance(directory, Path):
@@ -422,18 +729,7 @@ class WaferAnalyzer(QMainWindow):
         """
         Called when loading an existing wafer, or appending mode.
         """
-        with open(directory / "wafer_info.txt", "r") as file:
-            for line in file.readlines():
-                if "Rows" in line:
-                    chip_rows = int(line.split(":")[1].strip())
-                elif "Columns" in line:
-                    chip_cols = int(line.split(":")[1].strip())
-                elif "Maximum mode number" in line:
-                    max_mode = int(line.split(":")[1].strip())
-                elif "Lock-in ID" in line:
-                    zurich_id = line.split(":")[1].strip()
-
-        return [chip_rows, chip_cols, max_mode, zurich_id]
+        return read_wafer_info(directory)
 
     def prepare_demodulatorselection_combobox(self):
         base_string = "Mode {:d}"
@@ -447,6 +743,7 @@ class WaferAnalyzer(QMainWindow):
     def set_active_mode(self, val):
         self.active_mode = val
         self.update_wafer_image()
+        self.update_memory_display()
 
     def update_wafer_image(self):
         active_wafer = self.wafer_list[self.active_mode]
@@ -514,9 +811,13 @@ class WaferAnalyzer(QMainWindow):
         else:
             ringdown_collection = RingdownDataContainer()
             for ringdown in ringdowns_in_path:
-                ringdown_collection.load_ringdown(ringdown, basepath)
+                is_recording = ringdown == self._current_savefile
+                ringdown_collection.load_ringdown(ringdown, basepath, swmr=is_recording)
 
-            current_wafer.add_ringdowns(active_chip, ringdown_collection)
+            evicted_chips = current_wafer.add_ringdowns(
+                active_chip, ringdown_collection
+            )
+            self.remove_evicted_chips(active_mode, evicted_chips)
 
             self.update_spinbox()
             self.signal_data_uploaded.emit(active_chip)
@@ -539,21 +840,24 @@ class WaferAnalyzer(QMainWindow):
         """
         Called when loading new data, when clicking the mode selector, when selecting a new chip, and when changin the ringdown.
         """
-        for combobox in [
-            self.demodComboBox,
-            self.referenceDemodComboBox,
-            self.fitDemodComboBox,
-        ]:
+        comboboxes = [self.referenceDemodComboBox, self.fitDemodComboBox]
+        if self._live_buffers is None:
+            # During the acquisition, the plotted demods are the recorded ones
+            comboboxes.insert(0, self.demodComboBox)
+        for combobox in comboboxes:
             previous_text = combobox.currentText()
             if self.chipandmode_areLoaded(self.active_chip, self.active_mode):
                 ringdown_container = self.wafer_list[self.active_mode].get_ringdowns(
                     self.active_chip
                 )
-                combobox.blockSignals(True)
-                combobox.clear()
                 availdemodlist = ringdown_container.get_ringdown_demods(
                     selected_ringdown - 1
                 )  # -1 because of python indexing
+                if len(availdemodlist) == 0:
+                    # A ringdown being recorded, with no sample flushed yet
+                    continue
+                combobox.blockSignals(True)
+                combobox.clear()
                 for demod in availdemodlist:
                     combobox.addItem(str(demod + 1))
 
@@ -566,7 +870,13 @@ class WaferAnalyzer(QMainWindow):
                 combobox.currentIndexChanged.emit(idx)
 
     def refresh_plot(self):
-        if self.chipandmode_areLoaded(self.active_chip, self.active_mode):
+        """
+        Requests a plot refresh. The requests are debounced and the data are prepared on a worker thread, the plot
+        is then updated in draw_plot_data.
+        """
+        if self._live_buffers is not None:
+            self.update_live_plot(force=True)
+        elif self.chipandmode_areLoaded(self.active_chip, self.active_mode):
             ringdown_container = self.wafer_list[self.active_mode].get_ringdowns(
                 self.active_chip
             )
@@ -578,37 +888,29 @@ class WaferAnalyzer(QMainWindow):
             rdown_data = ringdown_container.ringdown(curr_rdown).demod(curr_demod)
 
             requested_quad = self.quadratureRadioButtons.checkedId()
+            self.plot_refresher.request(rdown_data, requested_quad)
 
-            timestamp = rdown_data.time_axis
-            if requested_quad == 2:
-                plot_quad = rdown_data.r_quad * 1e3  # Convert the quadrature in mV
-                self.dataPlotWidget.setLabel("left", "Amplitude (mV)")
-            elif requested_quad == 0:
-                plot_quad = rdown_data.x_quad * 1e3
-                self.dataPlotWidget.setLabel("left", "Amplitude (mV)")
-            elif requested_quad == 1:
-                plot_quad = rdown_data.y_quad * 1e3
-                self.dataPlotWidget.setLabel("left", "Amplitude (mV)")
-            elif requested_quad == 3:
-                plot_quad = rdown_data.phase_quad
-                self.dataPlotWidget.setLabel("left", "Phase (rad)")
-            self.dataPlotWidget.setLabel("bottom", "Time (s)")
-
-            self.dataPlotWidget.disableAutoRange()
-            self.data_plot.setData(timestamp, plot_quad)
-            if (requested_quad == 2) and rdown_data.isFitted():
-                fit_data = rdown_data.get_fitted_data()
-                self.fit_plot.setData(fit_data[0], fit_data[1] * 1e3)
-            else:
-                self.fit_plot.clear()
-            self.dataPlotWidget.autoRange()
+    def draw_plot_data(self, plot_data):
+        self.dataPlotWidget.setLabel("left", plot_data["ylabel"])
+        self.dataPlotWidget.setLabel("bottom", "Time (s)")
+
+        self.dataPlotWidget.disableAutoRange()
+        self.data_plot.setData(plot_data["x"], plot_data["y"])
+        if plot_data["fit"] is not None:
+            self.fit_plot.setData(plot_data["fit"][0], plot_data["fit"][1])
+        else:
+            self.fit_plot.clear()
+        self.dataPlotWidget.autoRange()
 
     def display_file_size(self, filesize):
         if self._current_savefile is not None:
             self.fileSizeDisplay.setValue(filesize)
 
     def set_loaded_cell_style(self, chipID):
-        self.interactive_wafer.chip_collection[chipID].setDataUploaded(True)
+        # The chip may have been evicted since the signal was emitted
+        self.interactive_wafer.chip_collection[chipID].setDataUploaded(
+            self.chipandmode_areLoaded(chipID, self.active_mode)
+        )
 
     def set_not_loaded_cell_style(self, chipID):
         self.interactive_wafer.chip_collection[chipID].setDataUploaded(False)
@@ -616,9 +918,11 @@ class WaferAnalyzer(QMainWindow):
     def clear_memory(self):
         active_wafer = self.wafer_list[self.active_mode]
         active_wafer.clear_data()
+        self.plot_refresher.cancel()
         self.update_wafer_image()
         self.fit_plot.clear()
         self.data_plot.clear()
+        self.update_memory_display()
 
     def clear_memory_selected(self):
         active_chip, active_mode = self.active_chip, self.active_mode
@@ -626,9 +930,52 @@ class WaferAnalyzer(QMainWindow):
         #    self.loaded_data[active_chip].pop(active_mode)
         #    self.interactive_wafer.chip_collection[active_chip].setDataUploaded(False)
         self.wafer_list[active_mode].clear_chip(active_chip)
+        self.plot_refresher.cancel()
         self.update_wafer_image()
         self.fit_plot.clear()
         self.data_plot.clear()
+        self.update_memory_display()
+
+    def remove_evicted_chips(self, mode, evicted_chips):
+        """
+        Updates the wafer after chips have been evicted to stay within the memory budget.
+        """
+        if mode == self.active_mode:
+            for chipID in evicted_chips:
+                self.set_not_loaded_cell_style(chipID)
+            if self.active_chip in evicted_chips:
+                self.plot_refresher.cancel()
+                self.fit_plot.clear()
+                self.data_plot.clear()
+        self.update_memory_display()
+
+    def update_memory_display(self):
+        if len(self.wafer_list) == 0:
+            return
+        active_wafer = self.wafer_list[self.active_mode]
+        memory_MB = active_wafer.get_memory_usage() / 1e6
+        memory_text = f"Mode {self.active_mode + 1} data: {memory_MB:.0f} MB"
+        if active_wafer.memory_budget is not None:
+            memory_text += f" / {active_wafer.memory_budget / 1e6:.0f} MB"
+        self.memoryLabel.setText(memory_text)
+
+    def set_memory_budget(self):
+        current_budget = 0 if self.memory_budget is None else self.memory_budget
+        budget_MB, accepted = QInputDialog.getInt(
+            self,
+            "Memory budget",
+            "Memory budget of each mode in MB (0 for no limit):",
+            int(current_budget / 1e6),
+            0,
+            1000000,
+        )
+        if not accepted:
+            return
+
+        self.memory_budget = None if budget_MB == 0 else budget_MB * 1e6
+        for wafer in self.wafer_list:
+            evicted_chips = wafer.set_memory_budget(self.memory_budget)
+            self.remove_evicted_chips(wafer.mode, evicted_chips)
 
     def chipandmode_areLoaded(self, chip, mode):
         isloaded = chip in self.wafer_list[mode].get_loaded_chips()
@@ -648,6 +995,10 @@ class WaferAnalyzer(QMainWindow):
             while not ringdowndata.ringdown(0).isChunkified():
                 ringdowndata.chunkify_ringdown(selected_ringdown_idx, reference_demod)
 
+            self.remove_evicted_chips(
+                self.active_mode,
+                self.wafer_list[self.active_mode].update_chip_memory(self.active_chip),
+            )
             self.update_spinbox()
             self.refresh_plot()
 
@@ -674,12 +1025,16 @@ class WaferAnalyzer(QMainWindow):
                 ringdown_idx = 0
                 while not ringdowndata.ringdown(0).isChunkified():
                     ringdowndata.chunkify_ringdown(ringdown_idx, reference_demod)
+            evicted_chips = current_wafer.update_chip_memory(self.active_chip)
+            self.remove_evicted_chips(self.active_mode, evicted_chips)
         elif action_type == 2:
             for loaded_chip in current_wafer.get_loaded_chips():
                 ringdowndata = current_wafer.get_ringdowns(loaded_chip)
                 ringdown_idx = 0
                 while not ringdowndata.ringdown(0).isChunkified():
                     ringdowndata.chunkify_ringdown(ringdown_idx, reference_demod)
+                evicted_chips = current_wafer.update_chip_memory(loaded_chip)
+                self.remove_evicted_chips(self.active_mode, evicted_chips)
 
         self.update_spinbox()
         self.refresh_plot()
@@ -775,21 +1130,4 @@ class WaferAnalyzer(QMainWindow):
             / "results"
             / f"mode{self.active_mode+1}"
         )
-        result_dir.mkdir(parents=True, exist_ok=True)
-
-        create_wafer(
-            result_dir / "wafer_image.png",
-            cells=(self.rows, self.cols),
-            chip_data=data_list,
-            pad_letter=0.01,
-        )
-
-        sortbyfirstfunc = itemgetter(0)
-        sorted_list = sorted(data_list, key=sortbyfirstfunc)
-        with open(result_dir / "result_data.txt", "w") as file:
-            header = "%chipID\tFrequency (MHz)\tQ\tAdditional info\n"
-            file.write(header)
-            for line in sorted_list:
-                line[1] /= 1e6
-                line[2] /= 1e6
-                file.write("{}\t{:.3f}\t{:.1f}\t{}\n".format(*line))
+        write_wafer_results(result_dir, (self.rows, self.cols), data_list)
@@ -1,8 +1,10 @@
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle, Circle
-from zhinstlib.data_processing.fitting_funcs import nlin_rdown
+import numpy as np
+from zhinstlib.data_processing.fitting_funcs import nlin_rdown, get_jacobian
 from inspect import signature
 from math import sqrt
+from operator import itemgetter
+from pathlib import Path
+import re
 
 
 def create_wafer(
@@ -26,6 +28,10 @@ def create_wafer(
     :param figsize:
     :return:
     """
+    # matplotlib is slow to import, and only needed here
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle, Circle
+
     chip_info = [[None for jj in range(cells[1])] for ii in range(cells[0])]
 
     for data in chip_data:
@@ -150,6 +156,7 @@ def create_wafer(
                 ax.add_artist(recty)
 
     plt.savefig(savedir, bbox_inches="tight")
+    plt.close(fig)
 
 
 def get_Q_factor(
@@ -168,11 +175,14 @@ def get_Q_factor(
     :param ringdown: (n,2) np.ndarray, containing the time axis and the ringdown data
     :param res_freq: The resonance frequency
     :param threshold: The threshold that's used to remove the background when estimating the gamma from the data
-    :param fitting_func: The function to be used to fit the data
+    :param fitting_func: The function to be used to fit the data. If it is one of the functions in fitting_funcs,
+                         its analytic Jacobian is passed to curve_fit.
     :param args: Passed to the core scipy.optimize.curve_fit function
     :param kwargs: Passed to the core scipy.optimize.curve_fit function
     :return: Tuple containing (best fit estimates, Q factor, covariance matrix)
     """
+    from scipy.optimize import curve_fit
+
     timetrace, decay = ringdown[:, 0], ringdown[:, 1]
     decay /= decay.max()
     data_above_thresh = decay[decay > threshold]
@@ -181,17 +191,91 @@ def get_Q_factor(
     ).mean()
 
     if p0_nogamma is None:
-        p0_nogamma = [1,] * len(
-            signature(fitting_func).parameters
-        ) - 2  # -2 because x axis and decay are excluded
+        p0_nogamma = [1,] * (
+            len(signature(fitting_func).parameters) - 2
+        )  # -2 because x axis and decay are excluded
     fit_guess = [gamma_guess] + p0_nogamma
     if fit_guess[0] < 0:
         print("Negative derivative estimated. Avoided fitting.")
-        fit_result, Q_factor = None, None
+        fit_result, Q_factor, cov_mat = None, None, None
     else:
+        if get_jacobian(fitting_func) is not None:
+            kwargs.setdefault("jac", get_jacobian(fitting_func))
         fit_result, cov_mat = curve_fit(
             fitting_func, timetrace, decay, p0=fit_guess, *args, **kwargs
         )
 
         Q_factor = 2 * np.pi * res_freq / fit_result[0]
     return fit_result, Q_factor, cov_mat
+
+
+def read_wafer_info(directory):
+    """
+    Reads the wafer_info.txt file of a wafer directory.
+    :param directory: the wafer directory.
+    :return: [chip rows, chip columns, maximum mode number, lock-in ID]
+    """
+    with open(Path(directory) / "wafer_info.txt", "r") as file:
+        for line in file.readlines():
+            if "Rows" in line:
+                chip_rows = int(line.split(":")[1].strip())
+            elif "Columns" in line:
+                chip_cols = int(line.split(":")[1].strip())
+            elif "Maximum mode number" in line:
+                max_mode = int(line.split(":")[1].strip())
+            elif "Lock-in ID" in line:
+                zurich_id = line.split(":")[1].strip()
+
+    return [chip_rows, chip_cols, max_mode, zurich_id]
+
+
+def find_wafer_chips(directory):
+    """
+    Finds the chips of a wafer directory which have a folder for a mode, e.g. A3/mode1.
+    :param directory: the wafer directory.
+    :return: dictionary with the modes (python indexing) as keys, and the lists of chip IDs as values.
+    """
+    pattern_chip = r"([A-Z])(\d+)"
+    pattern_mode = r"mode(\d+)"
+    chips_per_mode = dict()
+    for wafer_directory_content in Path(directory).iterdir():
+        if wafer_directory_content.is_dir():
+            match = re.match(pattern_chip, wafer_directory_content.name)
+            if match is not None:
+                chipID = match.group(0)
+                for chip_directory_content in wafer_directory_content.iterdir():
+                    match = re.match(pattern_mode, chip_directory_content.name)
+                    if match is not None:
+                        mode_num = int(match.group(1)) - 1
+                        chips_per_mode.setdefault(mode_num, []).append(chipID)
+    return chips_per_mode
+
+
+def write_wafer_results(result_dir, cells, data_list):
+    """
+    Exports the results of a mode: the wafer image, and the result_data.txt table.
+    :param result_dir: the directory into which the results are saved. Created if it does not exist.
+    :param cells: (rows, columns) of the wafer.
+    :param data_list: list of [chip ID, frequency, Q, additional info].
+    """
+    result_dir = Path(result_dir)
+    result_dir.mkdir(parents=True, exist_ok=True)
+
+    create_wafer(
+        result_dir / "wafer_image.png",
+        cells=cells,
+        chip_data=data_list,
+        pad_letter=0.01,
+    )
+
+    sortbyfirstfunc = itemgetter(0)
+    sorted_list = sorted(data_list, key=sortbyfirstfunc)
+    with open(result_dir / "result_data.txt", "w") as file:
+        header = "%chipID\tFrequency (MHz)\tQ\tAdditional info\n"
+        file.write(header)
+        for line in sorted_list:
+            file.write(
+                "{}\t{:.3f}\t{:.1f}\t{}\n".format(
+                    line[0], line[1] / 1e6, line[2] / 1e6, line[3]
+                )
+            )
@@ -1,10 +1,11 @@
-import zhinst.ziPython as zi
 import h5py
 import inspect
 from pathlib import Path
 
 
 def get_device_props(device_id):
+    import zhinst.ziPython as zi
+
     discovery = zi.ziDiscovery()
     device_id = discovery.find(device_id)
     device_props = discovery.get(device_id)
@@ -0,0 +1,45 @@
+from pathlib import Path
+import importlib.util
+
+ui_directory = Path(__file__).resolve().parents[1] / "ui_files"
+compiled_directory = ui_directory / "compiled"
+
+
+def compiled_ui_path(ui_file):
+    """
+    :param ui_file: the path of the .ui file.
+    :return: the path of the python module compiled from the .ui file by utilities/compile_ui.py.
+    """
+    return compiled_directory / ("ui_" + Path(ui_file).stem + ".py")
+
+
+def load_ui(ui_file, widget):
+    """
+    Sets up the widget from a Qt designer file. If the compiled module of the .ui file exists and is newer than the
+    .ui file, the module is used, which avoids parsing the xml at every startup. Otherwise, the .ui file is loaded
+    with uic.loadUi.
+    :param ui_file: the path of the .ui file.
+    :param widget: the widget to set up.
+    """
+    ui_file = Path(ui_file)
+    compiled_file = compiled_ui_path(ui_file)
+
+    if (
+        compiled_file.is_file()
+        and compiled_file.stat().st_mtime >= ui_file.stat().st_mtime
+    ):
+        spec = importlib.util.spec_from_file_location(compiled_file.stem, compiled_file)
+        ui_module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(ui_module)
+        ui_class = [
+            getattr(ui_module, name) for name in dir(ui_module) if name.startswith("Ui_")
+        ][0]
+        ui_instance = ui_class()
+        ui_instance.setupUi(widget)
+        # Unlike uic.loadUi, setupUi stores the child widgets in the ui instance: make them attributes of the widget
+        for name, child in vars(ui_instance).items():
+            setattr(widget, name, child)
+    else:
+        from PyQt5 import uic
+
+        uic.loadUi(str(ui_file), widget)
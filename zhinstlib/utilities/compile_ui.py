@@ -0,0 +1,22 @@
+"""
+Compiles the Qt designer files of ui_files into python modules, in ui_files/compiled. The GUIs load the compiled
+modules when they are up to date, which is faster than parsing the .ui files at every startup. Run it again after
+editing a .ui file: stale modules are ignored, and the .ui file is parsed instead.
+"""
+from PyQt5 import uic
+from zhinstlib.helpers.ui_loader import ui_directory, compiled_directory
+
+
+def compile_ui_files():
+    compiled_directory.mkdir(exist_ok=True)
+
+    def map_to_compiled(directory, module_name):
+        return str(compiled_directory), "ui_" + module_name
+
+    uic.compileUiDir(str(ui_directory), map=map_to_compiled)
+
+
+if __name__ == "__main__":
+    compile_ui_files()
+    for compiled_file in sorted(compiled_directory.glob("ui_*.py")):
+        print(f"Compiled {compiled_file.name}")
@@ -0,0 +1,96 @@
+"""
+Compares the time needed to hand the data of a demodulator to a worker process, either pickled or in shared memory,
+for typical ringdown sizes. In both cases, the worker computes the maximum amplitude and returns it, so that only the
+transfer differs. Usage:
+
+    python zhinstlib/utilities/shared_memory_benchmark.py --samples 100000 1000000 10000000
+"""
+
+import argparse
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from zhinstlib.core.custom_data_containers import DemodulatorDataContainer, TimeAxis
+from zhinstlib.core.shared_arrays import SharedArrayRegistry
+
+
+def _pickled_task(demod_data):
+    return float(demod_data.r_quad.max())
+
+
+def _shared_task(shared_state):
+    demod_data = DemodulatorDataContainer.from_shared(shared_state)
+    max_amplitude = float(demod_data.r_quad.max())
+    demod_data.close_shared()
+    return max_amplitude
+
+
+def make_demod_data(sample_num, sampling_rate=13.4e3, clockbase=60e6):
+    """
+    :return: a DemodulatorDataContainer with a decay of sample_num samples.
+    """
+    time_axis = TimeAxis(0, clockbase / sampling_rate, sample_num, clockbase)
+    decay = np.exp(-np.arange(sample_num) / sample_num)
+    demod_data = DemodulatorDataContainer(
+        time_axis=time_axis,
+        x_quad=decay * np.cos(0.1),
+        y_quad=decay * np.sin(0.1),
+        frequency=1e6,
+    )
+    demod_data.get_ampphase_quads()
+    return demod_data
+
+
+def measure_transfer(executor, task, argument, repeats):
+    """
+    :return: the shortest round trip time of the task in the worker process, in seconds.
+    """
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        executor.submit(task, argument).result()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare pickled and shared memory transfers of demodulator data to a worker process."
+    )
+    parser.add_argument(
+        "--samples", type=int, nargs="+", default=[100000, 1000000, 10000000]
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    registry = SharedArrayRegistry()
+    print(
+        f"{'samples':>10} {'MB':>8} {'pickled (s)':>12} {'shared (s)':>12} {'to shared (s)':>14}"
+    )
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        executor.submit(time.sleep, 0).result()  # Start the worker before timing
+        for sample_num in args.samples:
+            demod_data = make_demod_data(sample_num)
+            data_MB = demod_data.nbytes() / 1e6
+            pickled_time = measure_transfer(
+                executor, _pickled_task, demod_data, args.repeats
+            )
+
+            # Moving the data to shared memory is a one-off copy, paid once and not at each transfer
+            start = time.perf_counter()
+            shared_state = demod_data.to_shared(registry)
+            to_shared_time = time.perf_counter() - start
+            shared_time = measure_transfer(
+                executor, _shared_task, shared_state, args.repeats
+            )
+            demod_data.release_shared(registry, keep_data=False)
+
+            print(
+                f"{sample_num:>10d} {data_MB:>8.1f} {pickled_time:>12.4f} {shared_time:>12.4f} "
+                f"{to_shared_time:>14.4f}"
+            )
+    registry.release_all()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Measures the cold start time of the wafer analyzer, in a fresh interpreter, and appends the result to a csv log so
+that the startup time can be tracked over time. Also logs whether the heavy optional modules were imported.
+"""
+import subprocess
+import sys
+import os
+import csv
+import datetime
+import argparse
+from pathlib import Path
+
+_startup_script = """
+import time
+start = time.perf_counter()
+import sys
+from PyQt5.QtWidgets import QApplication
+from zhinstlib.gui.wafer_analyzer import WaferAnalyzer
+import_time = time.perf_counter() - start
+app = QApplication(sys.argv)
+window = WaferAnalyzer()
+app.processEvents()
+total_time = time.perf_counter() - start
+heavy_modules = [mod for mod in ("zhinst", "matplotlib", "scipy") if mod in sys.modules]
+print(import_time, total_time, "+".join(heavy_modules))
+"""
+
+
+def measure_startup(offscreen=False):
+    """
+    :param offscreen: if True, Qt draws offscreen, e.g. to run the benchmark without a display.
+    :return: the import time and the total time to the first processed events, in seconds, and the heavy modules
+             that were imported.
+    """
+    environment = os.environ.copy()
+    environment["PYTHONPATH"] = os.pathsep.join(
+        [str(Path(__file__).resolve().parents[2]), environment.get("PYTHONPATH", "")]
+    )
+    if offscreen:
+        environment["QT_QPA_PLATFORM"] = "offscreen"
+
+    output = subprocess.run(
+        [sys.executable, "-c", _startup_script],
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    import_time, total_time, heavy_modules = (
+        output.stdout.strip().splitlines()[-1].split(" ") + [""]
+    )[:3]
+    return float(import_time), float(total_time), heavy_modules
+
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the cold start time of the wafer analyzer."
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--log-file", default=str(Path(__file__).resolve().parent / "startup_log.csv")
+    )
+    parser.add_argument("--offscreen", action="store_true")
+    args = parser.parse_args()
+
+    results = [measure_startup(args.offscreen) for _ in range(args.repeats)]
+    import_time = min(result[0] for result in results)
+    total_time = min(result[1] for result in results)
+    heavy_modules = results[-1][2]
+    print(
+        f"Import: {import_time:.3f} s, startup: {total_time:.3f} s, "
+        f"heavy modules imported: {heavy_modules or 'none'}"
+    )
+
+    log_file = Path(args.log_file)
+    new_log = not log_file.is_file()
+    with open(log_file, "a", newline="") as file:
+        writer = csv.writer(file)
+        if new_log:
+            writer.writerow(
+                ["date", "revision", "import_s", "startup_s", "heavy_modules"]
+            )
+        writer.writerow(
+            [
+                datetime.datetime.now().isoformat(timespec="seconds"),
+                get_git_revision(),
+                f"{import_time:.4f}",
+                f"{total_time:.4f}",
+                heavy_modules,
+            ]
+        )
+
+
+if __name__ == "__main__":
+    main()